@@ -0,0 +1,141 @@
+"""
+The on-disk catalog of focal_mech.io.catalog on a synthetic phase file,
+its events in random order: the ingest, appending the same file again,
+appending it with the picks of some events changed, and the fit of the
+events whose picks changed, with fit_catalog.
+
+Each stage checks the catalog, the picks read back by open_catalog are
+those of the phase file, the unchanged events are not appended again
+and fit_catalog only touches the rows of the changed events.
+
+    python bench_catalog.py [num_events] [num_changed]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from numpy import isnan, sort, argsort, concatenate
+from numpy.random import RandomState
+
+from focal_mech.io.catalog import (ingest_phase_file, open_catalog,
+                                   latest_rows, fit_catalog)
+
+from synthetic_catalog import synthetic_catalog, write_phase_file
+
+
+def shuffle_events(block, rng):
+    """
+    The block with its events in a random order, and random ids.
+    """
+    order = rng.permutation(len(block.event))
+    picks = concatenate([block.picks[block.offsets[k]:block.offsets[k+1]]
+                         for k in order])
+    offsets = block.offsets.copy()
+    offsets[1:] = (block.offsets[1:] - block.offsets[:-1])[order].cumsum()
+    event = rng.choice(10 * len(order), len(order), replace=False)
+
+    return block._replace(event=event, time=block.time[order],
+                          offsets=offsets, picks=picks)
+
+def change_events(block, num_changed, rng):
+    """
+    The block with the polarity of the first pick of num_changed
+    random events flipped, and the ids of those events.
+    """
+    changed = rng.choice(len(block.event), num_changed, replace=False)
+    picks = block.picks.copy()
+    first = block.offsets[changed]
+    picks['polarity'][first] = -picks['polarity'][first]
+
+    return block._replace(picks=picks), block.event[changed]
+
+def check_picks(columns, block):
+    """
+    The latest rows of the catalog hold the picks of block.
+    """
+    rows = latest_rows(columns)
+    assert (columns["event"][rows] == sort(block.event)).all()
+
+    offsets = columns["offsets"]
+    for row, k in zip(rows, argsort(block.event)):
+        stored = columns["polarity"][offsets[row]:offsets[row+1]]
+        picks = block.picks[block.offsets[k]:block.offsets[k+1]]
+        assert (stored == picks['polarity']).all()
+        for name in ("station", "azimuth", "takeoff"):
+            assert (columns[name][offsets[row]:offsets[row+1]] ==
+                    picks[name]).all()
+
+def _fits(columns):
+    """
+    The spectra of the latest row of each event, keyed by event.
+    """
+    rows = latest_rows(columns)
+    return dict(zip(columns["event"][rows], columns["alm"][rows].copy()))
+
+def _same(a, b):
+    return ((a == b) | (isnan(a) & isnan(b))).all()
+
+def main(num_events=1000, num_changed=10):
+    rng = RandomState(0)
+    block, _ = synthetic_catalog(num_events, seed=0)
+    block = shuffle_events(block, rng)
+    changed_block, changed = change_events(block, num_changed, rng)
+
+    directory = tempfile.mkdtemp()
+    catalog = os.path.join(directory, "catalog")
+    filename = os.path.join(directory, "events.phase")
+    changed_filename = os.path.join(directory, "changed.phase")
+
+    def timed(name, func, *args, **kwargs):
+        start = time.time()
+        result = func(*args, **kwargs)
+        elapsed = time.time() - start
+        print("%-20s %10d %10.3f %12.0f" % (name, result, elapsed,
+                                            result / elapsed))
+        return result
+
+    try:
+        write_phase_file(filename, block)
+        write_phase_file(changed_filename, changed_block)
+
+        print("%d events, %d changed" % (num_events, num_changed))
+        print("%-20s %10s %10s %12s" % ("stage", "events", "seconds",
+                                        "events / s"))
+
+        assert timed("ingest", ingest_phase_file, catalog,
+                     filename) == num_events
+        check_picks(open_catalog(catalog), block)
+
+        assert timed("append unchanged", ingest_phase_file, catalog,
+                     filename) == 0
+        assert len(open_catalog(catalog)["event"]) == num_events
+
+        assert timed("fit", fit_catalog, catalog, processes=1,
+                     solver='explicit') == num_events
+        before = _fits(open_catalog(catalog))
+
+        assert timed("append changed", ingest_phase_file, catalog,
+                     changed_filename) == num_changed
+        columns = open_catalog(catalog)
+        assert len(columns["event"]) == num_events + num_changed
+        check_picks(columns, changed_block)
+
+        assert timed("refit changed", fit_catalog, catalog, processes=1,
+                     solver='explicit') == num_changed
+        assert fit_catalog(catalog, processes=1, solver='explicit') == 0
+
+        # only the rows of the changed events were fit
+        columns = open_catalog(catalog)
+        rows = latest_rows(columns)
+        assert (columns["fit_digest"][rows] == columns["digest"][rows]).all()
+        after = _fits(columns)
+        for event in before:
+            if event not in changed:
+                assert _same(before[event], after[event])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
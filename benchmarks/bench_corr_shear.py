@@ -0,0 +1,108 @@
+"""
+Compare the starting points of corr_shear: the original 1000 point scan
+evaluated one rotation at a time, the vectorized scan, the lookup table
+of rotated templates, and the analytic initializer from the principal
+axes of the quadrupole tensor. Then corr_shear_batch, all the events
+at once.
+
+Reports the time per event and how far the final correlation falls
+short of the best found by any method, on synthetic double couples
+with noisy polarities.
+
+    python bench_corr_shear.py [num_events]
+"""
+import sys
+import time
+
+from numpy import (array, pi, mgrid, argmin, sin, cos, arccos, sign, dot,
+                   zeros)
+from numpy.linalg import qr
+from numpy.random import RandomState
+from scipy.optimize import minimize
+
+from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
+from focal_mech.lib.correlate import (_corr_shear, _scan_shear,
+                                      _analytic_shear, corr_shear_batch)
+from focal_mech.lib.rotation_table import load_shear_table, table_shear
+
+
+def synthetic_spectra(num_events, num_picks=40, noise=0.1, seed=0):
+    """
+    Spectra of random double couples, classified from num_picks
+    polarities with a fraction noise of them flipped.
+    """
+    rng = RandomState(seed)
+
+    spectra = []
+    for _ in range(num_events):
+        azimuth = rng.uniform(0, 2*pi, num_picks)
+        takeoff = arccos(rng.uniform(-1, 1, num_picks))
+        x = cos(azimuth)*sin(takeoff)
+        y = sin(azimuth)*sin(takeoff)
+        z = cos(takeoff)
+
+        # the 2xz double couple in a random frame
+        q, _ = qr(rng.randn(3, 3))
+        rotated = dot(array([x, y, z]).T, q)
+        polarity = sign(rotated[:,0] * rotated[:,2])
+        polarity[rng.uniform(size=num_picks) < noise] *= -1
+
+        # enforce the parity, as hash_to_classifier does
+        result = classify(array([x, -x]), array([y, -y]),
+                          array([z, -z]), array([polarity, polarity]))
+        Alm = translate_to_sphharm(*result)
+        spectra.append(Alm)
+
+    return spectra
+
+def _loop_scan(alm):
+    # the original scan, one WignerD2 per grid point
+    X, Y, Z = mgrid[0:2*pi:10j, 0:pi:10j, 0:2*pi:10j]
+    x0s = list(zip(X.ravel(), Y.ravel(), Z.ravel()))
+    res = [_corr_shear(x0, alm) for x0 in x0s]
+    return x0s[argmin(res)]
+
+def _fit(alm, init):
+    x0 = init(alm)
+    f = lambda x : _corr_shear(x, alm)
+    return minimize(f, x0=x0, bounds=((0,2*pi), (0,pi), (0,2*pi))).fun
+
+def main(num_events=50):
+    spectra = synthetic_spectra(num_events)
+    alms = [array([Alm[2,m] for m in range(-2,3)]) for Alm in spectra]
+
+    # built or mapped outside of the timings
+    table = load_shear_table()
+
+    methods = [("loop scan, 10^3", _loop_scan),
+               ("vectorized scan, 10^3", lambda alm: _scan_shear(alm, 10)),
+               ("vectorized scan, 20^3", lambda alm: _scan_shear(alm, 20)),
+               ("table, %d" % len(table[0]),
+                lambda alm: table_shear(alm, table)),
+               ("analytic", _analytic_shear)]
+
+    batch = [("batch, table", "table"), ("batch, analytic", "analytic")]
+
+    scores = zeros((len(methods) + len(batch), num_events))
+    timings = []
+    for k, (name, init) in enumerate(methods):
+        start = time.time()
+        for j, alm in enumerate(alms):
+            scores[k,j] = -_fit(alm, init)
+        timings.append((time.time() - start) / num_events)
+
+    for k, (name, init) in enumerate(batch):
+        start = time.time()
+        _, scores[len(methods)+k], _ = corr_shear_batch(array(alms),
+                                                        init=init,
+                                                        table=table)
+        timings.append((time.time() - start) / num_events)
+
+    best = scores.max(axis=0)
+    print("%-24s %12s %14s" % ("init", "ms / event", "max shortfall"))
+    for k, (name, _) in enumerate(methods + batch):
+        shortfall = ((best - scores[k]) / best).max()
+        print("%-24s %12.3f %14.2e" % (name, 1e3*timings[k], shortfall))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
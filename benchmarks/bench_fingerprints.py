@@ -0,0 +1,115 @@
+"""
+Clustering a catalog by mechanism type with the rotation invariant
+fingerprints of focal_mech.lib.fingerprints and mini-batch k-means.
+
+The scale run: the spectra of x.M.x for random moment tensors of a few
+types, see CLASSES, each at random orientations and with noise added to
+the spectra, up to 1M events. The fit run: the spectra of fit_batch
+on a synthetic catalog of the same types, not timed. Both report the
+purity of the clusters, the fraction of the events in the majority
+type of their cluster, of the fingerprints against the raw spectra.
+
+    python bench_fingerprints.py [num_events] [num_fit]
+"""
+import sys
+import time
+
+from numpy import zeros, concatenate, bincount, isnan, eye, trace, sqrt, pi
+from numpy.linalg import lstsq
+from numpy.random import RandomState
+
+from focal_mech.lib.sph_harm import real_to_complex, complex_to_real
+from focal_mech.lib.correlate import quadrupole_tensor
+from focal_mech.lib.fingerprints import fingerprints, kmeans
+from focal_mech.lib.batch import fit_batch
+from focal_mech.util.hash_routines import hash_to_batch
+
+from synthetic_catalog import moment_tensors, synthetic_catalog
+
+
+# (DC, CLVD, ISO) weights of each type
+CLASSES = [(1.0, 0.0, 0.0), (0.6, 0.8, 0.0), (0.0, 1.0, 0.0),
+           (0.7, 0.0, 0.7)]
+
+def _quadrupole_basis():
+    # the traceless tensors of the real coefficients of degree 2
+    basis = zeros((5, 9))
+    basis[:,4:] = eye(5)
+    return quadrupole_tensor(real_to_complex(basis)[:,4:]).reshape(5, 9)
+
+_QUADRUPOLE = _quadrupole_basis()
+
+def tensor_spectra(M):
+    """
+    The dense spectra, up to degree 2, of x.M.x on the sphere.
+    """
+    N = len(M)
+    iso = trace(M, axis1=-2, axis2=-1) / 3.0
+    deviatoric = (M - iso[:,None,None] * eye(3)).reshape(N, 9)
+
+    c = zeros((N, 9))
+    # x.x = 1 = sqrt(4 pi) Y_00
+    c[:,0] = iso * sqrt(4 * pi)
+    c[:,4:] = lstsq(_QUADRUPOLE.T, deviatoric.T, rcond=None)[0].T
+    return real_to_complex(c)
+
+def typed_tensors(num_events, rng):
+    labels = rng.randint(0, len(CLASSES), num_events)
+    M = zeros((num_events, 3, 3))
+    for k, mix in enumerate(CLASSES):
+        members = (labels == k).nonzero()[0]
+        M[members] = moment_tensors(len(members), mix, rng)
+    return M, labels
+
+def purity(clusters, labels, num_clusters):
+    counts = bincount(clusters * len(CLASSES) + labels,
+                      minlength=num_clusters * len(CLASSES))
+    majority = counts.reshape(num_clusters, -1).max(axis=-1)
+    return majority.sum() / float(len(labels))
+
+def run(name, alm, labels, num_clusters):
+    start = time.time()
+    features = fingerprints(alm)
+    prints = time.time() - start
+
+    start = time.time()
+    _, clusters, _ = kmeans(features, num_clusters)
+    cluster = time.time() - start
+
+    # the raw real coefficients, normalized, for comparison
+    raw = complex_to_real(alm)
+    raw = raw / sqrt((raw**2).sum(axis=-1))[:,None]
+    _, raw_clusters, _ = kmeans(raw, num_clusters)
+
+    print("%-10s %10d %14.2f %10.2f %18.3f %14.3f" % (
+        name, len(alm), prints, cluster,
+        purity(clusters, labels, num_clusters),
+        purity(raw_clusters, labels, num_clusters)))
+
+def main(num_events=1000000, num_fit=20000):
+    rng = RandomState(0)
+    # CLVD and isotropic parts of either sign
+    num_clusters = 2 * len(CLASSES)
+
+    print("%-10s %10s %14s %10s %18s %14s" % (
+        "spectra", "events", "fingerprints s", "kmeans s",
+        "fingerprint purity", "raw purity"))
+
+    M, labels = typed_tensors(num_events, rng)
+    alm = tensor_spectra(M)
+    noise = real_to_complex(rng.standard_normal(alm.shape))
+    alm += 0.1 * sqrt((abs(alm)**2).sum(axis=-1))[:,None] * noise
+    run("x.M.x", alm, labels, num_clusters)
+
+    spectra, types = [], []
+    for k, mix in enumerate(CLASSES):
+        block, _ = synthetic_catalog(num_fit // len(CLASSES), mix=mix,
+                                     noise=0.05, seed=k)
+        a, _ = fit_batch(hash_to_batch(block))
+        valid = ~isnan(a).any(axis=-1)
+        spectra.append(a[valid])
+        types.append(k + zeros(valid.sum(), dtype=int))
+    run("fit", concatenate(spectra), concatenate(types), num_clusters)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
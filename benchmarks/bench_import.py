@@ -0,0 +1,64 @@
+"""
+The time to import focal_mech and its modules in a fresh interpreter,
+as a short lived batch worker does, and which of the heavy optional
+dependencies each one loads. For comparison, the time to import the
+dependencies loaded lazily, when the modes needing them are used.
+
+    python bench_import.py [repeats]
+"""
+import os
+import sys
+import json
+import subprocess
+
+
+MODULES = ["focal_mech",
+           "focal_mech.io.read_hash",
+           "focal_mech.lib.classify_mechanism",
+           "focal_mech.lib.correlate",
+           "focal_mech.lib.batch",
+           "focal_mech.lib.realizations",
+           "focal_mech.lib.nodal",
+           "focal_mech.lib.planes"]
+
+LAZY = ["sklearn.svm", "scipy.optimize", "scipy.special"]
+
+HEAVY = ["scipy", "sklearn", "matplotlib", "mplstereonet", "obspy"]
+
+_SCRIPT = """
+import sys, time, json
+start = time.time()
+import %s
+seconds = time.time() - start
+heavy = sorted(set(m.split('.')[0] for m in sys.modules) & set(%r))
+print(json.dumps([seconds, heavy]))
+"""
+
+def time_import(module):
+    """
+    The seconds to import module in a fresh interpreter, and the heavy
+    dependencies it loaded.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+
+    output = subprocess.check_output(
+        [sys.executable, "-c", _SCRIPT % (module, HEAVY)], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def main(repeats=5):
+    print("%-36s %10s   %s" % ("import", "best ms", "heavy dependencies"))
+    for module in MODULES + LAZY:
+        try:
+            times = [time_import(module) for _ in range(repeats)]
+        except subprocess.CalledProcessError:
+            print("%-36s %10s" % (module, "missing"))
+            continue
+        heavy = times[0][1]
+        print("%-36s %10.1f   %s" % (module,
+                                     1e3 * min(t[0] for t in times),
+                                     ", ".join(heavy) or "-"))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,95 @@
+"""
+The latency of a single pick update: picks of an event arrive one at a
+time, then each is flipped and flipped back. Each update is either fit
+from scratch with fit_event, or incrementally with EventFit.
+
+    python bench_incremental.py [num_picks]
+"""
+import sys
+import time
+
+from numpy import array, median, percentile
+
+from focal_mech.lib.batch import fit_event
+from focal_mech.lib.incremental import EventFit
+from focal_mech.util.hash_routines import hash_to_classifier
+
+from bench_realizations import double_couple_picks
+
+
+def _scratch(solver, initial):
+    """
+    An update refitting all the picks with fit_event.
+    """
+    picks = dict(enumerate(initial))
+
+    def update(key, pick):
+        picks[key] = pick
+        data = array([picks[k] for k in sorted(picks)])
+        inputs = hash_to_classifier({0: data})[0]
+        return fit_event(0, inputs, solver=solver)
+
+    return update
+
+def _incremental(initial):
+    """
+    An update of EventFit.
+    """
+    fit = EventFit(0)
+    polarity = {}
+    for key, pick in enumerate(initial):
+        fit.add_pick(key, *pick, refit=False)
+        polarity[key] = pick[2]
+
+    def update(key, pick):
+        if key in polarity and polarity[key] != pick[2]:
+            result = fit.flip_pick(key)
+        else:
+            result = fit.add_pick(key, *pick)
+        polarity[key] = pick[2]
+        return result
+
+    return update
+
+def _updates(data, first):
+    """
+    The (key, pick) of each update, the picks from first on arriving
+    one at a time.
+    """
+    updates = [(k, data[k]) for k in range(first, len(data))]
+    for k, pick in enumerate(data):
+        flipped = array(pick)
+        flipped[2] = -flipped[2]
+        updates += [(k, flipped), (k, pick)]
+    return updates
+
+def main(num_picks=40):
+    data = double_couple_picks(num_picks)
+
+    # the picks are there from the start until both polarities are
+    first = max((data[:,2] > 0).argmax(), (data[:,2] < 0).argmax()) + 1
+    initial = data[:first-1]
+    updates = _updates(data, first-1)
+    num_arrivals = num_picks - first + 1
+
+    print("%d updates of an event of %d picks" % (len(updates), num_picks))
+    print("%-36s %12s %12s %12s" % ("update", "median ms", "p95 ms",
+                                    "max ms"))
+    for name, update in [("fit_event, svc", _scratch('svc', initial)),
+                         ("fit_event, explicit",
+                          _scratch('explicit', initial)),
+                         ("EventFit", _incremental(initial))]:
+        latency = []
+        for key, pick in updates:
+            start = time.time()
+            update(key, pick)
+            latency.append(1e3 * (time.time() - start))
+
+        for kind, part in [("arrivals", latency[:num_arrivals]),
+                           ("flips", latency[num_arrivals:])]:
+            print("%-36s %12.2f %12.2f %12.2f" % (
+                "%s, %s" % (name, kind), median(part),
+                percentile(part, 95), max(part)))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,287 @@
+"""
+End to end timings of each stage of the fit on synthetic catalogs, see
+synthetic_catalog, from 10 to 1M events. The results are written as
+JSON, to track the hot paths across versions.
+
+The loop pipeline is the fit of the demos, one event at a time:
+iter_demo, hash_to_classifier, classify, translate_to_sphharm,
+corr_shear and rendering on the grid of get_sph_harm_grid. It is timed
+on at most --max-loop events of each catalog, and scaled to the size of
+the catalog.
+
+The batch pipeline fits the whole catalog, --chunk events at a time:
+read_phase_columns, the packed picks of hash_to_batch, fit_batch,
+corr_shear_batch and render_mechanisms. The parse is timed on at most
+--max-parse events, writing the phase files is not timed. With
+--weighted the picks are weighted by their quality and uncertainties,
+see pick_weights, in hash_to_batch.
+
+With --instrument the metrics of focal_mech.lib.instrument, the
+optimizer iterations, support vectors and so on, are added to the JSON.
+
+    python bench_pipeline.py [--sizes 10 100 1000] [--output FILE]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import datetime
+import subprocess
+from functools import partial
+from collections import OrderedDict
+
+import numpy
+from numpy import zeros, repeat, arange, diff, isnan, newaxis
+
+from focal_mech.io.read_hash import iter_demo, read_phase_columns
+from focal_mech.util.hash_routines import (hash_to_classifier, hash_to_batch,
+                                           pick_weights)
+from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
+from focal_mech.lib.correlate import corr_shear, corr_shear_batch
+from focal_mech.lib.sph_harm import (Alm_to_array, complex_to_real,
+                                     render_mechanisms, get_sph_harm_grid)
+from focal_mech.lib.rotation_table import load_shear_table
+from focal_mech.lib.batch import fit_batch
+from focal_mech.lib import instrument
+
+from synthetic_catalog import synthetic_catalog, write_phase_file
+
+
+LOOP_STAGES = ["parse", "hash_to_classifier", "classify",
+               "translate_to_sphharm", "corr_shear", "render"]
+
+BATCH_STAGES = ["parse", "hash_to_batch", "fit_batch", "corr_shear_batch",
+                "render"]
+
+def _two_polarities(block):
+    # there is no fit of an event with a single polarity
+    counts = diff(block.offsets)
+    owner = repeat(arange(len(counts)), counts)
+    up = zeros(len(counts), dtype=int)
+    numpy.add.at(up, owner, block.picks['polarity'] > 0)
+    return (up > 0) & (up < counts)
+
+def time_loop(block, filename, solver, resolution):
+    """
+    The seconds of each stage of the loop pipeline, and the number of
+    events fit.
+    """
+    write_phase_file(filename, block)
+    seconds = OrderedDict((stage, 0.0) for stage in LOOP_STAGES)
+
+    start = time.time()
+    events = list(iter_demo(filename))
+    seconds["parse"] = time.time() - start
+
+    valid = _two_polarities(block)
+    events = [item for item, ok in zip(events, valid) if ok]
+
+    start = time.time()
+    inputs = hash_to_classifier(dict(events))
+    seconds["hash_to_classifier"] = time.time() - start
+
+    for event, _ in events:
+        start = time.time()
+        result = classify(*inputs[event], kernel_degree=2, solver=solver)
+        seconds["classify"] += time.time() - start
+
+        start = time.time()
+        Alm = translate_to_sphharm(*result, kernel_degree=2)
+        seconds["translate_to_sphharm"] += time.time() - start
+
+        start = time.time()
+        corr_shear(Alm)
+        seconds["corr_shear"] += time.time() - start
+
+        start = time.time()
+        render_mechanisms(Alm_to_array(Alm)[newaxis], resolution)
+        seconds["render"] += time.time() - start
+
+    return seconds, len(events)
+
+def time_batch(block, filename, parse, resolution, table, weight=None):
+    """
+    The seconds of each stage of the batch pipeline on a chunk of a
+    catalog, the parse only if parse is True.
+    """
+    seconds = OrderedDict((stage, 0.0) for stage in BATCH_STAGES)
+
+    if parse:
+        write_phase_file(filename, block)
+        start = time.time()
+        block = read_phase_columns(filename)
+        seconds["parse"] = time.time() - start
+
+    start = time.time()
+    batch = hash_to_batch(block, weight=weight)
+    seconds["hash_to_batch"] = time.time() - start
+
+    start = time.time()
+    alm, _ = fit_batch(batch)
+    seconds["fit_batch"] = time.time() - start
+
+    valid = ~isnan(alm).any(axis=-1)
+    alm = alm[valid]
+
+    start = time.time()
+    corr_shear_batch(complex_to_real(alm)[:,4:], init='table', table=table,
+                     basis='real')
+    seconds["corr_shear_batch"] = time.time() - start
+
+    start = time.time()
+    render_mechanisms(alm, resolution)
+    seconds["render"] = time.time() - start
+
+    return seconds, int(valid.sum())
+
+def _git_version():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=root,
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _result(size, pipeline, stage, num_timed, seconds):
+    return OrderedDict([("events", size), ("pipeline", pipeline),
+                        ("stage", stage), ("events_timed", num_timed),
+                        ("seconds", seconds),
+                        ("events_per_second",
+                         num_timed / seconds if seconds > 0 else None),
+                        ("scaled_seconds",
+                         seconds * size / num_timed if num_timed else None)])
+
+def run(args):
+    """
+    The results of each catalog size, pipeline and stage.
+    """
+    catalog = dict(num_picks=tuple(args.picks) if len(args.picks) > 1
+                   else args.picks[0],
+                   mix=tuple(args.mix), geometry=args.geometry,
+                   num_stations=args.stations, noise=args.noise)
+    resolution = tuple(args.resolution)
+    weight = None
+    if args.weighted:
+        weight = partial(pick_weights, angle_error=10.0)
+
+    # loaded outside of the timings
+    table = load_shear_table()
+    get_sph_harm_grid(resolution)
+
+    fd, filename = tempfile.mkstemp(suffix=".phase")
+    os.close(fd)
+
+    results = []
+    try:
+        for size in args.sizes:
+            if args.max_loop > 0:
+                block, _ = synthetic_catalog(min(size, args.max_loop),
+                                             seed=args.seed, **catalog)
+                seconds, num_fit = time_loop(block, filename, args.solver,
+                                             resolution)
+                timed = dict(parse=len(block.event),
+                             hash_to_classifier=num_fit)
+                for stage in LOOP_STAGES:
+                    results.append(_result(size, "loop", stage,
+                                           timed.get(stage, num_fit),
+                                           seconds[stage]))
+
+            seconds = OrderedDict((stage, 0.0) for stage in BATCH_STAGES)
+            timed = dict((stage, 0) for stage in BATCH_STAGES)
+            for first in range(0, size, args.chunk):
+                num = min(args.chunk, size - first)
+                block, _ = synthetic_catalog(num, seed=args.seed + first,
+                                             first_event=first + 1,
+                                             **catalog)
+                parse = timed["parse"] < args.max_parse
+                chunk, num_fit = time_batch(block, filename, parse,
+                                            resolution, table, weight)
+                for stage in BATCH_STAGES:
+                    seconds[stage] += chunk[stage]
+                timed["parse"] += num if parse else 0
+                timed["hash_to_batch"] += num
+                timed["fit_batch"] += num
+                timed["corr_shear_batch"] += num_fit
+                timed["render"] += num_fit
+
+            for stage in BATCH_STAGES:
+                results.append(_result(size, "batch", stage, timed[stage],
+                                       seconds[stage]))
+    finally:
+        os.remove(filename)
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time each stage of the fit on synthetic catalogs.")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 1000, 10000],
+                        help="the numbers of events, up to 1000000")
+    parser.add_argument("--picks", type=int, nargs="+", default=[40],
+                        help="the picks of each event, or a low and high")
+    parser.add_argument("--mix", type=float, nargs=3,
+                        default=[1.0, 0.0, 0.0],
+                        metavar=("DC", "CLVD", "ISO"))
+    parser.add_argument("--geometry", default="network",
+                        choices=["network", "uniform"])
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.1,
+                        help="the fraction of the polarities flipped")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solver", default="explicit",
+                        choices=["explicit", "svc"])
+    parser.add_argument("--resolution", type=int, nargs=2, default=[25, 25])
+    parser.add_argument("--chunk", type=int, default=10000)
+    parser.add_argument("--weighted", action="store_true",
+                        help="weight the picks, see pick_weights")
+    parser.add_argument("--max-loop", type=int, default=200)
+    parser.add_argument("--max-parse", type=int, default=20000)
+    parser.add_argument("--instrument", action="store_true",
+                        help="add the summary of focal_mech.lib.instrument")
+    parser.add_argument("--output", default="bench_pipeline.json",
+                        help="the JSON results, - for stdout")
+    args = parser.parse_args(argv)
+
+    recorder = None
+    if args.instrument:
+        recorder = instrument.Recorder(per_event=False)
+    previous = instrument.set_recorder(recorder)
+    try:
+        results = run(args)
+    finally:
+        instrument.set_recorder(previous)
+
+    print("%10s %-6s %-22s %8s %10s %12s %12s" % (
+        "events", "", "stage", "timed", "seconds", "events / s",
+        "scaled s"))
+    for r in results:
+        print("%10d %-6s %-22s %8d %10.3f %12.0f %12.2f" % (
+            r["events"], r["pipeline"], r["stage"], r["events_timed"],
+            r["seconds"], r["events_per_second"] or 0,
+            r["scaled_seconds"] or 0))
+
+    report = OrderedDict([
+        ("benchmark", "pipeline"),
+        ("date", datetime.datetime.utcnow().isoformat()),
+        ("version", _git_version()),
+        ("python", platform.python_version()),
+        ("numpy", numpy.__version__),
+        ("machine", platform.machine()),
+        ("config", vars(args)),
+        ("results", results)])
+    if recorder is not None:
+        report["instrument"] = recorder.summary()
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=1)
+    else:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=1)
+
+if __name__ == "__main__":
+    main()
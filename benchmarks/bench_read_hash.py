@@ -0,0 +1,83 @@
+"""
+Compare the parse throughput of the HASH phase file readers: the line
+at a time parse_phase_file and iter_phase_file, and the block reader
+read_phase_columns, on a synthetic phase file.
+
+    python bench_read_hash.py [num_picks] [picks_per_event]
+"""
+import os
+import sys
+import time
+import tempfile
+
+from numpy import concatenate
+from numpy.random import RandomState
+
+from focal_mech.io.read_hash import (parse_phase_file, iter_phase_file,
+                                     read_phase_columns)
+
+
+def write_phase_file(filename, num_picks, picks_per_event=40, seed=0):
+    """
+    A phase file of random picks, in the format read by
+    focal_mech.io.read_hash.
+    """
+    rng = RandomState(seed)
+
+    stations = ["%s%02d" % (net, k) for net in "ABCDE" for k in range(40)]
+
+    with open(filename, "w") as fp:
+        event = 3146815
+        for start in range(0, num_picks, picks_per_event):
+            n = min(picks_per_event, num_picks - start)
+
+            second = rng.randint(6000)
+            header = "%02d%02d%02d%02d%02d%04d" % (94, 1, 17, 12, 30, second)
+            fp.write(header.ljust(122) + "%16d\n" % event)
+
+            for k in range(n):
+                fp.write("%-4s  %1s%1d%s%4d%3d%s%3d%4d%4d\n" %
+                         (stations[rng.randint(len(stations))],
+                          "UD"[rng.randint(2)], rng.randint(2), " "*50,
+                          rng.randint(10000), rng.randint(180), " "*10,
+                          rng.randint(360), 5, 10))
+
+            fp.write(" "*60 + "%10d\n" % event)
+            event += 1
+
+def main(num_picks=1000000, picks_per_event=40):
+    fd, filename = tempfile.mkstemp(suffix=".phase")
+    os.close(fd)
+
+    try:
+        write_phase_file(filename, num_picks, picks_per_event)
+        size = os.path.getsize(filename) / 1e6
+
+        def line_reader():
+            events = list(iter_phase_file(filename))
+            return concatenate([event.picks for event in events])
+
+        readers = [("parse_phase_file", lambda: parse_phase_file(filename)),
+                   ("iter_phase_file", line_reader),
+                   ("read_phase_columns",
+                    lambda: read_phase_columns(filename).picks)]
+
+        print("%d picks, %.1f MB" % (num_picks, size))
+        print("%-20s %10s %14s %10s" % ("reader", "seconds", "picks / s",
+                                        "MB / s"))
+        results = []
+        for name, reader in readers:
+            start = time.time()
+            results.append(reader())
+            elapsed = time.time() - start
+            print("%-20s %10.2f %14.0f %10.1f" % (name, elapsed,
+                                                 num_picks / elapsed,
+                                                 size / elapsed))
+
+        # the readers agree
+        assert (results[1] == results[2]).all()
+    finally:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
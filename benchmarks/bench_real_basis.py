@@ -0,0 +1,92 @@
+"""
+Compare the complex and the real spherical harmonic basis: the memory
+and time to render radiation patterns over a large grid, and the time
+of the batched double couple search, corr_shear_batch.
+
+    python bench_real_basis.py [num_events] [Nlong] [Nlati]
+"""
+import sys
+import time
+
+from numpy import float32, float64, abs, dot
+from numpy.random import RandomState
+
+from focal_mech.lib.sph_harm import (get_sph_harm, get_sph_harm_grid,
+                                     render_mechanisms, complex_to_real,
+                                     real_to_complex, sph_harm_modes)
+from focal_mech.lib.correlate import corr_shear_batch
+from focal_mech.lib.rotation_table import load_shear_table
+
+
+def random_spectra(num_events, lmax=2, seed=0):
+    """
+    Dense spectra of random real functions, real coefficients drawn
+    then taken to the complex basis.
+    """
+    rng = RandomState(seed)
+    coeffs = rng.randn(num_events, (lmax+1)**2)
+    return real_to_complex(coeffs)
+
+def _time(f, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.time()
+        result = f()
+        best = min(best, time.time() - start)
+    return best, result
+
+def main(num_events=1000, Nlong=200, Nlati=400):
+    resolution = (Nlong, Nlati)
+    alm = random_spectra(num_events)
+    coeffs = complex_to_real(alm)
+
+    # the grids are built and cached outside of the timings
+    _, _, Z = get_sph_harm(resolution)
+    grids = [("complex128", Z)]
+    for dtype in (float64, float32):
+        _, _, S = get_sph_harm_grid(resolution, 2, dtype)
+        grids.append((S.dtype.name, S))
+
+    complex_time, reference = _time(lambda: dot(alm, Z).real)
+    real_time, double = _time(lambda: render_mechanisms(coeffs, resolution,
+                                                        basis='real'))
+    single_time, single = _time(lambda: render_mechanisms(coeffs, resolution,
+                                                          dtype=float32,
+                                                          basis='real'))
+
+    print("render %d events over a %dx%d grid" % (num_events, Nlong, Nlati))
+    print("%-24s %10s %10s %12s" % ("basis", "grid MB", "seconds",
+                                    "max error"))
+    print("%-24s %10.1f %10.3f %12s" % ("complex, alm.dot(Z).real",
+                                        Z.nbytes / 1e6, complex_time, "-"))
+    print("%-24s %10.1f %10.3f %12.2e" % ("real, float64",
+                                          grids[1][1].nbytes / 1e6,
+                                          real_time,
+                                          abs(double - reference).max()))
+    print("%-24s %10.1f %10.3f %12.2e" % ("real, float32",
+                                          grids[2][1].nbytes / 1e6,
+                                          single_time,
+                                          abs(single - reference).max()))
+
+    # the double couple search, on the quadrupole
+    l, m = sph_harm_modes(2)
+    quadrupole = l == 2
+    table = load_shear_table()
+
+    print("")
+    print("corr_shear_batch, %d events" % num_events)
+    print("%-24s %10s %10s %12s" % ("init", "complex", "real",
+                                    "score diff"))
+    for init in ("table", "analytic"):
+        complex_time, (_, complex_score, _) = _time(
+            lambda: corr_shear_batch(alm[:,quadrupole], init=init,
+                                     table=table))
+        real_time, (_, real_score, _) = _time(
+            lambda: corr_shear_batch(coeffs[:,quadrupole], init=init,
+                                     table=table, basis='real'))
+        print("%-24s %10.3f %10.3f %12.2e" % (
+            init, complex_time, real_time,
+            abs(complex_score - real_score).max()))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,72 @@
+"""
+Time the realizations of an event: refitting each realization with
+classify and corr_shear, against realize_event, which fits the
+realizations as one stack and warm starts their double couple
+searches.
+
+    python bench_realizations.py [num_realizations] [num_picks] [processes]
+"""
+import sys
+import time
+
+from numpy import c_, cos, sin, arccos, sign, pi, dot
+from numpy.linalg import qr, det
+from numpy.random import RandomState
+
+from focal_mech.lib.realizations import (realize_event, perturb_picks,
+                                         rotation_angle)
+from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
+from focal_mech.lib.correlate import corr_shear
+from focal_mech.util.hash_routines import hash_to_classifier
+
+
+def double_couple_picks(num_picks, seed=0):
+    """
+    Picks of a random double couple, at random azimuths and takeoff
+    angles, in the form of read_demo.
+    """
+    rng = RandomState(seed)
+    azimuth = rng.uniform(0, 2*pi, num_picks)
+    takeoff = arccos(rng.uniform(-1, 1, num_picks))
+
+    R = qr(rng.randn(3, 3))[0]
+    R[:,0] *= sign(det(R))
+    x = c_[cos(azimuth)*sin(takeoff), sin(azimuth)*sin(takeoff),
+           cos(takeoff)]
+    polarity = sign(dot(x, R[:,1]) * dot(x, R[:,2]))
+
+    return c_[azimuth, takeoff, polarity]
+
+def main(num_realizations=1000, num_picks=40, processes=1):
+    data = double_couple_picks(num_picks)
+
+    # the loop is slow, time a few and scale
+    num_loop = min(num_realizations, 50)
+    realizations = perturb_picks(data, num_loop, rng=0)
+    inputs = hash_to_classifier(dict(enumerate(realizations)))
+
+    start = time.time()
+    for k in range(num_loop):
+        result = classify(*inputs[k], kernel_degree=2)
+        corr_shear(translate_to_sphharm(*result, kernel_degree=2))
+    loop_rate = num_loop / (time.time() - start)
+
+    start = time.time()
+    result = realize_event(0, data, num_realizations, seed=0,
+                           processes=processes)
+    engine_rate = num_realizations / (time.time() - start)
+
+    print("%d realizations of %d picks" % (num_realizations, num_picks))
+    print("%-28s %16s" % ("fit", "realizations / s"))
+    print("%-28s %16.0f" % ("classify, corr_shear loop", loop_rate))
+    print("%-28s %16.0f" % ("realize_event, %d process" % processes,
+                            engine_rate))
+    print("")
+    print("quality %s, prob %.2f, rms angle %.1f, misfit %.2f, stdr %.2f"
+          % result.quality)
+    print("median angle to the double couple %.1f degrees" % sorted(
+        rotation_angle(result.double_couple,
+                       result.solutions))[num_realizations // 2])
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
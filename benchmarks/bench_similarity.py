@@ -0,0 +1,86 @@
+"""
+The k most similar events of every event of a synthetic catalog, see
+focal_mech.lib.similarity: the blocked products of top_k against the
+ball tree of tree_top_k, on the coefficients of the spectra and on
+their rotation invariant power spectra. The spectra are fit with
+fit_batch, which is not timed.
+
+The loop is the serial comparison of demo/test5.py, one event against
+all the others, timed on a few queries and scaled.
+
+    python bench_similarity.py [num_events] [k] [block_size]
+"""
+import sys
+import time
+
+from numpy import array, isnan, concatenate, abs
+from numpy.linalg import norm
+
+from focal_mech.lib.batch import fit_batch
+from focal_mech.util.hash_routines import hash_to_batch
+from focal_mech.lib.similarity import SimilarityIndex
+
+from synthetic_catalog import synthetic_catalog
+
+
+def catalog_spectra(num_events, chunk=10000, noise=0.1):
+    spectra = []
+    for first in range(0, num_events, chunk):
+        block, _ = synthetic_catalog(min(chunk, num_events - first),
+                                     noise=noise, seed=first,
+                                     first_event=first + 1)
+        alm, _ = fit_batch(hash_to_batch(block))
+        spectra.append(alm[~isnan(alm).any(axis=-1)])
+    return concatenate(spectra)
+
+def time_loop(alm, num_queries=3):
+    start = time.time()
+    for a in alm[:num_queries]:
+        [abs(a.conjugate().dot(b)) / (norm(a) * norm(b)) for b in alm]
+    return (time.time() - start) * len(alm) / num_queries
+
+def main(num_events=100000, k=10, block_size=2**22):
+    alm = catalog_spectra(num_events)
+    N = len(alm)
+
+    print("%d events, k = %d, %.0f MB of scores per block"
+          % (N, k, 8.0 * block_size / 2**20))
+    print("%-28s %10s %12s %10s" % ("search", "build s", "query s",
+                                   "recall"))
+    print("%-28s %10s %12.1f" % ("test5.py loop, scaled", "-",
+                                 time_loop(alm)))
+
+    exact = {}
+    for invariant in (False, True):
+        name = "invariant" if invariant else "spectra"
+
+        start = time.time()
+        index = SimilarityIndex(alm, invariant=invariant,
+                                block_size=block_size)
+        build = time.time() - start
+
+        start = time.time()
+        exact[invariant] = index.top_k(k)
+        query = time.time() - start
+        print("%-28s %10.2f %12.2f %10.3f" % ("top_k, " + name, build,
+                                              query, 1.0))
+
+        try:
+            start = time.time()
+            index.tree_top_k(1, array(alm[:1]))
+            build = time.time() - start
+
+            start = time.time()
+            found, scores = index.tree_top_k(k)
+            query = time.time() - start
+        except ImportError:
+            print("%-28s %10s" % ("tree_top_k, " + name, "no sklearn"))
+            continue
+
+        # ties may swap events, compare the scores
+        recall = (abs(scores - exact[invariant][1]) < 1e-9).mean()
+        print("%-28s %10.2f %12.2f %10.3f" % ("tree_top_k, " + name, build,
+                                              query, recall))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
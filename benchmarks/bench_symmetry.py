@@ -0,0 +1,108 @@
+"""
+The fit with the parity imposed by the solver, see fit_symmetric,
+against the fit of the picks and their antipodes, as built by
+hash_to_classifier, for growing numbers of picks per event.
+
+The batch fits a synthetic catalog of about num_events * 40 picks with
+fit_batch, symmetric or not. The svc fits a single event with classify,
+the mirrored picks against parity=1 on the picks, up to max_picks.
+
+The memory of the batch is the peak of the arrays traced by
+tracemalloc. libsvm computes the kernel in its own cache, so for the
+svc it is the size of the kernel matrix, of 2n points mirrored and n
+symmetric. The differences are relative to the largest coefficient of
+each spectrum, the median and the largest over the events. The solvers
+stop at their tolerance, so the nearly degenerate fits, e.g. nearly
+isotropic, differ the most.
+
+    python bench_symmetry.py [num_events] [max_picks]
+"""
+import sys
+import time
+
+from numpy import abs, isnan, nan, median
+
+from focal_mech.util.hash_routines import (hash_to_batch,
+                                           iter_batch_to_classifier)
+from focal_mech.lib.batch import fit_batch
+from focal_mech.lib.classify_mechanism import classify, translate_to_coeffs
+
+from synthetic_catalog import synthetic_catalog
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+
+def measure(func, *args, **kwargs):
+    """
+    The result of func, its seconds, and the peak MB of a second,
+    traced, call.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    seconds = time.time() - start
+
+    peak = nan
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] / 2.0**20
+        tracemalloc.stop()
+
+    return result, seconds, peak
+
+def difference(a, b):
+    valid = ~isnan(a).any(axis=-1)
+    diff = abs(a - b)[valid].max(axis=-1) / abs(a)[valid].max(axis=-1)
+    return median(diff), diff.max()
+
+def _row(name, n, mirrored, symmetric, diff):
+    print("%-6s %6d %11.3f %11.3f %8.2f %10.1f %10.1f %9.1e %9.1e" % (
+        name, n, mirrored[1], symmetric[1], mirrored[1] / symmetric[1],
+        mirrored[2], symmetric[2], diff[0], diff[1]))
+
+def main(num_events=20000, max_picks=2000):
+    print("%-6s %6s %11s %11s %8s %10s %10s %9s %9s" % (
+        "fit", "picks", "mirrored s", "symm s", "speedup", "mirror MB",
+        "symm MB", "diff med", "diff max"))
+
+    for num_picks in (20, 80, 320, 1280):
+        block, _ = synthetic_catalog(max(1, num_events * 40 // num_picks),
+                                     num_picks, geometry='uniform',
+                                     noise=0.1, seed=num_picks)
+        batch = hash_to_batch(block)
+
+        mirrored = measure(fit_batch, batch, symmetric=False)
+        symmetric = measure(fit_batch, batch, symmetric=True)
+        _row("batch", num_picks, mirrored, symmetric,
+             difference(mirrored[0][0], symmetric[0][0]))
+
+    try:
+        # not timed
+        from sklearn import svm
+    except ImportError:
+        print("%-6s %6s" % ("svc", "no sklearn"))
+        return
+
+    num_picks = 125
+    while num_picks <= max_picks:
+        block, _ = synthetic_catalog(1, num_picks, geometry='uniform',
+                                     noise=0.1, seed=num_picks)
+        _, full = next(iter_batch_to_classifier(hash_to_batch(block)))
+        _, half = next(iter_batch_to_classifier(hash_to_batch(block, 0)))
+
+        mirrored = measure(classify, *full, solver='svc')[:2]
+        symmetric = measure(classify, *half, solver='svc', parity=1)[:2]
+        # the float64 kernel matrix
+        mirrored += (8.0 * (2 * num_picks)**2 / 2**20,)
+        symmetric += (8.0 * num_picks**2 / 2**20,)
+        _row("svc", num_picks, mirrored, symmetric,
+             difference(translate_to_coeffs(*mirrored[0])[None],
+                        translate_to_coeffs(*symmetric[0])[None]))
+        num_picks *= 2
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
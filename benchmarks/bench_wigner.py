@@ -0,0 +1,122 @@
+"""
+Timings of the Wigner-D rotations of any degree, and of the double
+couple search on the spectra of higher kernel degrees.
+
+The rotations, per rotation of a stack of angles: WignerD, the matrix
+of degree l, and rotate_spectrum, a dense spectrum up to degree l
+rotated without building the matrices, against WignerD2 for l = 2.
+
+The search: events of random double couples with a fraction of their
+polarities flipped, fit by classify with each kernel_degree, then
+corr_shear_spectrum up to that degree. The error is the Kagan angle to
+the true double couple, see rotation_angle, up to the sign of the
+polarities.
+
+    python bench_wigner.py [num_angles] [num_events] [noise]
+"""
+import sys
+import time
+
+from numpy import (arccos, median, minimum, pi, c_, cos, sin, sign, dot,
+                   stack, rad2deg, array)
+from numpy.random import RandomState
+
+from focal_mech.lib.sph_harm import (WignerD, WignerD2, rotate_spectrum,
+                                     Alm_to_array)
+from focal_mech.lib.rotation_table import euler_to_matrix
+from focal_mech.lib.correlate import corr_shear_spectrum
+from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
+from focal_mech.lib.realizations import rotation_angle
+from focal_mech.util.hash_routines import hash_to_classifier
+
+
+DEGREES = range(1, 9)
+
+KERNEL_DEGREES = [2, 3, 4, 6, 8]
+
+def best_time(f, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.time()
+        f()
+        best = min(best, time.time() - start)
+    return best
+
+def time_rotations(num_angles, rng):
+    alpha = rng.uniform(0, 2*pi, num_angles)
+    beta = arccos(rng.uniform(-1, 1, num_angles))
+    gamma = rng.uniform(0, 2*pi, num_angles)
+
+    print("%d rotations" % num_angles)
+    print("%4s %18s %26s" % ("l", "WignerD us / rot",
+                             "rotate_spectrum us / rot"))
+    for l in DEGREES:
+        alm = rng.randn((l+1)**2) + 1j * rng.randn((l+1)**2)
+        matrices = best_time(lambda: WignerD(l, alpha, beta, gamma))
+        spectra = best_time(lambda: rotate_spectrum(alm, alpha, beta, gamma))
+        print("%4d %18.2f %26.2f" % (l, 1e6 * matrices / num_angles,
+                                     1e6 * spectra / num_angles))
+
+    seconds = best_time(lambda: WignerD2(alpha, beta, gamma))
+    print("%4s %18.2f" % ("D2", 1e6 * seconds / num_angles))
+    print("")
+
+def noisy_events(num_events, num_picks, noise, rng):
+    """
+    Picks of random double couples, at random azimuths and takeoff
+    angles, with a fraction noise of the polarities flipped, and the
+    (strike, dip, rake) of each in degrees.
+    """
+    strike = rng.uniform(0, 2*pi, num_events)
+    dip = arccos(rng.uniform(-1, 1, num_events))
+    rake = rng.uniform(0, 2*pi, num_events)
+    R = euler_to_matrix(strike, dip, rake)
+
+    events = {}
+    for k in range(num_events):
+        azimuth = rng.uniform(0, 2*pi, num_picks)
+        takeoff = arccos(rng.uniform(-1, 1, num_picks))
+        x = c_[cos(azimuth)*sin(takeoff), sin(azimuth)*sin(takeoff),
+               cos(takeoff)]
+        polarity = sign(dot(x, R[k,:,1]) * dot(x, R[k,:,2]))
+        polarity[rng.random_sample(num_picks) < noise] *= -1
+        events[k] = c_[azimuth, takeoff, polarity]
+
+    return events, rad2deg(stack([strike, dip, rake], axis=-1))
+
+def time_search(num_events, noise, rng, num_picks=40):
+    events, truth = noisy_events(num_events, num_picks, noise, rng)
+    inputs = hash_to_classifier(events)
+
+    print("%d events of %d picks, %.0f%% of the polarities flipped"
+          % (num_events, num_picks, 100 * noise))
+    print("%6s %6s %12s %22s %14s" % ("degree", "modes", "classify s",
+                                      "corr_shear_spectrum s",
+                                      "median error"))
+    for degree in KERNEL_DEGREES:
+        start = time.time()
+        alm = array([Alm_to_array(translate_to_sphharm(
+            *classify(*inputs[k], kernel_degree=degree, solver='svc'),
+            kernel_degree=degree)) for k in range(num_events)])
+        fit = time.time() - start
+
+        start = time.time()
+        solution, _, _ = corr_shear_spectrum(alm)
+        search = time.time() - start
+
+        # the polarities of the correlation are up to sign, rake + 180
+        flipped = solution + [0, 0, 180]
+        error = minimum(rotation_angle(solution, truth),
+                        rotation_angle(flipped, truth))
+
+        print("%6d %6d %12.3f %22.3f %14.1f" % (degree, alm.shape[-1], fit,
+                                                 search, median(error)))
+
+def main(num_angles=10000, num_events=200, noise=0.15):
+    rng = RandomState(0)
+    time_rotations(num_angles, rng)
+    time_search(num_events, noise, rng)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]] +
+         [float(arg) for arg in sys.argv[3:4]])
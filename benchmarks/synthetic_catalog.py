@@ -0,0 +1,177 @@
+"""
+Synthetic catalogs for the benchmarks: events with mixes of double
+couple, CLVD and isotropic moment tensors, picked at a network of
+stations or uniformly over the focal sphere, with a fraction of the
+polarities flipped.
+"""
+import datetime
+
+from numpy import (array, zeros, ones, sqrt, sin, cos, arccos, arctan2,
+                   deg2rad, rad2deg, mod, around, where, einsum, cumsum,
+                   repeat, arange, argsort, minimum, eye,
+                   stack, int64)
+from numpy.random import RandomState
+
+from focal_mech.io.read_hash import PICK_DTYPE, PhaseBlock
+
+
+# the unit norm components of the moment tensors, in the frame of the
+# event, the double couple is the 2yz template of corr_shear
+_DOUBLE_COUPLE = array([[0, 0, 0], [0, 0, 1], [0, 1, 0]]) / sqrt(2.0)
+_CLVD = array([[2, 0, 0], [0, -1, 0], [0, 0, -1]]) / sqrt(6.0)
+_ISOTROPIC = eye(3) / sqrt(3.0)
+
+def random_rotations(num, rng):
+    """
+    (num, 3, 3) rotations, uniform over SO(3), from unit quaternions.
+    """
+    q = rng.standard_normal((num, 4))
+    w, x, y, z = (q / sqrt((q**2).sum(axis=-1))[:,None]).T
+
+    return stack([1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y),
+                  2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x),
+                  2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)],
+                 axis=-1).reshape(num, 3, 3)
+
+def moment_tensors(num, mix=(1.0, 0.0, 0.0), rng=None):
+    """
+    (num, 3, 3) random moment tensors, the sum of a double couple, a
+    CLVD and an isotropic part weighted by mix, each with a random
+    orientation and the last two with a random sign.
+    """
+    if not isinstance(rng, RandomState):
+        rng = RandomState(rng)
+
+    dc, clvd, iso = mix
+    R = random_rotations(num, rng)
+    M = dc * einsum('nij,jk,nlk->nil', R, _DOUBLE_COUPLE, R)
+
+    R = random_rotations(num, rng)
+    sign = where(rng.random_sample(num) < 0.5, -1.0, 1.0)[:,None,None]
+    M += clvd * sign * einsum('nij,jk,nlk->nil', R, _CLVD, R)
+
+    sign = where(rng.random_sample(num) < 0.5, -1.0, 1.0)[:,None,None]
+    M += iso * sign * _ISOTROPIC
+
+    return M
+
+def synthetic_catalog(num_events, num_picks=40, mix=(1.0, 0.0, 0.0),
+                      geometry='network', num_stations=200, aperture=200.0,
+                      noise=0.0, seed=0, first_event=1):
+    """
+    A synthetic catalog, in the columns of read_phase_columns.
+
+    Parameters:
+    -----------
+    :param num_picks: the picks of each event, or (low, high) for a
+                      uniform random number of them.
+    :param mix: the weights of the double couple, CLVD and isotropic
+                parts of the moment tensors, see moment_tensors.
+    :param geometry: 'network', a network of num_stations stations
+                     over a square of side aperture km, the events at
+                     2 to 15 km depth beneath it and the rays straight,
+                     or 'uniform', picks uniform over the focal sphere.
+    :param noise: the fraction of the polarities flipped.
+    :param seed: of the catalog.
+    :param first_event: the id of the first event.
+
+    Returns:
+    --------
+    :rtype PhaseBlock: the catalog, the angles rounded to whole degrees
+                       as in a phase file.
+    :rtype tensors: (num_events, 3, 3) the moment tensors.
+    """
+    rng = RandomState(seed)
+
+    if isinstance(num_picks, int):
+        counts = num_picks * ones(num_events, dtype=int64)
+    else:
+        counts = rng.randint(num_picks[0], num_picks[1] + 1, num_events)
+
+    if geometry == 'network':
+        counts = minimum(counts, num_stations)
+
+    tensors = moment_tensors(num_events, mix, rng)
+
+    offsets = zeros(num_events + 1, dtype=int64)
+    offsets[1:] = cumsum(counts)
+    owner = repeat(arange(num_events), counts)
+    num_total = offsets[-1]
+
+    picks = zeros(num_total, dtype=PICK_DTYPE)
+
+    if geometry == 'network':
+        stations = rng.uniform(0, aperture, (num_stations, 2))
+        epicenters = rng.uniform(0, aperture, (num_events, 2))
+        depth = rng.uniform(2.0, 15.0, num_events)
+
+        # the first counts stations of a random order, per event
+        order = argsort(rng.random_sample((num_events, num_stations)),
+                        axis=-1)
+        index = order[owner, arange(num_total) - offsets[owner]]
+
+        north, east = (stations[index] - epicenters[owner]).T
+        distance = sqrt(north**2 + east**2)
+        azimuth = mod(rad2deg(arctan2(east, north)), 360.0)
+        takeoff = rad2deg(arctan2(distance, depth[owner]))
+
+        picks['station'] = array(["S%03d" % k
+                                  for k in range(num_stations)])[index]
+        picks['distance'] = minimum(around(distance, 1), 999.9)
+    elif geometry == 'uniform':
+        azimuth = rng.uniform(0, 360.0, num_total)
+        takeoff = rad2deg(arccos(rng.uniform(-1, 1, num_total)))
+        picks['station'] = "UNI"
+    else:
+        raise Exception("Unknown geometry %s" % geometry)
+
+    picks['azimuth'] = mod(around(azimuth), 360.0)
+    picks['takeoff'] = around(takeoff)
+
+    # the takeoff angle is the colatitude, see hash_to_classifier
+    az = deg2rad(picks['azimuth'].astype(float))
+    toa = deg2rad(picks['takeoff'].astype(float))
+    x = stack([cos(az)*sin(toa), sin(az)*sin(toa), cos(toa)], axis=-1)
+    amplitude = einsum('pi,pij,pj->p', x, tensors[owner], x)
+
+    polarity = where(amplitude < 0, -1, 1)
+    flip = rng.random_sample(num_total) < noise
+    picks['polarity'] = where(flip, -polarity, polarity)
+    picks['quality'] = rng.randint(0, 2, num_total)
+    picks['takeoff_error'] = 5
+    picks['azimuth_error'] = 10
+
+    event = arange(first_event, first_event + num_events, dtype=int64)
+    # an event every minute from 2000
+    time = 946684800.0 + 60.0 * arange(num_events)
+
+    return PhaseBlock(event, time, offsets, picks), tensors
+
+def write_phase_file(filename, block):
+    """
+    Write a catalog in the format of a HASH phase file, see
+    focal_mech.io.read_hash.
+    """
+    polarity = array(["D", "U"])[(block.picks['polarity'] > 0).astype(int)]
+
+    with open(filename, "w") as fp:
+        for k, event in enumerate(block.event):
+            t = (datetime.datetime(1970, 1, 1) +
+                 datetime.timedelta(seconds=block.time[k]))
+            header = "%02d%02d%02d%02d%02d%04d" % (
+                t.year % 100, t.month, t.day, t.hour, t.minute,
+                100 * t.second + t.microsecond // 10000)
+            fp.write(header.ljust(122) + "%16d\n" % event)
+
+            lines = []
+            for p in range(block.offsets[k], block.offsets[k+1]):
+                pick = block.picks[p]
+                distance = int(round(10 * pick['distance']))
+                lines.append("%-4s  %1s%1d%s%4d%3d%s%3d%4d%4d\n" %
+                             (pick['station'].decode(), polarity[p],
+                              pick['quality'], " "*50, distance,
+                              pick['takeoff'], " "*10, pick['azimuth'],
+                              pick['takeoff_error'], pick['azimuth_error']))
+            fp.writelines(lines)
+
+            fp.write(" "*60 + "%10d\n" % event)
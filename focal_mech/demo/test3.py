@@ -3,7 +3,7 @@ from numpy import genfromtxt, rad2deg
 import matplotlib.pyplot as plt
 import mplstereonet
 
-from obspy.imaging.beachball import aux_plane
+from focal_mech.lib.planes import aux_plane
 
 from focal_mech.io.read_hash import read_demo, read_hash_solutions
 
@@ -3,7 +3,7 @@ from numpy import array, rad2deg, pi, mgrid, argmin
 import matplotlib.pyplot as plt
 import mplstereonet
 
-from obspy.imaging.beachball import aux_plane
+from focal_mech.lib.planes import aux_plane
 
 
 from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
@@ -54,13 +54,6 @@ longi.shape = resolution
 lati.shape = resolution
 mech.shape = resolution
 
-#c = contour(longi, lati, mech, [0])
-#pth1 = c.collections[0].get_paths()[0].vertices
-#pth1 = rad2deg(pth1)
-
-#pth2 = c.collections[0].get_paths()[1].vertices
-#pth2 = rad2deg(pth2)
-
 hash_focal = rad2deg(hash_solns[event])
 hash_focal_nr = rad2deg(hash_solns_nr[event])
 
@@ -1,16 +1,16 @@
 from numpy import array, rad2deg, pi, mgrid, argmin
 
-from matplotlib.pylab import contour
 import matplotlib.pyplot as plt
 import mplstereonet
 
-from obspy.imaging.beachball import aux_plane
+from focal_mech.lib.planes import aux_plane
 
 from focal_mech.lib.classify_mechanism import classify, translate_to_sphharm
 from focal_mech.io.read_hash import read_demo, read_hash_solutions
 
 from focal_mech.util.hash_routines import hash_to_classifier
 from focal_mech.lib.sph_harm import get_sph_harm
+from focal_mech.lib.nodal import nodal_lines
 from focal_mech.lib.correlate import corr_shear
 
 hash_solns = read_hash_solutions("example1.out")
@@ -39,12 +39,7 @@ longi.shape = resolution
 lati.shape = resolution
 mech.shape = resolution
 
-c = contour(longi, lati, mech, [0])
-pth1 = c.collections[0].get_paths()[0].vertices
-pth1 = rad2deg(pth1)
-
-pth2 = c.collections[0].get_paths()[1].vertices
-pth2 = rad2deg(pth2)
+pth1, pth2 = [rad2deg(pth) for pth in nodal_lines(coeffs, resolution)[:2]]
 
 hash_focal = rad2deg(hash_solns[event])
 
@@ -69,12 +64,7 @@ longi.shape = resolution
 lati.shape = resolution
 mech.shape = resolution
 
-c = contour(longi, lati, mech, [0])
-pth3 = c.collections[0].get_paths()[0].vertices
-pth3 = rad2deg(pth3)
-
-pth4 = c.collections[0].get_paths()[1].vertices
-pth4 = rad2deg(pth4)
+pth3, pth4 = [rad2deg(pth) for pth in nodal_lines(coeffs, resolution)[:2]]
 
 hash_focal2 = rad2deg(hash_solns[event2])
 
@@ -99,12 +89,7 @@ longi.shape = resolution
 lati.shape = resolution
 mech.shape = resolution
 
-c = contour(longi, lati, mech, [0])
-pth5 = c.collections[0].get_paths()[0].vertices
-pth5 = rad2deg(pth5)
-
-pth6 = c.collections[0].get_paths()[1].vertices
-pth6 = rad2deg(pth6)
+pth5, pth6 = [rad2deg(pth) for pth in nodal_lines(coeffs, resolution)[:2]]
 
 hash_focal3 = rad2deg(hash_solns[event3])
 
@@ -0,0 +1,318 @@
+"""
+A columnar on-disk catalog of the picks of a phase file and of the
+fitted spectra and double couples.
+
+A catalog is a directory of .npy files, a column each, memory mapped
+when read so nothing is copied. The picks are in CSR layout, the picks
+of the i-th event row are picks[offsets[i]:offsets[i+1]].
+
+Events are only ever appended. An event appended again with different
+picks supersedes its earlier rows, see latest_rows. Each row keeps a
+digest of its picks, and the fit columns the digest of the picks they
+were fit from, so refitting only touches the events whose picks
+changed.
+"""
+import os
+import json
+import struct
+import hashlib
+
+from numpy import (dtype, zeros, ones, full, nan, int64, concatenate,
+                   unique, searchsorted, ascontiguousarray, load,
+                   deg2rad, array, diff)
+from numpy.lib.format import (read_magic, read_array_header_1_0,
+                              dtype_to_descr)
+
+from focal_mech.io.read_hash import (PICK_DTYPE, iter_phase_blocks,
+                                     load_reversal_index, reverse_catalog)
+from focal_mech.lib.sph_harm import Alm_to_array
+
+
+# bump when the layout changes
+CATALOG_VERSION = 2
+
+# the columns, with their dtype and the shape of a row
+EVENT_COLUMNS = [("event", "int64", ()),
+                 ("time", "float64", ()),
+                 ("digest", "S20", ())]
+
+PICK_COLUMNS = [(name, fmt, ()) for name, fmt in PICK_DTYPE]
+
+def _fit_columns(lmax):
+    return [("fit_digest", "S20", ()),
+            ("alm", "complex128", ((lmax+1)**2,)),
+            ("solution", "float64", (3,)),
+            ("score", "float64", ())]
+
+# room for the shape to grow, so appends rewrite the header in place
+_HEADER_SIZE = 128
+
+def _write_header(fp, dt, shape):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+        dtype_to_descr(dtype(dt)), tuple(int(n) for n in shape))
+    header = header.ljust(_HEADER_SIZE - 11) + "\n"
+
+    fp.seek(0)
+    fp.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) +
+             header.encode("latin1"))
+
+def _write_column(filename, data, start):
+    """
+    Write the rows of data to a column from row start on, dropping any
+    rows after. The rows are written before the header, so an
+    interrupted write leaves the column as it was.
+    """
+    data = ascontiguousarray(data)
+
+    if not os.path.exists(filename):
+        with open(filename, "wb") as fp:
+            _write_header(fp, data.dtype, (0,) + data.shape[1:])
+
+    with open(filename, "r+b") as fp:
+        read_magic(fp)
+        shape, _, dt = read_array_header_1_0(fp)
+        if fp.tell() != _HEADER_SIZE or shape[1:] != data.shape[1:]:
+            raise Exception("%s: not a catalog column of shape %s"
+                            % (filename, (None,) + data.shape[1:]))
+
+        row = dt.itemsize
+        for n in shape[1:]:
+            row *= n
+
+        fp.seek(_HEADER_SIZE + start * row)
+        fp.write(data.astype(dt).tobytes())
+        fp.truncate()
+
+        _write_header(fp, dt, (start + len(data),) + shape[1:])
+
+def _column_file(directory, name):
+    return os.path.join(directory, name + ".npy")
+
+def _read_meta(directory):
+    with open(os.path.join(directory, "catalog.json")) as fp:
+        meta = json.load(fp)
+
+    if meta["version"] != CATALOG_VERSION:
+        raise Exception("%s: catalog version %d, expected %d"
+                        % (directory, meta["version"], CATALOG_VERSION))
+    return meta
+
+def open_catalog(directory, mode='r'):
+    """
+    The columns of a catalog, memory mapped.
+
+    Parameters:
+    -----------
+    :param mode: 'r' to read, 'r+' to also update rows in place.
+
+    Returns:
+    --------
+    :rtype columns: dict of arrays keyed by column name. The event
+                    columns, e.g. event, time, alm, solution, have a row
+                    per event row, offsets one more, and the pick
+                    columns, e.g. station, polarity, a row per pick.
+    """
+    meta = _read_meta(directory)
+
+    columns = {}
+    names = ([name for name, _, _ in EVENT_COLUMNS + PICK_COLUMNS +
+              _fit_columns(meta["lmax"])] + ["offsets"])
+    for name in names:
+        columns[name] = load(_column_file(directory, name), mmap_mode=mode)
+
+    # the event column is written last, rows beyond it are from an
+    # interrupted append
+    num_events = len(columns["event"])
+    num_picks = columns["offsets"][num_events]
+    for name, _, _ in EVENT_COLUMNS + _fit_columns(meta["lmax"]):
+        columns[name] = columns[name][:num_events]
+    for name, _, _ in PICK_COLUMNS:
+        columns[name] = columns[name][:num_picks]
+    columns["offsets"] = columns["offsets"][:num_events+1]
+
+    return columns
+
+def latest_rows(columns):
+    """
+    The rows holding the latest version of each event, in order of
+    the event ids.
+    """
+    event = columns["event"]
+    # unique sorts the ids, last is the first of each in the reversed
+    # rows
+    _, last = unique(event[::-1], return_index=True)
+    return len(event) - 1 - last
+
+def _digests(picks, offsets):
+    return array([hashlib.sha1(picks[a:b].tobytes()).digest()
+                  for a, b in zip(offsets[:-1], offsets[1:])], dtype="S20")
+
+def append_events(directory, block, lmax=2):
+    """
+    Append the events of a PhaseBlock to a catalog, creating it if
+    needed. Events whose picks are the same as their latest row are
+    skipped.
+
+    Parameters:
+    -----------
+    :param block: a PhaseBlock, see focal_mech.io.read_hash.
+    :param lmax: the degree of the stored spectra, for a new catalog.
+
+    Returns:
+    --------
+    :rtype num_events: the number of events appended.
+    """
+    if not os.path.exists(os.path.join(directory, "catalog.json")):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "catalog.json"), "w") as fp:
+            json.dump({"version": CATALOG_VERSION, "lmax": lmax}, fp)
+
+        num_events, num_picks = 0, 0
+        _write_column(_column_file(directory, "offsets"),
+                      zeros(1, dtype=int64), 0)
+        latest_event = zeros(0, dtype=int64)
+        latest_digest = zeros(0, dtype="S20")
+    else:
+        columns = open_catalog(directory)
+        num_events = len(columns["event"])
+        num_picks = columns["offsets"][-1]
+        rows = latest_rows(columns)
+        latest_event = array(columns["event"][rows])
+        latest_digest = array(columns["digest"][rows])
+
+    lmax = _read_meta(directory)["lmax"]
+
+    digest = _digests(block.picks, block.offsets)
+
+    # skip the unchanged events
+    keep = ones(len(digest), dtype=bool)
+    if len(latest_event) > 0:
+        k = searchsorted(latest_event, block.event)
+        k[k == len(latest_event)] = 0
+        keep = ~((latest_event[k] == block.event) &
+                 (latest_digest[k] == digest))
+    keep = keep.nonzero()[0]
+    if len(keep) == 0:
+        return 0
+
+    counts = diff(block.offsets)[keep]
+    picks = concatenate([block.picks[block.offsets[i]:block.offsets[i+1]]
+                         for i in keep])
+    offsets = num_picks + counts.cumsum()
+
+    for name, _, _ in PICK_COLUMNS:
+        _write_column(_column_file(directory, name), picks[name], num_picks)
+
+    n = len(keep)
+    fit = {"fit_digest": zeros(n, dtype="S20"),
+           "alm": zeros((n, (lmax+1)**2), dtype=complex),
+           "solution": full((n, 3), nan),
+           "score": full(n, nan)}
+    for name, _, _ in _fit_columns(lmax):
+        _write_column(_column_file(directory, name), fit[name], num_events)
+
+    _write_column(_column_file(directory, "offsets"), offsets,
+                  num_events + 1)
+    _write_column(_column_file(directory, "time"), block.time[keep],
+                  num_events)
+    _write_column(_column_file(directory, "digest"), digest[keep],
+                  num_events)
+    # last, this commits the rows
+    _write_column(_column_file(directory, "event"), block.event[keep],
+                  num_events)
+
+    return n
+
+def ingest_phase_file(directory, phase_file, sta_reverse=None, lmax=2,
+                      block_size=2**22):
+    """
+    Append the events of a HASH phase file to a catalog, see
+    append_events.
+
+    :param sta_reverse: the station polarity reversal file, if given
+                        the stored polarities are reversed.
+
+    :rtype num_events: the number of events appended.
+    """
+    index = None
+    if sta_reverse is not None:
+        index = load_reversal_index(sta_reverse)
+
+    num_events = 0
+    for block in iter_phase_blocks(phase_file, block_size):
+        if index is not None:
+            block.picks['polarity'] = reverse_catalog(index, block)
+        num_events += append_events(directory, block, lmax)
+
+    return num_events
+
+def iter_event_data(columns, rows=None):
+    """
+    The picks of catalog rows in the form of read_demo, to feed
+    focal_mech.util.hash_routines.iter_hash_to_classifier.
+
+    :param rows: the rows, defaults to latest_rows.
+
+    :rtype generator: of (event, data), data is an (n, 3) array of the
+                      azimuth, takeoff angle (radians) and polarity.
+    """
+    if rows is None:
+        rows = latest_rows(columns)
+
+    offsets = columns["offsets"]
+    for row in rows:
+        a, b = offsets[row], offsets[row+1]
+        data = array([deg2rad(columns["azimuth"][a:b]),
+                      deg2rad(columns["takeoff"][a:b]),
+                      columns["polarity"][a:b]]).T
+        yield columns["event"][row], data
+
+def fit_catalog(directory, parity=1, refit=False, **kwargs):
+    """
+    Fit the latest rows of the events of a catalog whose picks changed
+    since they were last fit, and store the spectra and double couples,
+    nan for the events with a single polarity.
+
+    Parameters:
+    -----------
+    :param parity: see hash_to_classifier.
+    :param refit: fit all the events.
+    :param kwargs: passed to focal_mech.lib.batch.iter_catalog.
+
+    Returns:
+    --------
+    :rtype num_events: the number of events fit.
+    """
+    # the classifier is only needed to fit
+    from focal_mech.util.hash_routines import iter_hash_to_classifier
+    from focal_mech.lib.batch import iter_catalog
+
+    lmax = _read_meta(directory)["lmax"]
+    columns = open_catalog(directory, mode='r+')
+
+    rows = latest_rows(columns)
+    if not refit:
+        rows = rows[columns["fit_digest"][rows] != columns["digest"][rows]]
+
+    row_of = dict(zip(columns["event"][rows], rows))
+
+    inputs = iter_hash_to_classifier(iter_event_data(columns, rows), parity)
+    for result in iter_catalog(inputs, **kwargs):
+        row = row_of[result.event]
+        if result.Alm is None:
+            # a single polarity, there is no solution
+            columns["alm"][row] = nan
+            columns["solution"][row] = nan
+            columns["score"][row] = nan
+        else:
+            columns["alm"][row] = Alm_to_array(result.Alm, lmax)
+        if result.double_couple is not None:
+            columns["solution"][row] = result.double_couple
+            columns["score"][row] = result.score
+        columns["fit_digest"][row] = columns["digest"][row]
+
+    for name, _, _ in _fit_columns(lmax):
+        columns[name].flush()
+
+    return len(rows)
@@ -1,41 +1,112 @@
 """
 Read the demo data supplied by the HASH demo codes.
 """
+import os
 import datetime
-from numpy import genfromtxt, int_, deg2rad, array
+from collections import namedtuple
+
+from numpy import (genfromtxt, int_, deg2rad, array, where, memmap, uint8,
+                   int64, arange, concatenate, flatnonzero, zeros, empty,
+                   cumsum, bincount, newaxis, ones, atleast_1d, asarray,
+                   searchsorted, repeat, diff)
+
+from focal_mech.lib import instrument
 
 def read_hash_solutions(filename):
     data = genfromtxt(filename)
     return dict(zip(int_(data[:,0]),deg2rad(data[:,21:24])))
 
-def read_demo(phase_data, sta_reverse, reverse=True):
+def read_demo(phase_data, sta_reverse, reverse=True, full=False):
     """
     Read the demo data in and grab the polarity and stations coords.
     """
-    
-    polarity_data, event_time_map = parse_phase_file(phase_data)
+    if not reverse:
+        sta_reverse = None
+
+    return dict(iter_demo(phase_data, sta_reverse, full))
+
+def iter_demo(phase_data, sta_reverse=None, full=False):
+    """
+    Stream the events of a phase file, see iter_phase_file, in the form
+    of read_demo. Only one event is held in memory at a time.
+
+    Parameters:
+    -----------
+    :param phase_data: the HASH phase file.
+    :param sta_reverse: the station polarity reversal file, if given
+                        the polarities are reversed.
+    :param full: also keep the quality, distance and uncertainties of
+                 each pick, see event_data.
+
+    Returns:
+    --------
+    :rtype generator: of (event, data), data is an (n, 3) array of the
+                      azimuth, takeoff angle (radians) and polarity of
+                      each pick.
+    """
     # Some of the stations were known to be recording the oppsite
-    # polarity during certain periods: 
-    reverse_data = parse_reverse(sta_reverse)
+    # polarity during certain periods:
+    index = None
+    if sta_reverse is not None:
+        index = load_reversal_index(sta_reverse)
 
-    if reverse:
-        reverse_polarity(reverse_data, polarity_data, event_time_map)
+    for event, t, picks in iter_phase_file(phase_data):
+        yield event, event_data(picks, t, index, full)
 
-    demo_data = {}
-    for event, val in polarity_data.items():
+def event_data(picks, t, index=None, full=False):
+    """
+    The picks of an event in the form of read_demo.
+
+    :param picks: structured array of PICK_DTYPE.
+    :param t: the origin time of the event.
+    :param index: ReversalIndex, see load_reversal_index, if given the
+                  polarities are reversed.
+    :param full: also the quality, distance and uncertainties.
+    :rtype data: (n, 3) the azimuth, takeoff angle (radians) and
+                 polarity of each pick, (n, 7) the columns of
+                 DEMO_COLUMNS with full.
+    """
+    polarity = picks['polarity'].astype(float)
+    if index is not None:
+        polarity = reversed_polarity(index, picks['station'], t, polarity)
 
-        _, data = val        
-        
-        pol = array([deg2rad(data[-1]), deg2rad(data[-2]), data[1]])
-        pol = pol.reshape([3,-1]).T
+    columns = [deg2rad(picks['azimuth']), deg2rad(picks['takeoff']),
+               polarity]
+    if full:
+        columns += [picks['quality'], picks['distance'],
+                    deg2rad(picks['takeoff_error']),
+                    deg2rad(picks['azimuth_error'])]
 
-        demo_data[event] = pol
+    return array(columns, dtype=float).T
 
-    return demo_data
+# From HASH driver1.f:
+#30    continue
+#        read (12,35) sname(k),pickpol(k),p_qual(k),
+#     &           qdist,ith,iaz,isthe,isazi
+#35      format (a4,2x,a1,i1,50x,f4.1,i3,10x,i3,1x,i3,1x,i3)
+#
+# isthe and isazi are the takeoff and azimuth uncertainties, in degrees
+PICK_DTYPE = [('station', 'S4'), ('polarity', 'i1'), ('quality', 'i1'),
+              ('distance', 'f4'), ('takeoff', 'f4'), ('azimuth', 'f4'),
+              ('takeoff_error', 'f4'), ('azimuth_error', 'f4')]
+
+# the columns of event_data(..., full=True), the angles in radians
+DEMO_COLUMNS = ['azimuth', 'takeoff', 'polarity', 'quality', 'distance',
+                'takeoff_error', 'azimuth_error']
+
+PhaseEvent = namedtuple("PhaseEvent", ["event", "time", "picks"])
 
-def _parse_phase_header(line_iter):
-    """  
-    1-10 5i2 origin time, year, month, day, hour, minute 
+PhaseBlock = namedtuple("PhaseBlock", ["event", "time", "offsets", "picks"])
+
+def _implied_decimal(field, decimals):
+    # Fortran fw.d input, the decimal point is implied unless given
+    if '.' in field:
+        return float(field)
+    return float(field) / 10**decimals
+
+def _parse_phase_header(line):
+    """
+    1-10 5i2 origin time, year, month, day, hour, minute
     11-14 f4.2 origin time, seconds
     15-16 i2 latitude, degrees
     17 a1 latitude, 'S'=south
@@ -46,22 +117,20 @@ def _parse_phase_header(line_iter):
     30-34 f5.2 depth, km
     35-36 f2.1 magnitude
     81-88 2f4.2 horizontal and vertical uncertainty, km
-    """
-
-    line = line_iter.next()
+    123-138 i16 event id
 
-    cursor = 0
+    Returns the event id and the origin time in seconds since epoch.
+    """
+    year = int(line[0:2])
+    month = int(line[2:4])
+    day = int(line[4:6])
+    hour = int(line[6:8])
+    minute = int(line[8:10])
 
-    year = int(line[cursor:cursor+2]); cursor += 2
-    month = int(line[cursor:cursor+2]); cursor += 2
-    day = int(line[cursor:cursor+2]); cursor += 2
-    hour = int(line[cursor:cursor+2]); cursor += 2
-    minute = int(line[cursor:cursor+2]); cursor += 2
-    second = float(line[cursor:cursor+2]); cursor += 4
+    second = _implied_decimal(line[10:14], 2)
 
     event_id = int(line[122:138])
 
-    second /= 100
     microsecond = 1.0E+6 * (second - int(second))
 
     # y2k bug:
@@ -72,147 +141,493 @@ def _parse_phase_header(line_iter):
 
     # seconds since epoch:
     t = (datetime.datetime(year, month, day, hour, minute, int(second),
-                           int(microsecond)) - 
+                           int(microsecond)) -
          datetime.datetime(1970,1,1)).total_seconds()
 
     return event_id, t
-    
-def _parse_polarity_data(line_iter):
+
+def _parse_polarity_line(line):
     """
     1-4 a4 station name
     7 a1 polarity:U,u,+,D,d,or-
-    8 i1 quality: 0=good quality, 1=lower quality, etc 
+    8 i1 quality: 0=good quality, 1=lower quality, etc
     59-62 f4.1 source-station distance (km)
-    66-68 i3 takeoff angle
-    79-81 i3  azimuth
-    83-85 i3 takeoff angle uncertainty 
-    87-89 i3 azimuth angle uncertainty 
+    63-65 i3 takeoff angle
+    76-78 i3 azimuth
+    80-82 i3 takeoff angle uncertainty
+    84-86 i3 azimuth uncertainty
+
+    Returns a row of PICK_DTYPE. The uncertainties are often left out,
+    blank fields read as zero, as in Fortran.
     """
+    if line[6] in 'dD-':
+        polarity = -1
+    else:
+        polarity = 1
 
-    station = []
-    polarity = []
-    quality = []
-    src_sta_dist = []
-    toa = []
-    azimuth = []
+    return (line[0:4].strip(), polarity, int(line[7]),
+            _implied_decimal(line[58:62], 1), float(line[62:65]),
+            float(line[75:78]), _blank_zero(line[79:82]),
+            _blank_zero(line[83:86]))
 
-    line = line_iter.next()
-    while(line[0] != " "):
-        cursor = 0
+def _blank_zero(field):
+    field = field.strip()
+    if not field:
+        return 0.0
+    return float(field)
 
+def iter_phase_file(filename):
+    """
+    Stream the events of a HASH phase file, files consist of a header
+    line, a line per pick, and a line starting with a blank that closes
+    the event. Reads a line at a time, so memory is bounded by the
+    largest event.
+
+    Returns:
+    --------
+    :rtype generator: of PhaseEvent, the event id, the origin time in
+                      seconds since epoch and the picks, a structured
+                      array of PICK_DTYPE.
+    """
+    return instrument.timed_iter("read_hash.iter_phase_file",
+                                 _iter_phase_file(filename))
+
+def _iter_phase_file(filename):
+    with open(filename, 'r') as fp:
+        parser = PhaseParser()
+        for lineno, line in enumerate(fp, 1):
+            try:
+                closed = parser.feed(line)
+            except (ValueError, IndexError) as err:
+                raise Exception("%s, line %d: %s" % (filename, lineno, err))
+
+            if closed is not None:
+                instrument.count("read_hash.picks", len(closed.picks))
+                yield closed
+
+        if parser.event is not None:
+            raise Exception("%s: unexpected end of file in event %d"
+                            % (filename, parser.event))
+
+class PhaseParser(object):
+    """
+    Parse the lines of a HASH phase file pushed one at a time, e.g. as
+    they arrive on a stream, see iter_phase_file.
 
-# From HASH driver1.f:
-#30    continue
-#        read (12,35) sname(k),pickpol(k),p_qual(k),
-#     &           qdist,ith,iaz,isthe,isazi
-#35      format (a4,2x,a1,i1,50x,f4.1,i3,10x,i3,1x,i3,1x,i3)
-#
-        station.append(line[cursor:cursor+4]); cursor += 6
-        
-        pol = line[cursor:cursor+1]; cursor += 1
-        if pol.lower() == 'd':
-            polarity.append(-1)
-        else:
-            polarity.append(1)
-        
-        quality.append(int(line[cursor:cursor+1])); cursor += 51
-        src_sta_dist.append(float(line[cursor:cursor+4])/10); cursor += 4
+    :attr event: the id of the event being read, None between events.
+    """
+    def __init__(self):
+        self.event = None
+        self._time = None
+        self._picks = []
+
+    def feed(self, line):
+        """
+        :param line: a line of a phase file.
+        :rtype event: the PhaseEvent the line closes, otherwise None.
+        Raises ValueError or IndexError on a malformed line, the state
+        is left as it was.
+        """
+        if self.event is None:
+            # blank lines between events
+            if line.strip():
+                self.event, self._time = _parse_phase_header(line)
+                self._picks = []
+            return None
+
+        if not line.strip() or line[0] == " ":
+            closed = PhaseEvent(self.event, self._time,
+                                array(self._picks, dtype=PICK_DTYPE))
+            self.event = None
+            return closed
+
+        self._picks.append(_parse_polarity_line(line))
+        return None
+
+# the columns of the fields read by the block reader, see
+# _parse_phase_header and _parse_polarity_line
+_HEADER_COLUMNS = concatenate((arange(0, 14), arange(122, 138)))
+_PICK_COLUMNS = concatenate((arange(0, 4), [6, 7], arange(58, 65),
+                             arange(75, 78), arange(79, 82),
+                             arange(83, 86)))
+
+def _gather(buf, starts, ends, columns):
+    """
+    The given columns of the lines [starts, ends) of buf, as an
+    (len(columns), n) array of bytes padded with blanks, a row per
+    column so the fields are contiguous.
+    """
+    index = columns[:,newaxis] + starts
+    outside = index >= ends
 
-        toa.append(float(line[cursor:cursor+3])); cursor += 13
-        azimuth.append(float(line[cursor:cursor+3])); cursor += 3
+    index[outside] = 0
+    return where(outside, uint8(ord(" ")), buf[index])
 
-        line = line_iter.next()
+def _fixed_field(cols, decimals, lines, filename, blank=False):
+    """
+    Vectorized Fortran iw / fw.d input of a (w, n) array of bytes.
+    Blanks are ignored and the decimal point is implied. Fields that
+    are not a plain signed integer are read one at a time, which also
+    raises on malformed fields with their line number.
+
+    :param lines: the line number of each field, for error messages.
+    :param blank: read all blank fields as zero, otherwise they raise.
+    """
+    n = cols.shape[1]
+    value = zeros(n, dtype=int64)
+    negative = zeros(n, dtype=bool)
+    # plain fields have at most one sign, ahead of the digits
+    plain = ones(n, dtype=bool)
+    signed = zeros(n, dtype=bool)
+    started = zeros(n, dtype=bool)
+
+    for col in cols:
+        digit = col - uint8(ord("0"))
+        is_digit = digit < 10
+        minus = col == ord("-")
+        sign = minus | (col == ord("+"))
+
+        value = where(is_digit, 10*value + digit, value)
+        plain &= is_digit | (col == ord(" ")) | (sign & ~signed & ~started)
+
+        signed |= sign
+        started |= is_digit
+        negative |= minus
+
+    plain &= started
+    if blank:
+        plain |= (cols == ord(" ")).all(axis=0)
+    value = where(negative, -value, value)
+
+    if decimals == 0 and plain.all():
+        return value
+
+    value = value / float(10**decimals)
+    for k in flatnonzero(~plain):
+        field = cols[:,k].tobytes().decode("ascii", "replace")
+        try:
+            value[k] = _implied_decimal(field, decimals)
+        except ValueError as err:
+            raise Exception("%s, line %d: %s" % (filename, lines[k], err))
+
+    return value
+
+def _parse_block(buf, starts, ends, closing, first_line, filename):
+    """
+    Parse the complete events in the lines [starts, ends) of buf, see
+    iter_phase_blocks. closing marks the lines that close an event.
+    """
+    lines = first_line + arange(len(starts))
+
+    # the line after a closing line starts an event
+    header = ~closing
+    header[1:] &= closing[:-1]
+    pick = ~closing & ~header
+
+    # headers
+    h = header.nonzero()[0]
+    cols = _gather(buf, starts[h], ends[h], _HEADER_COLUMNS)
+    field = lambda a, b, d=0: _fixed_field(cols[a:b], d, lines[h],
+                                           filename)
+
+    year = field(0, 2)
+    year += where(year > 50, 1900, 2000)
+    days = (((year - 1970).astype("M8[Y]") +
+             (field(2, 4) - 1).astype("m8[M]")).astype("M8[D]") +
+            (field(4, 6) - 1).astype("m8[D]"))
+    time = (days.astype(int64) * 86400.0 + field(6, 8) * 3600.0 +
+            field(8, 10) * 60.0 + field(10, 14, 2))
+    event = field(14, 30)
+
+    # picks, in the order of the events
+    p = pick.nonzero()[0]
+    cols = _gather(buf, starts[p], ends[p], _PICK_COLUMNS)
+    field = lambda a, b, d=0, blank=False: _fixed_field(cols[a:b], d,
+                                                        lines[p], filename,
+                                                        blank)
+
+    picks = empty(len(p), dtype=PICK_DTYPE)
+
+    # drop the padding of the station names, as strip does
+    station = cols[0:4].T.copy()
+    trailing = station[:,3] == ord(" ")
+    for j in range(3, -1, -1):
+        trailing &= station[:,j] == ord(" ")
+        station[trailing,j] = 0
+    picks['station'] = station.view("S4")[:,0]
+
+    polarity = cols[4]
+    picks['polarity'] = where((polarity == ord("d")) |
+                              (polarity == ord("D")) |
+                              (polarity == ord("-")), -1, 1)
+    picks['quality'] = field(5, 6)
+    picks['distance'] = field(6, 10, 1)
+    picks['takeoff'] = field(10, 13)
+    picks['azimuth'] = field(13, 16)
+    picks['takeoff_error'] = field(16, 19, blank=True)
+    picks['azimuth_error'] = field(19, 22, blank=True)
+
+    counts = bincount(cumsum(header)[p] - 1, minlength=len(h))
+    offsets = concatenate(([0], cumsum(counts))).astype(int64)
+
+    return PhaseBlock(event, time, offsets, picks)
+
+def iter_phase_blocks(filename, block_size=2**22):
+    """
+    Read a HASH phase file a block at a time, parsing the fixed width
+    fields of all the lines of a block at once. The file is memory
+    mapped, and a block holds the complete events within block_size
+    bytes.
+
+    Returns:
+    --------
+    :rtype generator: of PhaseBlock, the event ids, origin times, the
+                      picks of all the events of the block as a
+                      structured array of PICK_DTYPE, and offsets such
+                      that picks[offsets[i]:offsets[i+1]] are those of
+                      event[i].
+    """
+    return instrument.timed_iter("read_hash.iter_phase_blocks",
+                                 _iter_phase_blocks(filename, block_size))
+
+def _iter_phase_blocks(filename, block_size):
+    size = os.path.getsize(filename)
+    if size == 0:
+        return
+
+    buf = memmap(filename, dtype=uint8, mode='r')
+
+    start = 0
+    first_line = 1
+    step = block_size
+    while start < size:
+        stop = min(start + step, size)
+        block = buf[start:stop]
+
+        newlines = flatnonzero(block == ord("\n"))
+        ends = newlines
+        if stop == size and block[-1] != ord("\n"):
+            # no newline at the end of the file
+            ends = concatenate((newlines, [len(block)]))
+        elif len(newlines) == 0:
+            # a line larger than the block
+            step *= 2
+            continue
+
+        starts = concatenate(([0], newlines[:len(ends)-1] + 1))
+
+        # windows line endings
+        ends = ends - (block[ends - 1] == ord("\r")) * (ends > starts)
+
+        first = block[starts]
+        closing = ((ends == starts) | (first == ord(" ")) |
+                   (first == ord("\t")))
+
+        if stop < size:
+            # cut after the last closing line, the event after is
+            # incomplete
+            last = flatnonzero(closing)
+            if len(last) == 0:
+                # an event larger than the block
+                step *= 2
+                continue
+            n = last[-1] + 1
+            starts, ends, closing = starts[:n], ends[:n], closing[:n]
+            consumed = newlines[n-1] + 1
+        else:
+            if not closing[-1]:
+                event_start = flatnonzero(closing)
+                event_start = event_start[-1] + 1 if len(event_start) else 0
+                raise Exception("%s: unexpected end of file in the event "
+                                "at line %d" % (filename,
+                                                first_line + event_start))
+            consumed = len(block)
+
+        parsed = _parse_block(block, starts, ends, closing, first_line,
+                              filename)
+        instrument.count("read_hash.picks", len(parsed.picks))
+        yield parsed
+
+        start += consumed
+        first_line += len(starts)
+        step = block_size
+
+def read_phase_columns(filename, block_size=2**22):
+    """
+    Read a HASH phase file in to columns, see iter_phase_blocks.
 
-    event_id = int(line)
+    Returns:
+    --------
+    :rtype PhaseBlock: for all the events of the file.
+    """
+    blocks = list(iter_phase_blocks(filename, block_size))
+    if len(blocks) == 0:
+        return PhaseBlock(zeros(0, dtype=int64), zeros(0),
+                          zeros(1, dtype=int64), zeros(0, dtype=PICK_DTYPE))
 
-    return event_id, [station, polarity, quality, src_sta_dist, toa, azimuth]
+    offsets = [blocks[0].offsets]
+    for block in blocks[1:]:
+        offsets.append(block.offsets[1:] + offsets[-1][-1])
 
+    return PhaseBlock(concatenate([block.event for block in blocks]),
+                      concatenate([block.time for block in blocks]),
+                      concatenate(offsets),
+                      concatenate([block.picks for block in blocks]))
 
 def parse_phase_file(filename):
     """
-    files consist of header/data
+    files consist of header/data, see iter_phase_file.
     """
-
-    with open(filename,'r') as fp:
-        lines = fp.readlines()
-
     polarity_data = {}
     event_time_map = {}
-    line_iter = iter(lines)
-    try:
-        while(line_iter):
-            ev_id, t = _parse_phase_header(line_iter)
-            event_time_map[ev_id] = t
-            ev_id, data = _parse_polarity_data(line_iter)
-            polarity_data[ev_id] = (t, data)
-    except:
-        pass
+    for ev_id, t, picks in iter_phase_file(filename):
+        event_time_map[ev_id] = t
+        data = [list(picks['station']), list(picks['polarity']),
+                list(picks['quality']), list(picks['distance']),
+                list(picks['takeoff']), list(picks['azimuth']),
+                list(picks['takeoff_error']), list(picks['azimuth_error'])]
+        polarity_data[ev_id] = (t, data)
 
     return polarity_data, event_time_map
 
+def _reverse_date(date, default):
+    # yyyymmdd, or 0 for open ended
+    if date == b'0':
+        year, month, day = default
+    else:
+        year = int(date[:4])
+        month = int(date[4:6])
+        day = int(date[6:8])
+
+    return (datetime.datetime(year, month, day) -
+            datetime.datetime(1970, 1, 1)).total_seconds()
+
 def parse_reverse(filename):
-    data = genfromtxt(filename,dtype=[('station','S4'),
-                                      ('start_t', 'S8'),
-                                      ('end_t', 'S8')])
+    """
+    Read the station polarity reversal file, a line per period a
+    station was recording the opposite polarity: the station, the start
+    and end dates as yyyymmdd, 0 if open ended.
+
+    Returns:
+    --------
+    :rtype reverse: dict of the list of (tstart, tend) periods of each
+                    station, in seconds since epoch.
+    """
+    data = atleast_1d(genfromtxt(filename,dtype=[('station','S4'),
+                                                 ('start_t', 'S8'),
+                                                 ('end_t', 'S8')]))
 
     reverse = {}
     for dat in data:
+        tstart = _reverse_date(dat[1], (1900, 1, 1))
+        tend = _reverse_date(dat[2], (2100, 1, 1))
 
-        st = dat[1]
+        reverse.setdefault(dat[0], []).append((tstart, tend))
 
-        if st != '0':
-            year = int(st[:4])
-            month = int(st[4:6])
-            day = int(st[6:8])
-        else:
-            year = 1900
-            month = 1
-            day = 1
-            
-        tstart = (datetime.datetime(year, month, day) -
-                     datetime.datetime(1970, 1, 1)).total_seconds()
-
-        en = dat[2]
-
-        if en != '0':
-            year = int(en[:4])
-            month = int(en[4:6])
-            day = int(en[6:8])
-        else:
-            year = 2100
-            month = 1
-            day = 1
+    return reverse
 
-        tend = (datetime.datetime(year, month, day) -
-                    datetime.datetime(1970, 1, 1)).total_seconds()
-        
-        reverse[dat[0]] = (tstart, tend)
+ReversalIndex = namedtuple("ReversalIndex", ["stations", "key", "end"])
 
-    return reverse
+def build_reversal_index(reverse_data):
+    """
+    Index the reversal periods of parse_reverse for vectorized lookups.
+    The overlapping periods of a station are merged, and the periods
+    are sorted by station then start time, the sort key of a period is
+    station + 1j * start, complex numbers sort lexicographically.
+
+    Returns:
+    --------
+    :rtype ReversalIndex: the sorted station names, and the key and end
+                          time of each period.
+    """
+    stations = array(sorted(reverse_data.keys()), dtype='S4')
+
+    key = []
+    end = []
+    for k, sta in enumerate(stations):
+        merged = []
+        for tstart, tend in sorted(reverse_data[sta]):
+            if merged and tstart < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], tend)
+            else:
+                merged.append([tstart, tend])
+
+        key.extend(k + 1j*tstart for tstart, _ in merged)
+        end.extend(tend for _, tend in merged)
+
+    return ReversalIndex(stations, array(key, dtype=complex),
+                         array(end, dtype=float))
+
+def load_reversal_index(filename):
+    """
+    build_reversal_index of a station polarity reversal file.
+    """
+    return build_reversal_index(parse_reverse(filename))
+
+def reversed_polarity(index, stations, times, polarity):
+    """
+    The polarity of picks, reversed for those at a station recording
+    the opposite polarity at the time of the event.
+
+    Parameters:
+    -----------
+    :param index: ReversalIndex, see load_reversal_index.
+    :param stations: the station of each pick.
+    :param times: the origin time of the event of each pick, or a
+                  scalar for the picks of a single event.
+    :param polarity: the polarity of each pick.
+
+    Returns:
+    --------
+    :rtype polarity: a new array, the polarity is left unchanged.
+    """
+    stations = asarray(stations, dtype='S4')
+    polarity = asarray(polarity)
+    times = times + zeros(len(stations))
+
+    if len(index.stations) == 0:
+        return polarity.copy()
+
+    # unknown stations are mapped to a station without periods
+    sta = searchsorted(index.stations, stations)
+    sta[sta == len(index.stations)] = 0
+    sta = where(index.stations[sta] == stations, sta, len(index.stations))
+
+    # the last period of the station starting before the event
+    period = searchsorted(index.key, sta + 1j*times) - 1
+    flip = ((period >= 0) & (index.key[period].real == sta) &
+            (times < index.end[period]))
+
+    return where(flip, -polarity, polarity)
+
+def reverse_catalog(index, block):
+    """
+    reversed_polarity of all the picks of a PhaseBlock, see
+    iter_phase_blocks.
+    """
+    times = repeat(block.time, diff(block.offsets))
+    return reversed_polarity(index, block.picks['station'], times,
+                             block.picks['polarity'])
 
 def reverse_polarity(reverse_data, polarity, event_time_map):
+    """
+    Reverse the polarities of parse_phase_file.
 
-    for key, val in polarity.items():
-        t = event_time_map[key]
-
-        t0 = val[0]
-        stations = val[1][0]
-        pol = val[1][1]
-
-        updated_polarity = []
-        for sta, p in zip(stations,pol):
-            
-            if sta in reverse_data.keys():
-
-                if(t > reverse_data[sta][0] and
-                        t < reverse_data[sta][1]):
-                    #reverse the polarity:                
-                    updated_polarity.append(p * -1)
-                else:
-                    updated_polarity.append(p)
-        
-            else:
-                updated_polarity.append(p)
+    :param reverse_data: the output of parse_reverse, or a
+                         ReversalIndex.
+
+    Returns:
+    --------
+    :rtype polarity_data: a new dict, the input is left unchanged.
+    """
+    if not isinstance(reverse_data, ReversalIndex):
+        reverse_data = build_reversal_index(reverse_data)
+
+    updated = {}
+    for key, (t0, data) in polarity.items():
+        data = list(data)
+        data[1] = list(reversed_polarity(reverse_data, data[0],
+                                         event_time_map[key], data[1]))
+        updated[key] = (t0, data)
 
-        #update polarity
-        polarity[key][1][1] = updated_polarity
+    return updated
@@ -0,0 +1,355 @@
+"""
+Fit every event of a catalog, optionally across a pool of worker
+processes.
+"""
+import time
+from collections import namedtuple
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+from numpy import (sign, mean, zeros, ones, cos, sin, where, concatenate,
+                   isnan, newaxis, nan, arange, empty, diff, argsort,
+                   repeat, cumsum, maximum)
+
+from focal_mech.lib.classify_mechanism import (classify, translate_to_sphharm,
+                                               explicit_to_sphharm,
+                                               has_both_polarities)
+from focal_mech.lib.feature_map import (poly_features, fit_explicit,
+                                        fit_symmetric, ANTIPODE)
+from focal_mech.lib.sph_harm import Alm_to_array, array_to_Alm, complex_to_real
+from focal_mech.lib.correlate import corr_shear, corr_shear_batch
+from focal_mech.lib import instrument
+from focal_mech.util.hash_routines import hash_to_batch
+
+
+EventResult = namedtuple("EventResult", ["event", "Alm", "accuracy",
+                                         "double_couple", "score"])
+
+
+def fit_event(event, inputs, kernel_degree=2, kernel_coeff=1,
+              solver='svc', double_couple=True, parity=0):
+    """
+    Classify a single event and summarize the fit.
+
+    Parameters:
+    -----------
+    :param event: the event id, carried through to the result.
+    :param inputs: (x, y, z, data) for the event, as produced by
+                   hash_to_classifier.
+    :param kernel_degree, kernel_coeff, solver: passed through to
+                                                classify.
+    :param double_couple: also search for the best double couple,
+                          this is the most expensive part of the fit.
+    :param parity: imposed by the solver, for inputs without the
+                   antipodes, see classify.
+
+    Returns:
+    --------
+    :rtype EventResult: the spectrum Alm, the in-sample accuracy, the
+                        best (strike, dip, rake) in degrees and its
+                        correlation score. The last two are None if
+                        double_couple is False. All four are None for
+                        an event with a single polarity, as fit_events.
+    """
+    with instrument.event(event):
+        x, y, z, data = inputs
+
+        if parity >= 0 and not has_both_polarities(data):
+            return EventResult(event, None, None, None, None)
+
+        result = classify(x, y, z, data, kernel_degree=kernel_degree,
+                          kernel_coeff=kernel_coeff, solver=solver,
+                          parity=parity)
+        Alm = translate_to_sphharm(*result, kernel_degree=kernel_degree)
+
+        classes = sign(data.ravel())
+        classes[classes <= 0] = -1
+        accuracy = mean(result[-1] == classes)
+
+        soln, score = None, None
+        if double_couple:
+            soln, score = corr_shear(Alm)
+            # corr_shear minimizes the negative correlation
+            score = -score
+
+        return EventResult(event, Alm, accuracy, soln, score)
+
+def _fit_stack(features, classes, parity, kernel_coeff, C, symmetric=True):
+    """
+    fit_explicit of padded (N, n, 10) features and (N, n) classes, zero
+    for the padding, with the antipodes of the picks for parity. The
+    classifier function then has the parity, so its accuracy on the
+    antipodes is its accuracy on the picks. The picks of zero penalty
+    are dropped, and left out of the accuracy.
+    """
+    C = C * ones(classes.shape)
+    classes = where(C > 0, classes, 0)
+
+    with instrument.timer("fit_spectra"):
+        if parity != 0 and symmetric:
+            weights, intercept, _ = fit_symmetric(features, classes, parity,
+                                                  C=C)
+        else:
+            if parity != 0:
+                features = concatenate((features, features * ANTIPODE),
+                                       axis=-2)
+                classes = concatenate((classes, sign(parity)*classes),
+                                      axis=-1)
+                C = concatenate((C, C), axis=-1)
+            weights, intercept, _ = fit_explicit(features, classes, C=C)
+
+    decision = (features * weights[:,newaxis,:]).sum(axis=-1)
+    decision += intercept[:,newaxis]
+    correct = (classes * decision > 0).sum(axis=-1)
+    # nan for the events with every pick dropped
+    total = (classes != 0).sum(axis=-1)
+    accuracy = where(total > 0, correct / maximum(total, 1.0), nan)
+
+    Alm = explicit_to_sphharm(weights, intercept, kernel_coeff)
+    return Alm_to_array(Alm, 2).T, accuracy
+
+def fit_spectra(data, counts=None, parity=1, kernel_coeff=1, C=1.0,
+                symmetric=True):
+    """
+    Fit the picks of many events at once, in the explicit feature space
+    of the degree 2 kernel, see fit_explicit.
+
+    Parameters:
+    -----------
+    :param data: (N, n, 3) the picks of each event, as read_demo,
+                 padded to the same number.
+    :param counts: (N,) the number of picks of each event, defaults to
+                   n.
+    :param parity: see hash_to_classifier.
+    :param kernel_coeff: of the degree 2 kernel classifier.
+    :param C: the penalty, a scalar or (N, n) of each pick, e.g. C
+              times pick_weights, zero drops the pick.
+    :param symmetric: for parity != 0, fit the even or odd features of
+                      the picks, see fit_symmetric, otherwise the picks
+                      and their antipodes. The spectra are the same.
+
+    Returns:
+    --------
+    :rtype alm: (N, 9) the dense spectra, ordered as sph_harm_modes, nan
+                for events with a single polarity, unless parity is -1.
+    :rtype accuracy: (N,) the in-sample accuracy.
+    """
+    # the takeoff angle is the colatitude, see hash_to_classifier
+    x = cos(data[...,0])*sin(data[...,1])
+    y = sin(data[...,0])*sin(data[...,1])
+    z = cos(data[...,1])
+
+    # zero marks the padding
+    classes = where(data[...,2] > 0, 1.0, -1.0)
+    if counts is not None:
+        classes[arange(data.shape[1]) >= counts[:,newaxis]] = 0
+
+    return _fit_stack(poly_features(x, y, z, kernel_coeff), classes, parity,
+                      kernel_coeff, C, symmetric)
+
+def fit_batch(batch, kernel_coeff=1, C=1.0, chunk_size=4096, symmetric=True):
+    """
+    fit_spectra of the packed picks of hash_to_batch, without a padded
+    copy of the catalog. The events are sorted by their number of picks
+    and fit chunk_size at a time, each chunk padded to its longest
+    event. The batch has no antipodes, the parity is imposed by the
+    solver, see symmetric. The penalty of each pick is C times its
+    weight in the batch, if any, the picks of zero weight are dropped.
+
+    Parameters:
+    -----------
+    :param batch: PickBatch, see hash_to_batch.
+    :param kernel_coeff, C: of the degree 2 kernel classifier.
+    :param chunk_size: the events fit at once.
+    :param symmetric: see fit_spectra.
+
+    Returns:
+    --------
+    :rtype alm: (N, 9) the dense spectra in the order of batch.event,
+                nan for events with a single polarity, unless parity is
+                -1.
+    :rtype accuracy: (N,) the in-sample accuracy.
+    """
+    counts = diff(batch.offsets)
+    features = poly_features(batch.coords[:,0], batch.coords[:,1],
+                             batch.coords[:,2], kernel_coeff)
+    classes = where(batch.polarity > 0, 1.0, -1.0)
+
+    alm = empty((len(counts), 9), dtype=complex)
+    accuracy = empty(len(counts))
+
+    order = argsort(counts, kind='mergesort')
+    for start in range(0, len(order), chunk_size):
+        events = order[start:start+chunk_size]
+        num = counts[events]
+
+        # the position of each pick of the chunk in the padded stack
+        owner = repeat(arange(len(events)), num)
+        position = arange(len(owner)) - repeat(cumsum(num) - num, num)
+        picks = repeat(batch.offsets[events], num) + position
+
+        n = max(num.max(), 1)
+        F = zeros((len(events), n, features.shape[-1]))
+        Y = zeros((len(events), n))
+        F[owner, position] = features[picks]
+        Y[owner, position] = classes[picks]
+
+        penalty = C
+        if batch.weight is not None:
+            penalty = zeros((len(events), n))
+            penalty[owner, position] = C * batch.weight[picks]
+
+        alm[events], accuracy[events] = _fit_stack(F, Y, batch.parity,
+                                                   kernel_coeff, penalty,
+                                                   symmetric)
+
+    return alm, accuracy
+
+def fit_events(items, parity=1, kernel_coeff=1, C=1.0, table=None,
+               weight=None):
+    """
+    fit_event with solver='explicit' for many events at once, the
+    picks fit with fit_spectra and the double couples searched with
+    corr_shear_batch.
+
+    Parameters:
+    -----------
+    :param items: list of (event, data), data the (n, 3) picks of the
+                  event, as read_demo.
+    :param parity: see hash_to_classifier.
+    :param kernel_coeff, C: of the degree 2 kernel classifier.
+    :param table: the lookup table for the double couple search, see
+                  load_shear_table.
+    :param weight: the weights of the picks, see hash_to_batch.
+
+    Returns:
+    --------
+    :rtype results: list of EventResult. The Alm, accuracy,
+                    double_couple and score are None for events with a
+                    single polarity.
+    """
+    alm, accuracy = fit_batch(hash_to_batch(items, parity, weight=weight),
+                              kernel_coeff, C)
+
+    valid = ~isnan(alm).any(axis=-1)
+    solution = zeros((len(items), 3)) + nan
+    score = zeros(len(items)) + nan
+    if valid.any():
+        # the search is faster in the real basis
+        solution[valid], score[valid], _ = corr_shear_batch(
+            complex_to_real(alm[valid])[:,4:], init='table', table=table,
+            basis='real')
+
+    results = []
+    for k, (event, _) in enumerate(items):
+        if not valid[k]:
+            results.append(EventResult(event, None, None, None, None))
+            continue
+        results.append(EventResult(event, array_to_Alm(alm[k]),
+                                   accuracy[k], solution[k], score[k]))
+
+    return results
+
+def _fit_item(item, **kwargs):
+    event, inputs = item
+    return fit_event(event, inputs, **kwargs)
+
+def _record_item(worker, per_event, item):
+    with instrument.recording(instrument.Recorder(per_event)) as recorder:
+        result = worker(item)
+    return result, recorder
+
+def iter_catalog(inputs, events=None, processes=None, chunksize=1,
+                 ordered=True, **kwargs):
+    """
+    Fit the events of a catalog, yielding an EventResult per event.
+
+    Parameters:
+    -----------
+    :param inputs: the output of hash_to_classifier, a dict keyed by event,
+                   or an iterable of (event, inputs) such as
+                   iter_hash_to_classifier, consumed as the events are
+                   fit.
+    :param events: the events of the dict to fit, defaults to all of them.
+    :param processes: number of worker processes, defaults to the
+                      number of cpus. With a single process the events
+                      are fit serially, without a pool.
+    :param chunksize: number of events handed to a worker at a time.
+    :param ordered: yield results in the order of events, otherwise
+                    as they complete.
+    :param kwargs: passed through to fit_event.
+    """
+    if not isinstance(inputs, dict):
+        items = iter(inputs)
+    else:
+        if events is None:
+            events = list(inputs.keys())
+        items = ((event, inputs[event]) for event in events)
+    worker = partial(_fit_item, **kwargs)
+
+    for result in imap_items(worker, items, processes, chunksize, ordered):
+        yield result
+
+def imap_items(worker, items, processes=None, chunksize=1, ordered=True):
+    """
+    worker(item) for each of items, across a pool of worker processes.
+
+    While a recorder is installed, each worker process records into a
+    Recorder of its own, sent back with each result and merged into the
+    installed recorder, see focal_mech.lib.instrument.
+
+    :param worker: a picklable function, e.g. a module level function
+                   or a functools.partial of one.
+    :param processes, chunksize, ordered: see iter_catalog.
+    """
+    if processes is None:
+        processes = cpu_count()
+
+    if processes == 1:
+        for item in items:
+            yield worker(item)
+        return
+
+    record = instrument.enabled()
+    if record:
+        per_event = getattr(instrument.get_recorder(), "per_event", True)
+        worker = partial(_record_item, worker, per_event)
+
+    pool = Pool(processes)
+    try:
+        if ordered:
+            results = pool.imap(worker, items, chunksize)
+        else:
+            results = pool.imap_unordered(worker, items, chunksize)
+
+        for result in results:
+            if record:
+                result, recorder = result
+                instrument.merge(recorder)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def classify_catalog(inputs, events=None, processes=None, chunksize=1,
+                     ordered=True, **kwargs):
+    """
+    Fit the events of a catalog, see iter_catalog.
+
+    Returns:
+    --------
+    :rtype results: dict of EventResult keyed by event.
+    :rtype rate: the throughput, in events per second.
+    """
+    start = time.time()
+
+    results = {}
+    for result in iter_catalog(inputs, events=events, processes=processes,
+                               chunksize=chunksize, ordered=ordered,
+                               **kwargs):
+        results[result.event] = result
+
+    elapsed = time.time() - start
+    rate = len(results) / elapsed if elapsed > 0 else float("inf")
+
+    return results, rate
@@ -1,10 +1,15 @@
 from numpy import (dot, array, sign, arccos, zeros, pi, c_, arctan2,
-                         sum, pi, sqrt, conjugate, logical_and, arcsin)
+                         sum, pi, sqrt, conjugate, logical_and, arcsin,
+                         asarray, where, concatenate)
 from math import gamma
 
-from sklearn import svm
-
-from focal_mech.lib.sph_harm import sph_harm
+from focal_mech.lib.sph_harm import (sph_harm, sph_harm_matrix,
+                                     sph_harm_modes, array_to_Alm,
+                                     real_sph_harm, real_sph_harm_matrix)
+from focal_mech.lib.feature_map import (poly_features, feature_scale,
+                                        fit_explicit, fit_symmetric, MODES,
+                                        SPH_HARM_MONOMIALS)
+from focal_mech.lib import instrument
 
 
 def kernel(x, y, degree=2, coeff=1):
@@ -18,6 +23,21 @@ def kernel(x, y, degree=2, coeff=1):
                           is adequate for iso, dc and clvd classification.                             
     """
     return (dot(x,y) + coeff)**degree
+
+def has_both_polarities(data, sample_weight=None):
+    """
+    Whether the picks of positive weight are both up and down, without
+    which classify has no solution, unless the parity is -1.
+
+    Parameters:
+    -----------
+    :param data: the polarity of each pick, positive for up.
+    :param sample_weight: of each pick, see classify.
+    """
+    data = asarray(data).ravel()
+    if sample_weight is not None:
+        data = data[asarray(sample_weight).ravel() > 0]
+    return bool((data > 0).any() and (data <= 0).any())
     
 def classify(*args, **kwargs):
     """Parameters:
@@ -26,7 +46,20 @@ def classify(*args, **kwargs):
 
     :param kwargs: kernel_degree and kernel_coeff parameterize the
     kernels, 2 and 1 respectively is adequate for iso, dc and clvd
-    classification.
+    classification. solver is "svc" (default) to fit with
+    sklearn.svm.SVC, or "explicit" to fit the degree 2 kernel as a
+    linear classifier in its explicit feature space, see
+    focal_mech.lib.feature_map. Both give the same dual solution.
+    parity, 0 by default, imposes the parity of hash_to_classifier in
+    the solver, pass the picks without their antipodes,
+    hash_to_classifier(..., parity=0). The solver fits the even (1) or
+    odd (-1) part of the kernel, on half the points, see fit_symmetric,
+    and the support vectors are returned with their antipodes, as for
+    the mirrored picks. The svc solver has a bias, and only supports
+    parity 1. C, 1.0 by default, is the penalty and sample_weight, of
+    each observation, scales it, e.g. pick_weights, as for
+    sklearn.svm.SVC.fit. Both solvers raise a ValueError for picks of a
+    single polarity, see has_both_polarities.
 
     Returns:
     --------
@@ -45,6 +78,8 @@ def classify(*args, **kwargs):
     Isotropic, double couple and clvd sources can be represented in
     this basis, which makes this a convenient expansion.
 
+    The explicit solver avoids building an SVC, and fit_explicit can
+    fit a stack of events at once.
     """
     
     if 'kernel_degree' in kwargs:
@@ -57,37 +92,118 @@ def classify(*args, **kwargs):
     else:
         kernel_coeff = 1
 
+    solver = kwargs.get('solver', 'svc')
+    parity = kwargs.get('parity', 0)
+    C = kwargs.get('C', 1.0)
+    sample_weight = kwargs.get('sample_weight', None)
+
     x, y, z, data = args
     inputs = array([x.ravel(),y.ravel(),z.ravel()]).T
     classes = sign(data.ravel())
     classes[classes<=0] = -1
 
-    poly_svc = svm.SVC(kernel='poly', degree=kernel_degree, 
-                       coef0=kernel_coeff, C=1.0).fit(inputs, classes)
+    # a single polarity has no separating surface, the explicit solver
+    # would return a nan intercept, raise for both solvers as SVC does.
+    # With parity -1 the antipodes have the other polarity.
+    if parity >= 0 and not has_both_polarities(classes, sample_weight):
+        raise ValueError("The picks have a single polarity.")
+
+    if solver == 'explicit':
+        if kernel_degree != 2:
+            raise Exception("The explicit solver requires kernel_degree=2.")
+
+        with instrument.timer("classify.explicit"):
+            features = poly_features(inputs[:,0], inputs[:,1], inputs[:,2],
+                                     kernel_coeff=kernel_coeff)
+            penalty = C
+            if sample_weight is not None:
+                penalty = C * asarray(sample_weight, dtype=float).ravel()
+
+            if parity != 0:
+                weights, beta, alpha = fit_symmetric(features, classes,
+                                                     parity, C=penalty)
+            else:
+                weights, beta, alpha = fit_explicit(features, classes,
+                                                    C=penalty)
+
+        # the interior point solution is never exactly zero off the
+        # support.
+        support = alpha > 1e-6
+
+        # \beta_0
+        intercept = array([beta])
+        dual_coeff = (alpha * classes)[support]
+        support_vectors = inputs[support]
+
+        in_sample = where(features.dot(weights) + beta > 0, 1.0, -1.0)
+
+    elif solver == 'svc':
+        # sklearn is slow to import, only load it when it is used
+        from sklearn import svm
+
+        if parity < 0:
+            raise Exception("The svc solver requires parity 0 or 1.")
+
+        # gamma=1 so the kernel is (x.dot(y) + coeff)^degree, as assumed
+        # by the expansion in spherical harmonics.
+        with instrument.timer("classify.svc"):
+            if parity > 0:
+                # the even part of the kernel, each pick counting for
+                # itself and its antipode, see fit_symmetric
+                gram = 0.5 * (kernel(inputs, inputs.T, kernel_degree,
+                                     kernel_coeff) +
+                              kernel(inputs, -inputs.T, kernel_degree,
+                                     kernel_coeff))
+                poly_svc = svm.SVC(kernel='precomputed', C=2*C).fit(
+                    gram, classes, sample_weight=sample_weight)
+            else:
+                poly_svc = svm.SVC(kernel='poly', degree=kernel_degree,
+                                   gamma=1.0, coef0=kernel_coeff,
+                                   C=C).fit(inputs, classes,
+                                            sample_weight=sample_weight)
+        # n_iter_ is new in scikit-learn 1.1
+        if hasattr(poly_svc, "n_iter_"):
+            instrument.count("classify.svc.iterations",
+                             int(poly_svc.n_iter_.sum()))
+
+        n_support = poly_svc.n_support_
+        if len(n_support) > 2:
+            raise Exception("Not supported yet.")
+
+        # \beta_0
+        intercept = poly_svc.intercept_
+
+        # we only have classes : 1 or 0 (y_i ~ \pm 1)    
+        dual_coeff = poly_svc.dual_coef_[0,:]
+        support_vectors = inputs[poly_svc.support_]
+
+        if parity > 0:
+            in_sample = poly_svc.predict(gram)
+        else:
+            in_sample = poly_svc.predict(c_[inputs])
 
-    n_support = poly_svc.n_support_
-    if len(n_support) > 2:
-        raise Exception("Not supported yet.")
-
-    # \beta_0
-    intercept = poly_svc.intercept_
+    else:
+        raise Exception("Unknown solver %s" % solver)
 
-    # we only have classes : 1 or 0 (y_i ~ \pm 1)    
-    dual_coeff = poly_svc.dual_coef_[0,:]
+    if parity != 0:
+        # the classifier function is the one of the picks and their
+        # antipodes, with half the multipliers each
+        dual_coeff = 0.5 * concatenate((dual_coeff,
+                                        sign(parity) * dual_coeff))
+        support_vectors = concatenate((support_vectors, -support_vectors))
 
     num_support = len(dual_coeff)
+    instrument.count("classify.support_vectors", num_support)
 
     #we need the angles of the support vectors:
     # measured from up - the colatitude
-    theta = arccos(poly_svc.support_vectors_[:,2])
+    theta = arccos(support_vectors[:,2])
     
     # the forward half, phi > 0
     phi = zeros(num_support)
 
     # phi the angle between [-pi,pi] measured as azimuth
-    phi = arctan2(poly_svc.support_vectors_[:,1],poly_svc.support_vectors_[:,0])
-    
-    in_sample = poly_svc.predict(c_[inputs])
+    phi = arctan2(support_vectors[:,1],support_vectors[:,0])
 
     return dual_coeff, phi, theta, intercept, in_sample
 
@@ -110,7 +226,8 @@ def calc_00(intercept, kernel_degree=2):
 
     return intercept  / norm
 
-def calc_alm(dual_coeff, phi, theta, elle, emm, kernel_degree=2):
+def calc_alm(dual_coeff, phi, theta, elle, emm, kernel_degree=2,
+             basis='complex'):
     """Computes the spectral content of the classifier function estimated by 
     the support vector machine. 
 
@@ -132,6 +249,9 @@ def calc_alm(dual_coeff, phi, theta, elle, emm, kernel_degree=2):
     :param kernel_degree: must be an integer, for the kernel used
     (<x,x'> + 1)^d, use the default for focal mechanism
     classification.
+
+    :param basis: 'complex', or 'real' for the coefficient of the real
+                  harmonic S_lm, see real_sph_harm_matrix.
                        
     Returns:
     --------
@@ -148,10 +268,56 @@ def calc_alm(dual_coeff, phi, theta, elle, emm, kernel_degree=2):
     # from the addition theorem
     norm *= 4 * pi / (2.0 * elle + 1)
 
+    if basis == 'real':
+        return sum(real_sph_harm(emm, elle, phi, theta) * dual_coeff) * norm
+
     # scipy does y_ml (with -l <= m <= l)
     # rather than y_lm (convention used in Jackson)
     return sum(conjugate(sph_harm(emm, elle, phi, theta) ) * dual_coeff) * norm
 
+def translate_to_coeffs(*args, **kwargs):
+    """
+    Take the results of the classification (using kernels) and
+    translate the result to a basis of spherical harmonics, as a dense
+    array.
+
+    All the modes are evaluated in one pass over the support vectors,
+    see sph_harm_matrix.
+
+    :param args: pass the output of classify
+    :param basis: 'complex', or 'real' for the real coefficients in the
+                  basis of real_sph_harm_matrix, half the work and
+                  memory. See complex_to_real, real_to_Alm.
+    :rtype alm: the spectrum of the classifier function, ordered
+                [Alm[0,0], Alm[1,-1], Alm[1,0], ..., Alm[l,l]] up to
+                l = kernel_degree, see sph_harm_modes.
+    """
+
+    kernel_degree = kwargs.pop("kernel_degree",2)
+    basis = kwargs.pop("basis", 'complex')
+
+    dual_coeff, phi, theta, intercept, _ = args
+
+    l, m = sph_harm_modes(kernel_degree)
+
+    # Scholkopf and Smola, page 113, eq 4.72 coefficient a_l, l>kernel_degree=0
+    norm = array([scholkopf_norm(elle, kernel_degree)
+                  for elle in range(kernel_degree+1)])
+    # from the addition theorem
+    norm = norm[l] * 4 * pi / (2.0 * l + 1)
+
+    with instrument.timer("translate_to_sphharm"):
+        if basis == 'real':
+            S = real_sph_harm_matrix(kernel_degree, phi, theta)
+            alm = S.dot(dual_coeff) * norm
+        else:
+            Y = sph_harm_matrix(kernel_degree, phi, theta)
+            alm = conjugate(Y).dot(dual_coeff) * norm
+
+    alm[0] = calc_00(intercept, kernel_degree)[0]
+
+    return alm
+
 def translate_to_sphharm(*args, **kwargs):
     """
     
@@ -162,17 +328,41 @@ def translate_to_sphharm(*args, **kwargs):
     :rtype Alm: the spectrum of the classifier function.
     """
 
-    kernel_degree = kwargs.pop("kernel_degree",2)
-    
-    dual_coeff, phi, theta, intercept, _ = args
-    
-    # Scholkopf and Smola, page 113, eq 4.72 coefficient a_l, l>kernel_degree=0
+    return array_to_Alm(translate_to_coeffs(*args, **kwargs))
+
+def explicit_to_sphharm(weights, intercept, kernel_coeff=1):
+    """
+    Closed form spectrum of the degree 2 classifier function fit in
+    its explicit feature space,
+
+    f(x) = weights.dot(poly_features(x)) + intercept
+
+    Since weights = \sum_i dual_coeff[i] poly_features(x_i), the sum
+    over support vectors in calc_alm is a fixed linear map of the
+    weights, and this gives the same Alm as translate_to_sphharm.
+
+    Parameters:
+    -----------
+    :param weights: (10,) or (N, 10) weights, see fit_explicit.
+    :param intercept: scalar or (N,) the bias.
+    :param kernel_coeff: the kernel coeff used to build the features.
+
+    Returns:
+    --------
+    :rtype Alm: A dict Alm[l,m] containing the spectrum in the sph_harm
+                basis. For stacked weights each entry is an array over
+                the events.
+    """
+    weights = asarray(weights, dtype=float)
+
+    # \sum_i dual_coeff[i] x_i^a y_i^b z_i^c
+    moments = weights / feature_scale(kernel_coeff)
+    spectrum = moments.dot(SPH_HARM_MONOMIALS.T)
+
     Alm = {}
     Alm[0,0] = calc_00(intercept)
-    Alm[0,0] = Alm[0,0][0]
-    for l in range(1,kernel_degree+1):
-        for m in range(-l,l+1):            
-            Alm[(l,m)] = calc_alm(dual_coeff, phi, theta, l, m)
-    
-    return Alm
+    for k, (l, m) in enumerate(MODES):
+        norm = scholkopf_norm(l, 2) * 4 * pi / (2.0 * l + 1)
+        Alm[l,m] = spectrum[...,k] * norm
 
+    return Alm
@@ -1,48 +1,111 @@
 
-from numpy import (pi, rad2deg, inner, array, zeros, mgrid,
-                       argmin)
-from scipy.linalg import norm
-from scipy.optimize import minimize
+from functools import partial
 
-from focal_mech.lib.sph_harm import WignerD2
+from numpy import (pi, rad2deg, array, zeros, mgrid,
+                       argmin, abs, dot, stack, sign, newaxis, matmul,
+                       asarray, arange, empty, maximum, argmax, sqrt, mod,
+                       where, deg2rad, ones)
+from numpy.linalg import eigh, det
+
+from focal_mech.lib.sph_harm import real_transform
+from focal_mech.lib.feature_map import SPH_HARM_MONOMIALS
+from focal_mech.lib.rotation_table import (shear_templates, matrix_to_euler,
+                                           table_shear, real_shear_templates,
+                                           real_shear_table,
+                                           polarity_templates)
+from focal_mech.lib import instrument
 
 
 def _corr_shear(x, alm):
     """
-    Rotates the (13),(31) double couple source you can 
-    find in Ben-Menahem and Singh. Monopole, dipole 
+    Rotates the (13),(31) double couple source you can
+    find in Ben-Menahem and Singh. Monopole, dipole
     terms for this source are zero.
+
+    The angles in x may be arrays, to evaluate many rotations at once.
     """
-    
+
     strike, dip, rake = x
-    # Wigner is ZYZ Euler rotation, \gamma = -rake
-    D = WignerD2(strike, dip, -rake).conjugate()
-    # Template Spectrum : glm = (0, -1j, 0, -1j, 0)
-    prop = (inner(D[:,3], alm) + inner(D[:,1], alm))*1j
+    prop = dot(shear_templates(strike, dip, rake), alm)
     # Maximize, not minimize.
-    return -norm(prop)
+    return -abs(prop)
 
-def _scan_shear(alm):
+def _scan_shear(alm, resolution=10):
     """
-    :param alm: Quadrupole components. 
+    :param alm: Quadrupole components.
+    :param resolution: number of grid points along each angle.
 
     Scans for the best starting point, the optimization
     can get stuck otherwise.
     """
-   
+
     # scan for a good starting point
-    X, Y, Z = mgrid[0:2*pi:10j, 0:pi:10j, 0:2*pi:10j]
-    x0s = zip(X.ravel(),Y.ravel(),Z.ravel())
-    res = [_corr_shear(x0, alm) for x0 in x0s]
-    x0 = x0s[argmin(res)]
+    n = resolution * 1j
+    X, Y, Z = mgrid[0:2*pi:n, 0:pi:n, 0:2*pi:n]
+    X, Y, Z = X.ravel(), Y.ravel(), Z.ravel()
+    res = _corr_shear((X, Y, Z), alm)
+    instrument.count("corr_shear.scan.evaluations", len(X))
+    best = argmin(res)
+
+    return X[best], Y[best], Z[best]
+
+def quadrupole_tensor(alm):
+    """
+    The real symmetric, traceless tensor M with
+
+    x.dot(M).dot(x) = sum_m alm[m] Y_2m(x)
+
+    on the unit sphere.
 
-    print x0
-    
-    return x0
-    
-def corr_shear(Alm):
+    :param alm: Quadrupole components, Alm[2,-2] ... Alm[2,2], or an
+                (N, 5) stack of them.
+    :rtype M: (3, 3) or (N, 3, 3)
     """
-    :param Alm: the spectrum of the classifier function. 
+    # Y_2m in terms of (xx, yy, zz, xy, xz, yz)
+    c = dot(alm, SPH_HARM_MONOMIALS[3:,4:].conjugate()).real
+    xx, yy, zz = c[...,0], c[...,1], c[...,2]
+    xy, xz, yz = c[...,3]/2, c[...,4]/2, c[...,5]/2
+
+    return stack([stack([xx, xy, xz], axis=-1),
+                  stack([xy, yy, yz], axis=-1),
+                  stack([xz, yz, zz], axis=-1)], axis=-2)
+
+def _analytic_shear(alm):
+    """
+    :param alm: Quadrupole components, or an (N, 5) stack of them.
+
+    The double couple aligned with the principal axes of the
+    quadrupole tensor, which is the best double couple when the
+    source is a pure double couple.
+    """
+    # eigenvalues in ascending order, so the columns are the P, null
+    # and T axis, reorder to (T, null, P).
+    _, axes = eigh(quadrupole_tensor(alm))
+    axes = axes[...,::-1]
+
+    # keep it a proper rotation
+    axes[...,1] *= sign(det(axes))[...,newaxis]
+
+    # principal axes (T, null, P) of the template, 2yz
+    h = 0.5**0.5
+    template = array([[0, h, h],
+                      [1, 0, 0],
+                      [0, h, -h]])
+
+    # rotate the template axes onto the axes of the tensor
+    return matrix_to_euler(matmul(axes, template))
+
+def corr_shear(Alm, init='analytic', resolution=10, table=None):
+    """
+    :param Alm: the spectrum of the classifier function.
+    :param init: how to pick the starting point of the optimization,
+                 'analytic' from the principal axes of the quadrupole
+                 tensor, 'table' for the best rotation in the lookup
+                 table of rotated templates, or 'scan' for a grid search.
+    :param resolution: number of grid points along each angle of the
+                       scan.
+    :param table: the lookup table for init='table', see
+                  focal_mech.lib.rotation_table.load_shear_table.
 
     Scans for the best starting point, the optimization
     can get stuck otherwise.
@@ -52,15 +115,257 @@ def corr_shear(Alm):
     alm = array([Alm[2,-2], Alm[2,-1],
                  Alm[2,0],
                  Alm[2,1],Alm[2,2]])
-    
+
     # pick a good starting point.
-    x0 = _scan_shear(alm)
+    with instrument.timer("corr_shear.init.%s" % init):
+        if init == 'analytic':
+            x0 = _analytic_shear(alm)
+        elif init == 'table':
+            x0 = table_shear(alm, table)
+        elif init == 'scan':
+            x0 = _scan_shear(alm, resolution)
+        else:
+            raise Exception("Unknown init %s" % init)
+
+    # scipy is slow to import, only load it when it is used
+    from scipy.optimize import minimize
 
     f = lambda x : _corr_shear(x,alm)
-    results = minimize(f, x0=x0,
-                    bounds=((0,2*pi), (0,pi), (0,2*pi)))
+    with instrument.timer("corr_shear.minimize"):
+        results = minimize(f, x0=x0,
+                        bounds=((0,2*pi), (0,pi), (0,2*pi)))
+    instrument.count("corr_shear.minimize.iterations", results.nit)
+    instrument.count("corr_shear.minimize.evaluations", results.nfev)
 
     return rad2deg(results.x), results.fun
-    
+
+def _shear_objective(x, alm, templates=shear_templates):
+    # |correlation|^2, smooth where the correlation is not zero.
+    prop = (templates(x[...,0], x[...,1], x[...,2]) *
+            alm[:,newaxis,:]).sum(axis=-1)
+    return abs(prop)**2
+
+# offsets of the finite difference stencil, the centre, +-e_i, and
+# +-e_i +-e_j for i < j.
+_pairs = [(0, 1), (0, 2), (1, 2)]
+_stencil = [zeros(3)]
+for _i in range(3):
+    for _s in (1, -1):
+        _e = zeros(3)
+        _e[_i] = _s
+        _stencil.append(_e)
+for _i, _j in _pairs:
+    for _si, _sj in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+        _e = zeros(3)
+        _e[_i] = _si
+        _e[_j] = _sj
+        _stencil.append(_e)
+_stencil = array(_stencil)
+
+def _refine_shear(x, alm, tol=1e-10, max_iter=50, step=1e-3,
+                  templates=shear_templates):
+    """
+    Damped Newton ascent of the correlation for a stack of events at
+    once, with finite difference derivatives. Events drop out as they
+    converge.
+
+    :param x: (N, 3) starting angles.
+    :param alm: (N, 5) quadrupole components, or the spectra matching
+                templates.
+    :param tol: convergence tolerance on the Newton step, in radians.
+    :param step: finite difference step, in radians.
+    :param templates: shear_templates, real_shear_templates for real
+                      coefficients, or polarity_templates.
+
+    :rtype x: (N, 3) the refined angles.
+    :rtype converged: (N,) mask of the events that converged.
+    """
+    x = array(x, dtype=float)
+    N = len(x)
+    h = step
+
+    # backtracking line search, tried all at once.
+    lengths = 0.5**arange(8)
+
+    converged = zeros(N, dtype=bool)
+    iterations = evaluations = 0
+    for it in range(max_iter):
+        k = (~converged).nonzero()[0]
+        if len(k) == 0:
+            break
+        iterations += 1
+        evaluations += len(k) * (len(_stencil) + len(lengths))
+
+        F = _shear_objective(x[k,newaxis,:] + h*_stencil, alm[k], templates)
+        f0 = F[:,0]
+
+        grad = (F[:,1:7:2] - F[:,2:7:2]) / (2*h)
+
+        hess = empty((len(k), 3, 3))
+        for i in range(3):
+            hess[:,i,i] = (F[:,1+2*i] - 2*f0 + F[:,2+2*i]) / h**2
+        for n, (i, j) in enumerate(_pairs):
+            pp, pm, mp, mm = F[:,7+4*n:11+4*n].T
+            hess[:,i,j] = hess[:,j,i] = (pp - pm - mp + mm) / (4*h**2)
+
+        # ascent direction, Newton with the curvature made negative
+        # definite.
+        w, v = eigh(hess)
+        w = maximum(abs(w), 1e-8 * abs(w).max(axis=-1)[:,newaxis] + 1e-300)
+        p = matmul(grad[:,newaxis,:], v)[:,0] / w
+        p = matmul(v, p[...,newaxis])[...,0]
+
+        trial = x[k,newaxis,:] + lengths[:,newaxis] * p[:,newaxis,:]
+        improved = _shear_objective(trial, alm[k], templates) > f0[:,newaxis]
+
+        # the longest step that improves, if any
+        found = improved.any(axis=-1)
+        first = argmax(improved, axis=-1)
+        dx = lengths[first][:,newaxis] * p
+        dx[~found] = 0
+        x[k] += dx
+
+        done = ~found | (sqrt((dx*dx).sum(axis=-1)) < tol)
+        converged[k[done]] = True
+
+    instrument.count("corr_shear_batch.iterations", iterations)
+    instrument.count("corr_shear_batch.evaluations", evaluations)
+
+    return x, converged
+
+def _canonical_shear(x):
+    """
+    Wrap (strike, dip, rake) into the bounds of corr_shear, using
+    (strike, -dip, rake) = (strike + pi, dip, rake - pi).
+    """
+    strike, dip, rake = x[:,0], mod(x[:,1], 2*pi), x[:,2]
+
+    flip = dip > pi
+    dip = where(flip, 2*pi - dip, dip)
+    strike = where(flip, strike + pi, strike)
+    rake = where(flip, rake - pi, rake)
+
+    return stack([mod(strike, 2*pi), dip, mod(rake, 2*pi)], axis=-1)
+
+def _analytic_start(alm, basis='complex'):
+    quadrupole = alm
+    if basis == 'real':
+        quadrupole = dot(alm, real_transform(2).conjugate())
+    return stack(_analytic_shear(quadrupole), axis=-1)
+
+def corr_shear_batch(alm, init='table', table=None, tol=1e-10, max_iter=50,
+                     basis='complex'):
+    """
+    corr_shear for many events at once.
+
+    :param alm: (N, 5) quadrupole components, Alm[2,-2] ... Alm[2,2]
+                of each event.
+    :param init: 'table' to start from the best rotation in the lookup
+                 table of rotated templates, one matrix product for all
+                 the events, or 'analytic' from the principal axes of
+                 the quadrupole tensors. Or (strike, dip, rake) in
+                 degrees, (3,) or (N, 3), to warm start from a nearby
+                 solution, e.g. of the same event with a few picks
+                 changed. Where the analytic start scores better, it
+                 is refined instead.
+    :param table: the lookup table for init='table', see
+                  focal_mech.lib.rotation_table.load_shear_table.
+    :param tol, max_iter: convergence of the Newton refinement.
+    :param basis: 'complex', or 'real' for alm the real coefficients of
+                  the basis of real_sph_harm_matrix, see
+                  complex_to_real. The search is then real arithmetic
+                  throughout.
+
+    Returns:
+    --------
+    :rtype solution: (N, 3) strike, dip, rake in degrees.
+    :rtype score: (N,) the correlation, -corr_shear(Alm)[1].
+    :rtype converged: (N,) mask of the events whose refinement converged.
+    """
+    if basis == 'real':
+        alm = asarray(alm, dtype=float)
+        templates = real_shear_templates
+    else:
+        alm = asarray(alm, dtype=complex)
+        templates = shear_templates
+
+    warm = not isinstance(init, str)
+    with instrument.timer("corr_shear_batch.init.%s"
+                          % ("warm" if warm else init)):
+        if warm:
+            x0 = deg2rad(asarray(init, dtype=float)) * ones((len(alm), 1))
+            x_a = _analytic_start(alm, basis)
+            better = (_shear_objective(x_a[:,newaxis,:], alm, templates) >
+                      _shear_objective(x0[:,newaxis,:], alm,
+                                       templates))[:,0]
+            x0[better] = x_a[better]
+        elif init == 'table':
+            if basis == 'real':
+                table = real_shear_table(table)
+            x0 = table_shear(alm, table)
+        elif init == 'analytic':
+            x0 = _analytic_start(alm, basis)
+        else:
+            raise Exception("Unknown init %s" % init)
+
+    with instrument.timer("corr_shear_batch.refine"):
+        x, converged = _refine_shear(x0, alm, tol=tol, max_iter=max_iter,
+                                     templates=templates)
+    instrument.count("corr_shear_batch.events", len(alm))
+    x = _canonical_shear(x)
+
+    score = sqrt(_shear_objective(x[:,newaxis,:], alm, templates)[:,0])
+
+    return rad2deg(x), score, converged
+
+def corr_shear_spectrum(alm, lmax=None, init='table', table=None, tol=1e-10,
+                        max_iter=50):
+    """
+    corr_shear_batch on the full spectra, e.g. of classify with a
+    kernel_degree above 2, correlating every degree up to lmax with
+    the polarities of the double couple rather than the quadrupole
+    alone, see polarity_templates.
+
+    Starts from corr_shear_batch on the quadrupoles, then refines on
+    the full spectra. The odd degrees do not correlate with the
+    polarities of a double couple.
+
+    :param alm: (N, (L+1)**2) dense spectra, ordered as sph_harm_modes,
+                with L >= 2, see Alm_to_array.
+    :param lmax: the highest degree correlated, L by default.
+    :param init, table: the start of corr_shear_batch.
+    :param tol, max_iter: convergence of the Newton refinement.
+
+    Returns:
+    --------
+    :rtype solution: (N, 3) strike, dip, rake in degrees.
+    :rtype score: (N,) the correlation with the polarity template, the
+                  score of corr_shear_batch for lmax=2.
+    :rtype converged: (N,) mask of the events whose refinement converged.
+    """
+    alm = asarray(alm, dtype=complex)
+    if lmax is None:
+        lmax = int(round(sqrt(alm.shape[-1]))) - 1
+    if lmax < 2 or alm.shape[-1] < (lmax+1)**2:
+        raise Exception("Spectra of degree %d, correlated up to %d"
+                        % (int(round(sqrt(alm.shape[-1]))) - 1, lmax))
+    alm = alm[:,:(lmax+1)**2]
+
+    x0, score, converged = corr_shear_batch(alm[:,4:9], init=init,
+                                            table=table, tol=tol,
+                                            max_iter=max_iter)
+    if lmax == 2:
+        return x0, score, converged
+
+    templates = partial(polarity_templates, lmax=lmax)
+    with instrument.timer("corr_shear_spectrum.refine"):
+        x, converged = _refine_shear(deg2rad(x0), alm, tol=tol,
+                                     max_iter=max_iter, templates=templates)
+    x = _canonical_shear(x)
+
+    score = sqrt(_shear_objective(x[:,newaxis,:], alm, templates)[:,0])
+
+    return rad2deg(x), score, converged
+
 def corr_tensile(Alm):
     raise Exception("Method not implemented")
@@ -0,0 +1,441 @@
+"""
+Solve the degree 2 polynomial kernel classifier in its explicit feature
+space.
+
+On the unit sphere the kernel (x.dot(y) + coeff)^2 is the inner product
+of a 10 component feature map, so the classifier function is a quadratic
+form in (x, y, z) and the support vector machine reduces to a linear one
+with 10 weights and a bias. The weights project onto the spherical
+harmonics in closed form, see explicit_to_sphharm.
+
+The antipode of a pick only changes the sign of the linear features,
+of degree 1, see ANTIPODE. A fit of the picks and their antipodes, as
+hash_to_classifier builds for parity != 0, only has even (parity 1) or
+odd (parity -1) weights, and fit_symmetric solves for those from the
+picks alone.
+"""
+from numpy import (asarray, sqrt, pi, ones, zeros, eye, matmul, concatenate,
+                   newaxis, inf, nan, abs, array, stack, full, isnan, clip,
+                   sign, where, maximum)
+from numpy.linalg import solve
+
+from focal_mech.lib import instrument
+
+
+# the modes of the spectrum, in the order of the rows of SPH_HARM_MONOMIALS
+MODES = [(1,-1), (1,0), (1,1),
+         (2,-2), (2,-1), (2,0), (2,1), (2,2)]
+
+def _conjugate_sph_harm_coeffs():
+    """
+    Coefficients of the monomials (1, x, y, z, xx, yy, zz, xy, xz, yz)
+    in Y*_lm on the unit sphere, with the Condon-Shortley phase of
+    focal_mech.lib.sph_harm.sph_harm.
+    """
+    a1 = 0.5 * sqrt(3.0 / (2.0 * pi))
+    a0 = 0.5 * sqrt(3.0 / pi)
+    b2 = 0.25 * sqrt(15.0 / (2.0 * pi))
+    b1 = 0.5 * sqrt(15.0 / (2.0 * pi))
+    b0 = 0.25 * sqrt(5.0 / pi)
+
+    coeffs = zeros([len(MODES), 10], dtype=complex)
+    # l = 1, (x, y, z)
+    coeffs[0,1:4] = [-a1, -1j*a1, 0]
+    coeffs[1,1:4] = [0, 0, a0]
+    coeffs[2,1:4] = [a1, -1j*a1, 0]
+
+    # l = 2, (xx, yy, zz, xy, xz, yz)
+    coeffs[3,4:] = [b2, -b2, 0, 2j*b2, 0, 0]
+    coeffs[4,4:] = [0, 0, 0, 0, -b1, -1j*b1]
+    # 3z^2 - 1 = 2z^2 - x^2 - y^2 on the sphere
+    coeffs[5,4:] = [-b0, -b0, 2*b0, 0, 0, 0]
+    coeffs[6,4:] = [0, 0, 0, 0, b1, -1j*b1]
+    coeffs[7,4:] = [b2, -b2, 0, -2j*b2, 0, 0]
+
+    return coeffs
+
+SPH_HARM_MONOMIALS = _conjugate_sph_harm_coeffs()
+
+def feature_scale(kernel_coeff=1):
+    """
+    The scale of each monomial in the feature map of the kernel
+    (x.dot(y) + kernel_coeff)^2.
+    """
+    c = float(kernel_coeff)
+    return array([c,
+                  sqrt(2*c), sqrt(2*c), sqrt(2*c),
+                  1.0, 1.0, 1.0,
+                  sqrt(2.0), sqrt(2.0), sqrt(2.0)])
+
+def poly_features(x, y, z, kernel_coeff=1):
+    """
+    Explicit feature map of the kernel (x.dot(y) + kernel_coeff)^2, such
+    that kernel(a, b) = poly_features(*a).dot(poly_features(*b)).
+
+    Parameters:
+    -----------
+    :param x, y, z: cartesian coords, of any (matching) shape.
+
+    Returns:
+    --------
+    :rtype features: array of shape x.shape + (10,)
+    """
+    x = asarray(x, dtype=float)
+    y = asarray(y, dtype=float)
+    z = asarray(z, dtype=float)
+
+    monomials = stack([ones(x.shape), x, y, z,
+                       x*x, y*y, z*z, x*y, x*z, y*z], axis=-1)
+
+    return monomials * feature_scale(kernel_coeff)
+
+# poly_features(-x, -y, -z) is poly_features(x, y, z) * ANTIPODE, the
+# linear monomials change sign
+ANTIPODE = array([1, -1, -1, -1, 1, 1, 1, 1, 1, 1])
+
+def _step_length(x, dx):
+    """
+    Largest step in [0,1] along dx keeping x positive, per event.
+    """
+    ratio = full(x.shape, inf)
+    decrease = dx < 0
+    ratio[decrease] = -x[decrease] / dx[decrease]
+    step = ratio.min(axis=-1)
+    step[step > 1] = 1.0
+    return step
+
+def fit_explicit(features, classes, C=1.0, tol=1e-6, max_iter=50,
+                 warm_start=None, fit_intercept=True):
+    """
+    Fit the soft margin support vector machine in an explicit feature
+    space, solving the dual problem with a primal-dual interior point
+    method (Mehrotra predictor-corrector).
+
+    The dual is the one solved by sklearn.svm.SVC, so for the same
+    kernel the weights and bias agree with SVC within its tolerance.
+    Each Newton step is a (d+1)x(d+1) linear solve in the space of the
+    weights and bias, so the cost is linear in the number of picks. A
+    single event is solved without the padding of the stack, whose
+    overhead dominates the fit of a few dozen picks.
+
+    Parameters:
+    -----------
+    :param features: (n, d) features of each observation, e.g. from
+                     poly_features. Pass (N, n, d) to fit N events at
+                     once.
+    :param classes: (n,) or (N, n) the class of each observation, -1 or
+                    1. Zero marks padding, for stacking events with
+                    different numbers of observations. Events with a
+                    single class have no solution, their weights and
+                    bias are nan.
+    :param C: the penalty, a scalar or an array matching classes, e.g.
+              scaled by the weight of each observation. A zero penalty
+              drops the observation, as padding.
+    :param tol: tolerance on the KKT residuals and the duality gap.
+    :param max_iter: maximum number of interior point iterations.
+    :param warm_start: (alpha, intercept) to start from, e.g. the
+                       solution for nearly the same observations. The
+                       multipliers are pulled into the interior, nan
+                       ones, e.g. of new observations, start at C/2.
+    :param fit_intercept: fit the bias, otherwise it is zero and there
+                          is no equality constraint on alpha, so events
+                          with a single class have a solution.
+
+    Returns:
+    --------
+    :rtype weights: (d,) or (N, d), w = sum_i alpha_i y_i features_i
+    :rtype intercept: scalar or (N,), the bias b of w.dot(features) + b
+    :rtype alpha: (n,) or (N, n) the lagrange multipliers.
+    """
+    features = asarray(features, dtype=float)
+    classes = asarray(classes, dtype=float)
+
+    single = classes.ndim == 1
+    if single:
+        features = features[newaxis]
+        classes = classes[newaxis]
+
+    N, n, d = features.shape
+
+    C = C * ones((N,n))
+    dropped = C <= 0
+    if dropped.any():
+        classes = where(dropped, 0.0, classes)
+        C = where(dropped, 1.0, C)
+
+    # rows of U are (y_i features_i, y_i), so U.dot((w,b)) = y_i f(x_i),
+    # (y_i features_i, 0) without the intercept
+    bias = classes if fit_intercept else zeros((N,n))
+    U = concatenate((features * classes[...,newaxis], bias[...,newaxis]),
+                    axis=-1)
+
+    alpha = 0.5 * C
+    z = ones((N,n))
+    u = ones((N,n))
+    b = zeros(N)
+
+    if warm_start is not None:
+        alpha0, b0 = warm_start
+        alpha0 = alpha0 * ones((N,n))
+        known = ~isnan(alpha0)
+        alpha[known] = clip(alpha0[known], 0.05*C[known], 0.95*C[known])
+        if fit_intercept:
+            b = b0 * ones(N)
+
+    # there is no separating surface with a single class
+    if fit_intercept:
+        valid = (classes > 0).any(axis=-1) & (classes < 0).any(axis=-1)
+    else:
+        valid = (classes != 0).any(axis=-1)
+
+    iterations = 0
+    if single:
+        # the steps of a few dozen observations cost the overhead of
+        # the stacking, solve the event without the padding instead
+        if valid[0]:
+            keep = classes[0] != 0
+            (alpha[0,keep], b[0],
+             iterations) = _fit_single(U[0,keep], classes[0,keep],
+                                       C[0,keep], alpha[0,keep], b[0],
+                                       tol, max_iter, fit_intercept)
+    else:
+        active = valid.copy()
+        for it in range(max_iter):
+            k = active.nonzero()[0]
+            if len(k) == 0:
+                break
+            iterations += 1
+
+            if len(k) == N:
+                (alpha, z, u, b,
+                 converged) = _interior_point_step(U, classes, C,
+                                                   alpha, z, u, b, tol,
+                                                   fit_intercept)
+            else:
+                (alpha[k], z[k], u[k], b[k],
+                 converged) = _interior_point_step(U[k], classes[k], C[k],
+                                                   alpha[k], z[k], u[k],
+                                                   b[k], tol,
+                                                   fit_intercept)
+            active[k[converged]] = False
+
+    instrument.count("fit_explicit.events", N)
+    instrument.count("fit_explicit.iterations", iterations)
+
+    weights = matmul(alpha[:,newaxis], U[...,:d])[:,0]
+    intercept = b
+    alpha[dropped] = 0
+
+    weights[~valid] = nan
+    intercept[~valid] = nan
+
+    if single:
+        return weights[0], intercept[0], alpha[0]
+
+    return weights, intercept, alpha
+
+def _interior_point_step(U, y, C, alpha, z, u, b, tol, fit_intercept=True):
+    """
+    One predictor-corrector step for a stack of events, see
+    fit_explicit. Returns the updated (alpha, z, u, b) and which events
+    had already converged, these are left unchanged. Without the
+    intercept the last column of U is zero, and so are the bias and its
+    steps.
+
+    The padding, y = 0, is left out of the duality gap and does not
+    move, so the solution of an event does not depend on it.
+    """
+    N, n, d = U.shape
+    d -= 1
+
+    real = y != 0
+    m = 2.0 * maximum(real.sum(axis=-1), 1)
+
+    s = C - alpha
+    wb = concatenate((matmul(alpha[:,newaxis], U[...,:d])[:,0],
+                      b[:,newaxis]), axis=-1)
+
+    # residuals of the KKT conditions
+    rd = where(real, matmul(U, wb[...,newaxis])[...,0] - 1.0 - z + u, 0)
+    if fit_intercept:
+        re = (y * alpha).sum(axis=-1)
+    else:
+        re = zeros(N)
+    mu = where(real, alpha*z + s*u, 0).sum(axis=-1) / m
+
+    converged = ((mu < tol) & (abs(re) < tol) &
+                 (abs(rd).max(axis=-1) < tol))
+    if converged.all():
+        return alpha, z, u, b, converged
+
+    # Newton steps reduce to a linear solve for the weights and bias,
+    # the bias is not regularized.
+    Di = 1.0 / (z/alpha + u/s)
+    UD = U * Di[...,newaxis]
+    E = eye(d+1)
+    if fit_intercept:
+        E[d,d] = 0
+    G = E + matmul(U.transpose(0,2,1), UD)
+
+    def newton(r):
+        rhs = matmul(r[:,newaxis], UD)[:,0]
+        rhs[:,d] += re
+        dwb = solve(G, rhs[...,newaxis])[...,0]
+        dalpha = Di * (r - matmul(U, dwb[...,newaxis])[...,0])
+        return dalpha, dwb[:,d]
+
+    # predictor
+    dalpha, db = newton(-rd - z + u)
+    dz = -z - z*dalpha/alpha
+    du = -u + u*dalpha/s
+    dalpha, dz, du = [where(real, step, 0) for step in (dalpha, dz, du)]
+
+    x = concatenate((alpha, s, z, u), axis=-1)
+    dx = concatenate((dalpha, -dalpha, dz, du), axis=-1)
+    t = _step_length(x, dx)[:,newaxis]
+    mu_aff = where(real, (alpha + t*dalpha)*(z + t*dz) +
+                   (s - t*dalpha)*(u + t*du), 0).sum(axis=-1) / m
+    sigma_mu = ((mu_aff / mu)**3 * mu)[:,newaxis]
+
+    # corrector
+    rz = sigma_mu - alpha*z - dalpha*dz
+    ru = sigma_mu - s*u + dalpha*du
+    dalpha, db = newton(-rd + rz/alpha - ru/s)
+    dz = (rz - z*dalpha) / alpha
+    du = (ru + u*dalpha) / s
+    dalpha, dz, du = [where(real, step, 0) for step in (dalpha, dz, du)]
+
+    dx = concatenate((dalpha, -dalpha, dz, du), axis=-1)
+    t = 0.995 * _step_length(x, dx)
+    t[converged] = 0
+    t = t[:,newaxis]
+
+    return (alpha + t*dalpha, z + t*dz, u + t*du, b + t[:,0]*db,
+            converged)
+
+def _max_step(x, dx):
+    """
+    _step_length of a single event, without the indexing, x > 0.
+    """
+    return 1.0 / max(1.0, (-dx / x).max())
+
+def _fit_single(U, y, C, alpha, b, tol, max_iter, fit_intercept=True):
+    """
+    The interior point steps of _interior_point_step for a single event
+    without padding, (n, d+1) U and (n,) y, C and alpha. Returns alpha,
+    the bias and the number of iterations, counted as fit_explicit does.
+    """
+    n, d = U.shape
+    d -= 1
+    m = 2.0 * n
+
+    V = U[:,:d]
+    z = ones(n)
+    u = ones(n)
+    E = eye(d+1)
+    if fit_intercept:
+        E[d,d] = 0
+    wb = zeros(d+1)
+
+    for it in range(max_iter):
+        s = C - alpha
+        wb[:d] = alpha.dot(V)
+        wb[d] = b
+
+        # residuals of the KKT conditions, the right hand side of the
+        # predictor is -rd - z + u
+        r = 1.0 - U.dot(wb)
+        rd = u - z - r
+        re = y.dot(alpha) if fit_intercept else 0.0
+        mu = (alpha.dot(z) + s.dot(u)) / m
+
+        if mu < tol and abs(re) < tol and abs(rd).max() < tol:
+            return alpha, b, it + 1
+
+        za = z / alpha
+        us = u / s
+        Di = 1.0 / (za + us)
+        UD = U * Di[:,newaxis]
+        G = E + U.T.dot(UD)
+
+        # predictor
+        rhs = r.dot(UD)
+        rhs[d] += re
+        dalpha = Di * (r - U.dot(solve(G, rhs)))
+        dz = -z - za*dalpha
+        du = -u + us*dalpha
+
+        x = concatenate((alpha, s, z, u))
+        dx = concatenate((dalpha, -dalpha, dz, du))
+        xt = x + _max_step(x, dx)*dx
+        mu_aff = (xt[:n].dot(xt[2*n:3*n]) + xt[n:2*n].dot(xt[3*n:])) / m
+        sigma_mu = (mu_aff / mu)**3 * mu
+
+        # corrector
+        rz = sigma_mu - alpha*z - dalpha*dz
+        ru = sigma_mu - s*u + dalpha*du
+        r = rz/alpha - ru/s - rd
+        rhs = r.dot(UD)
+        rhs[d] += re
+        dwb = solve(G, rhs)
+        dalpha = Di * (r - U.dot(dwb))
+        dz = (rz - z*dalpha) / alpha
+        du = (ru + u*dalpha) / s
+
+        dx = concatenate((dalpha, -dalpha, dz, du))
+        t = 0.995 * _max_step(x, dx)
+        x = x + t*dx
+        alpha, z, u = x[:n], x[2*n:3*n], x[3*n:]
+        b = b + t*dwb[d]
+
+    return alpha, b, max_iter
+
+def fit_symmetric(features, classes, parity, C=1.0, **kwargs):
+    """
+    fit_explicit of the observations and their antipodes, of class
+    sign(parity) times theirs, from the observations alone.
+
+    The mirrored problem is unchanged by flipping the sign of the odd
+    weights (parity 1), or of the even weights and the bias (parity -1),
+    so its solution has none. What is left is the fit of the even, or
+    odd, features of the observations, each counting twice, that is
+    with the penalty 2 C, and without the bias for parity -1. It has
+    half the observations and 7, or 3, of the 10 weights.
+
+    Parameters:
+    -----------
+    :param features: (n, 10) or (N, n, 10) features of poly_features.
+    :param classes: (n,) or (N, n), see fit_explicit.
+    :param parity: 1 or -1, see hash_to_classifier.
+    :param C: the penalty of the mirrored problem, a scalar or an array
+              matching classes.
+    :param kwargs: tol, max_iter and warm_start of fit_explicit, the
+                   multipliers of warm_start in [0, 2 C].
+
+    Returns:
+    --------
+    :rtype weights: (10,) or (N, 10), the weights of the mirrored
+                    problem, zero off the parity.
+    :rtype intercept: scalar or (N,), the bias, zero for parity -1.
+    :rtype alpha: (n,) or (N, n), the multipliers of the observations,
+                  twice those of an observation or its antipode in the
+                  mirrored problem.
+    """
+    if parity == 0:
+        raise Exception("fit_symmetric requires parity 1 or -1.")
+
+    features = asarray(features, dtype=float)
+    keep = ANTIPODE == sign(parity)
+
+    with instrument.timer("fit_symmetric"):
+        half, intercept, alpha = fit_explicit(features[...,keep], classes,
+                                              C=2*asarray(C),
+                                              fit_intercept=parity > 0,
+                                              **kwargs)
+
+    weights = zeros(half.shape[:-1] + (len(keep),))
+    weights[...,keep] = half
+    # the events without a solution
+    weights = where(isnan(half).any(axis=-1)[...,newaxis], nan, weights)
+
+    return weights, intercept, alpha
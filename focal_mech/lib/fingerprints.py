@@ -0,0 +1,174 @@
+"""
+Rotation invariant fingerprints of the spectra of a catalog, and their
+clustering, so mechanisms are grouped by type, double couple, CLVD,
+isotropic and their mixes, whatever their orientation, without the
+search over rotations of corr_shear.
+
+The fingerprint of a spectrum is its isotropic part Alm[0,0], the
+eigenvalues of its quadrupole_tensor, which carry the power and the
+bispectrum of degree 2 as tr(M^2) and tr(M^3), and the amplitude,
+the square root of the power_spectrum, of every other degree.
+"""
+from numpy import (asarray, sqrt, pi, zeros, empty, concatenate, newaxis,
+                   isfinite, where, argmin, bincount, minimum, maximum, add)
+from numpy.linalg import eigvalsh
+from numpy.random import RandomState
+
+from focal_mech.lib.sph_harm import real_to_complex, power_spectrum
+from focal_mech.lib.correlate import quadrupole_tensor
+from focal_mech.lib import instrument
+
+
+def fingerprints(alm, basis='complex', normalize=True):
+    """
+    The rotation invariant fingerprints of dense spectra, columns
+
+        Alm[0,0], A_1, l_1, l_2, l_3, A_3, ..., A_lmax
+
+    with A_l the amplitude of degree l and l_1 <= l_2 <= l_3 the
+    eigenvalues of the quadrupole_tensor, scaled so that their norm is
+    A_2. The norm of a fingerprint is the norm of its spectrum.
+
+    Parameters:
+    -----------
+    :param alm: (N, (lmax+1)**2) dense spectra, ordered as
+                sph_harm_modes, lmax >= 2.
+    :param basis: 'complex', or 'real' for the coefficients of
+                  complex_to_real.
+    :param normalize: scale each fingerprint to unit norm, removing
+                      the amplitude of the fit.
+
+    Returns:
+    --------
+    :rtype features: (N, lmax+3) real, zero where the spectrum is zero
+                     or nan, e.g. of fit_spectra for an event of a
+                     single polarity.
+    """
+    alm = asarray(alm)
+    if basis == 'real':
+        alm = real_to_complex(alm)
+    elif basis != 'complex':
+        raise Exception("Unknown basis %s" % basis)
+
+    amplitude = sqrt(power_spectrum(alm))
+
+    # <x.M.x, x.M.x> over the sphere is 8 pi/15 tr(M M), for traceless M
+    eigenvalues = eigvalsh(quadrupole_tensor(where(
+        isfinite(alm[:,4:9]), alm[:,4:9], 0))) * sqrt(8 * pi / 15)
+
+    features = concatenate([alm[:,:1].real, amplitude[:,1:2], eigenvalues,
+                            amplitude[:,3:]], axis=-1)
+
+    norm = sqrt((features**2).sum(axis=-1))
+    valid = isfinite(norm) & (norm > 0)
+    if normalize:
+        features = features / where(valid, norm, 1)[:,newaxis]
+
+    return where(valid[:,newaxis], features, 0)
+
+def assign_clusters(features, centers, block_size=2**22):
+    """
+    The nearest center of each feature vector, a block of rows at a
+    time.
+
+    :param features: (N, d)
+    :param centers: (K, d)
+    :param block_size: bound on the number of distances held at once.
+
+    Returns:
+    --------
+    :rtype labels: (N,) the index of the nearest center.
+    :rtype distance: (N,) the squared distance to it.
+    """
+    features = asarray(features)
+    centers = asarray(centers)
+    step = max(1, block_size // max(len(centers), 1))
+
+    labels = empty(len(features), dtype=int)
+    distance = empty(len(features))
+    squared = (centers**2).sum(axis=-1)
+    for start in range(0, len(features), step):
+        x = features[start:start+step]
+        d = squared - 2 * x.dot(centers.T)
+        best = argmin(d, axis=-1)
+        labels[start:start+step] = best
+        distance[start:start+step] = maximum(
+            d[range(len(x)), best] + (x**2).sum(axis=-1), 0)
+
+    return labels, distance
+
+def _kmeans_plus_plus(sample, num_clusters, rng):
+    # Arthur and Vassilvitskii, "k-means++: the advantages of careful
+    # seeding", 2007
+    centers = empty((num_clusters, sample.shape[1]))
+    centers[0] = sample[rng.randint(len(sample))]
+    distance = ((sample - centers[0])**2).sum(axis=-1)
+    for k in range(1, num_clusters):
+        total = distance.sum()
+        if total > 0:
+            pick = rng.choice(len(sample), p=distance / total)
+        else:
+            pick = rng.randint(len(sample))
+        centers[k] = sample[pick]
+        distance = minimum(distance, ((sample - centers[k])**2).sum(axis=-1))
+    return centers
+
+def kmeans(features, num_clusters, batch_size=4096, max_iter=300, tol=1e-6,
+           seed=0, block_size=2**22):
+    """
+    Mini-batch k-means of Sculley, "Web-scale k-means clustering",
+    WWW 2010, vectorized over each batch: a center moves towards the
+    mean of its members in the batch, at a rate of their number over
+    all the members it has had.
+
+    Parameters:
+    -----------
+    :param features: (N, d) e.g. fingerprints.
+    :param num_clusters: the number of clusters.
+    :param batch_size: the features of each step.
+    :param max_iter, tol: the steps, stopping early when no center moves
+                          more than tol.
+    :param seed: of the seeding, k-means++ on a sample, and the batches.
+    :param block_size: of assign_clusters.
+
+    Returns:
+    --------
+    :rtype centers: (num_clusters, d)
+    :rtype labels: (N,) the cluster of each feature vector.
+    :rtype inertia: the sum of the squared distances to the centers.
+    """
+    features = asarray(features, dtype=float)
+    N = len(features)
+    rng = RandomState(seed)
+
+    with instrument.timer("kmeans.seed"):
+        sample = features[rng.choice(N, min(N, max(batch_size,
+                                                   10 * num_clusters)),
+                                     replace=False)]
+        centers = _kmeans_plus_plus(sample, num_clusters, rng)
+
+    counts = zeros(num_clusters)
+    iterations = 0
+    with instrument.timer("kmeans.fit"):
+        for it in range(max_iter):
+            iterations += 1
+            batch = features[rng.randint(0, N, min(batch_size, N))]
+            labels, _ = assign_clusters(batch, centers, block_size)
+
+            members = bincount(labels, minlength=num_clusters)
+            sums = zeros(centers.shape)
+            add.at(sums, labels, batch)
+
+            counts += members
+            rate = (members / maximum(counts, 1))[:,newaxis]
+            step = rate * (sums / maximum(members, 1)[:,newaxis] - centers)
+            centers += step
+
+            if sqrt((step**2).sum(axis=-1)).max() < tol:
+                break
+    instrument.count("kmeans.iterations", iterations)
+
+    with instrument.timer("kmeans.assign"):
+        labels, distance = assign_clusters(features, centers, block_size)
+
+    return centers, labels, distance.sum()
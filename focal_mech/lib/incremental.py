@@ -0,0 +1,223 @@
+"""
+Fit an event incrementally, as its picks arrive station by station and
+analysts revise them.
+
+A pick off the support that is added, removed, or flipped, and lands
+outside the margin leaves the fit as it is. Otherwise the picks are
+refit, the interior point solver warm started from the multipliers of
+the last fit, and the double couple search from the last solution.
+"""
+import time
+from collections import OrderedDict
+
+from numpy import (array, cos, sin, concatenate, stack, sign, mean, where,
+                   newaxis, ones, nan)
+
+from focal_mech.lib.feature_map import poly_features, fit_explicit
+from focal_mech.lib.classify_mechanism import explicit_to_sphharm
+from focal_mech.lib.sph_harm import (Alm_to_array, array_to_Alm,
+                                     complex_to_real)
+from focal_mech.lib.correlate import corr_shear_batch
+from focal_mech.lib.batch import EventResult
+
+
+class EventFit(object):
+    """
+    The picks of an event and their current fit, see fit_event.
+
+    Picks are keyed, e.g. by station, so they can be revised.
+
+        fit = EventFit(event)
+        fit.add_pick("BAR", azimuth, takeoff, 1)
+        ...
+        fit.flip_pick("BAR")
+        fit.result.double_couple
+
+    Parameters:
+    -----------
+    :param event: the event id, carried through to the result.
+    :param data: (n, 3) picks to start from, as read_demo, keyed by
+                 their row.
+    :param parity: see hash_to_classifier.
+    :param kernel_coeff, C: of the degree 2 kernel classifier.
+    :param table: the lookup table of the first double couple search,
+                  see load_shear_table.
+    :param tol: tolerance of fit_explicit.
+
+    Attributes:
+    -----------
+    :attr result: the EventResult of the picks, the Alm, accuracy,
+                  double_couple and score are None while the picks have
+                  a single polarity.
+    :attr latency: the seconds taken by each refit.
+    """
+    def __init__(self, event=None, data=None, parity=1, kernel_coeff=1,
+                 C=1.0, table=None, tol=1e-6):
+        self.event = event
+        self.parity = parity
+        self.kernel_coeff = kernel_coeff
+        self.C = C
+        self.table = table
+        self.tol = tol
+
+        # key -> (azimuth, takeoff, polarity)
+        self._picks = OrderedDict()
+        self._changed = set()
+        # the multipliers of each pick, and the weights and bias of the
+        # last fit, stale once a support vector is removed
+        self._alpha = {}
+        self._fit = None
+        self._stale = False
+
+        self.result = EventResult(event, None, None, None, None)
+        self.latency = []
+
+        if data is not None:
+            for key, pick in enumerate(data):
+                self.add_pick(key, pick[0], pick[1], pick[2], refit=False)
+            self.refit()
+
+    def __len__(self):
+        return len(self._picks)
+
+    def __contains__(self, key):
+        return key in self._picks
+
+    def add_pick(self, key, azimuth, takeoff, polarity, refit=True):
+        """
+        Add a pick, or replace the pick of the same key.
+
+        :param azimuth, takeoff: in radians.
+        :param polarity: > 0 for up, otherwise down.
+        :param refit: refit now, otherwise on the next change or refit.
+        :rtype result: the EventResult.
+        """
+        self._picks[key] = (float(azimuth), float(takeoff),
+                            1.0 if polarity > 0 else -1.0)
+        self._changed.add(key)
+        return self._update(refit)
+
+    def remove_pick(self, key, refit=True):
+        """
+        Remove a pick.
+        """
+        del self._picks[key]
+        self._changed.discard(key)
+        if self._alpha.pop(key, 0) > 0:
+            self._stale = True
+        return self._update(refit)
+
+    def flip_pick(self, key, refit=True):
+        """
+        Reverse the polarity of a pick.
+        """
+        azimuth, takeoff, polarity = self._picks[key]
+        self._picks[key] = (azimuth, takeoff, -polarity)
+        self._changed.add(key)
+        return self._update(refit)
+
+    def _update(self, refit):
+        if refit:
+            return self.refit()
+        return self.result
+
+    def _features(self, data):
+        """
+        The features and classes of the picks, (n, k, 10) and (n, k),
+        each pick with its mirror image, k = 2, if parity is not 0.
+        """
+        x = cos(data[:,0])*sin(data[:,1])
+        y = sin(data[:,0])*sin(data[:,1])
+        z = cos(data[:,1])
+        classes = data[:,2:3]
+
+        if self.parity != 0:
+            x = stack([x, -x], axis=-1)
+            y = stack([y, -y], axis=-1)
+            z = stack([z, -z], axis=-1)
+            classes = concatenate([classes, sign(self.parity)*classes],
+                                  axis=-1)
+        else:
+            x, y, z = x[:,newaxis], y[:,newaxis], z[:,newaxis]
+
+        return poly_features(x, y, z, self.kernel_coeff), classes
+
+    def refit(self):
+        """
+        Refit the picks, see the module docs.
+
+        :rtype result: the EventResult.
+        """
+        start = time.time()
+
+        keys = list(self._picks.keys())
+        data = array([self._picks[key] for key in keys]).reshape(-1, 3)
+        features, classes = self._features(data)
+
+        if not ((classes > 0).any() and (classes < 0).any()):
+            self.result = EventResult(self.event, None, None, None, None)
+            self._alpha = {}
+            self._fit = None
+            self._changed = set()
+            self.latency.append(time.time() - start)
+            return self.result
+
+        # the last fit still holds if its support is unchanged and the
+        # changed picks are outside the margin
+        keep = (self._fit is not None and not self._stale and
+                not any(self._alpha.get(key, 0) > 0 for key in self._changed))
+        if keep:
+            weights, intercept = self._fit
+            decision = features.dot(weights) + intercept
+            changed = array([key in self._changed for key in keys])
+            keep = (classes * decision >= 1 - self.tol)[changed].all()
+
+        if keep:
+            for key in self._changed:
+                self._alpha[key] = 0.0
+        else:
+            warm_start = None
+            if self._fit is not None:
+                alpha = array([nan if key in self._changed
+                               else self._alpha.get(key, nan)
+                               for key in keys])
+                warm_start = ((alpha[:,newaxis] * ones(classes.shape)).ravel(),
+                              self._fit[1])
+
+            weights, intercept, alpha = fit_explicit(
+                features.reshape(-1, 10), classes.ravel(), C=self.C,
+                tol=self.tol, warm_start=warm_start)
+            decision = features.dot(weights) + intercept
+
+            # the multipliers of a pick and its mirror image are the same
+            alpha = alpha.reshape(classes.shape).mean(axis=-1)
+            self._alpha = dict((key, a if a > 1e-6 else 0.0)
+                               for key, a in zip(keys, alpha))
+
+        self._changed = set()
+        self._stale = False
+        accuracy = mean(where(decision > 0, 1.0, -1.0) == classes)
+
+        if keep:
+            # the spectrum and double couple are unchanged
+            self.result = self.result._replace(accuracy=accuracy)
+            self.latency.append(time.time() - start)
+            return self.result
+
+        self._fit = (weights, intercept)
+        alm = Alm_to_array(explicit_to_sphharm(weights, intercept,
+                                               self.kernel_coeff), 2)
+
+        # the last solution is the warm start
+        init = self.result.double_couple
+        if init is None:
+            init = 'table'
+        solution, score, _ = corr_shear_batch(
+            complex_to_real(alm)[newaxis,4:], init=init, table=self.table,
+            basis='real')
+
+        self.result = EventResult(self.event, array_to_Alm(alm), accuracy,
+                                  solution[0], score[0])
+        self.latency.append(time.time() - start)
+
+        return self.result
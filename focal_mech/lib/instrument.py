@@ -0,0 +1,251 @@
+"""
+Timers and counters across the fit, off by default.
+
+    recorder = Recorder()
+    with recording(recorder):
+        results = list(iter_catalog(events))
+    recorder.dump()
+
+Each metric has a name, e.g. "classify.svc" for the seconds in
+sklearn.svm.SVC or "corr_shear.minimize.evaluations". While no recorder
+is installed the hooks return at once, timer returns a shared null
+context, so the fit pays a global lookup and a call per hook.
+
+The recorder is per process. The worker processes of imap_items, and
+so iter_catalog, record into a Recorder of their own, merged into the
+installed recorder with each result, the times are then summed over
+the workers. Anything with the methods of Recorder, add_time,
+add_count, start_event and end_event, and merge for the pools, can be
+installed in its place, e.g. to forward the metrics to a monitoring
+system.
+"""
+import sys
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from numpy import percentile
+
+
+# the recorder of this process, None when the hooks are off
+_recorder = None
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class Recorder(object):
+    """
+    Aggregates the metrics of a run, over all calls and per event.
+
+    :param per_event: also total the metrics of each event, between
+                      start_event and end_event, see event.
+    """
+    def __init__(self, per_event=True):
+        self.per_event = per_event
+        # name -> [kind, calls, total, min, max]
+        self.metrics = OrderedDict()
+        # event -> {name: total}
+        self.events = OrderedDict()
+        self._event = None
+
+    def _add(self, kind, name, value):
+        metric = self.metrics.get(name)
+        if metric is None:
+            self.metrics[name] = [kind, 1, value, value, value]
+        else:
+            metric[1] += 1
+            metric[2] += value
+            metric[3] = min(metric[3], value)
+            metric[4] = max(metric[4], value)
+
+        if self._event is not None:
+            totals = self.events[self._event]
+            totals[name] = totals.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        self._add("time", name, seconds)
+
+    def add_count(self, name, value=1):
+        self._add("count", name, value)
+
+    def start_event(self, event):
+        if self.per_event:
+            self._event = event
+            self.events.setdefault(event, {})
+
+    def end_event(self):
+        self._event = None
+
+    def merge(self, other):
+        """
+        Add the metrics of another Recorder, e.g. of a worker process.
+        """
+        for name, (kind, calls, total, low, high) in other.metrics.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                self.metrics[name] = [kind, calls, total, low, high]
+            else:
+                metric[1] += calls
+                metric[2] += total
+                metric[3] = min(metric[3], low)
+                metric[4] = max(metric[4], high)
+
+        if self.per_event:
+            for event, totals in other.events.items():
+                merged = self.events.setdefault(event, {})
+                for name, value in totals.items():
+                    merged[name] = merged.get(name, 0) + value
+
+    def summary(self):
+        """
+        The calls, total, mean, min and max of each metric, times in
+        seconds. With per_event, the mean, median, 90th percentile and
+        max over the events of the total of each metric per event.
+        """
+        metrics = OrderedDict()
+        for name, (kind, calls, total, low, high) in self.metrics.items():
+            metrics[name] = OrderedDict([("kind", kind), ("calls", calls),
+                                         ("total", total),
+                                         ("mean", total / float(calls)),
+                                         ("min", low), ("max", high)])
+
+        per_event = OrderedDict()
+        for name in self.metrics:
+            totals = [event.get(name, 0) for event in self.events.values()]
+            if len(totals) == 0:
+                continue
+            per_event[name] = OrderedDict([
+                ("mean", float(sum(totals)) / len(totals)),
+                ("p50", float(percentile(totals, 50))),
+                ("p90", float(percentile(totals, 90))),
+                ("max", max(totals))])
+
+        return OrderedDict([("metrics", metrics),
+                            ("events", OrderedDict([
+                                ("count", len(self.events)),
+                                ("per_event", per_event)]))])
+
+    def dump(self, fp=None):
+        """
+        Write the summary as JSON, to stderr by default.
+        """
+        if fp is None:
+            fp = sys.stderr
+        json.dump(self.summary(), fp, indent=1)
+        fp.write("\n")
+
+def set_recorder(recorder):
+    """
+    Install a recorder, None turns the hooks off. Returns the recorder
+    it replaces.
+    """
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    return previous
+
+def get_recorder():
+    return _recorder
+
+def enabled():
+    return _recorder is not None
+
+def merge(recorder):
+    """
+    Add the metrics of recorder, e.g. of a worker process, to the
+    installed recorder, if any.
+    """
+    if _recorder is not None:
+        _recorder.merge(recorder)
+
+@contextmanager
+def recording(recorder=None):
+    """
+    Install a recorder, a new Recorder by default, for the duration of
+    a with block.
+    """
+    if recorder is None:
+        recorder = Recorder()
+    previous = set_recorder(recorder)
+    try:
+        yield recorder
+    finally:
+        set_recorder(previous)
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullContext()
+
+class _Timer(object):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add_time(self.name, _clock() - self.start)
+        return False
+
+class _Event(object):
+    def __init__(self, recorder, event):
+        self.recorder = recorder
+        self.event = event
+
+    def __enter__(self):
+        self.recorder.start_event(self.event)
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.end_event()
+        return False
+
+def timer(name):
+    """
+    A context timing its block as the metric name.
+    """
+    if _recorder is None:
+        return _NULL
+    return _Timer(_recorder, name)
+
+def count(name, value=1):
+    """
+    Add value to the metric name.
+    """
+    if _recorder is not None:
+        _recorder.add_count(name, value)
+
+def event(event):
+    """
+    A context recording the metrics of its block against event.
+    """
+    if _recorder is None:
+        return _NULL
+    return _Event(_recorder, event)
+
+def timed_iter(name, iterable):
+    """
+    The items of iterable, timing the production of each as the metric
+    name. iterable itself while the hooks are off.
+    """
+    if _recorder is None:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+def _timed_iter(name, iterator):
+    while True:
+        start = _clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if _recorder is not None:
+            _recorder.add_time(name, _clock() - start)
+        yield item
@@ -0,0 +1,206 @@
+"""
+The nodal lines of a mechanism, the zero set of the classifier function
+on the sphere, without a plotting library.
+
+nodal_curves traces the degree 2 spectrum analytically, the zero set of
+a quadratic form on the sphere is the intersection with a cone, for
+stacks of events at once. nodal_lines contours any spectrum over the
+cached grid of render_mechanisms with marching squares.
+"""
+from numpy import (asarray, sqrt, pi, eye, newaxis, linspace, cos, sin,
+                   where, arctan2, arccos, clip, mod, stack, nan, zeros,
+                   concatenate, arange, argsort, full, indices,
+                   take_along_axis)
+from numpy.linalg import eigh
+
+from focal_mech.lib.sph_harm import (Alm_to_array, render_mechanisms,
+                                     get_sph_harm_grid)
+from focal_mech.lib.correlate import quadrupole_tensor
+
+
+def _dense(alm):
+    if isinstance(alm, dict):
+        return Alm_to_array(alm, 2)
+    return asarray(alm)
+
+def _to_spherical(x):
+    azimuth = mod(arctan2(x[...,1], x[...,0]), 2*pi)
+    colatitude = arccos(clip(x[...,2], -1, 1))
+    return azimuth, colatitude
+
+def nodal_curves(alm, num_points=181):
+    """
+    The nodal lines of degree 2 spectra.
+
+    On the sphere the classifier function is the quadratic form
+    x.Q.x, Q = M + Alm[0,0] Y_00 I with M the quadrupole_tensor. Where
+    the eigenvalues of Q do not all have the same sign, the zero set is
+    two antipodal closed curves around the eigenvector of the odd
+    signed eigenvalue, traced here at num_points angles about it. For a
+    double couple the two curves are the halves of the nodal planes,
+    meeting at the null axis.
+
+    The dipole terms are ignored, they are zero for fits with
+    parity=1, see hash_to_classifier. Use nodal_lines otherwise.
+
+    Parameters:
+    -----------
+    :param alm: a spectrum dict Alm, or dense spectra ordered as
+                sph_harm_modes, (9,) or (N, 9).
+    :param num_points: vertices of each curve, the first and last are
+                       the same.
+
+    Returns:
+    --------
+    :rtype azimuth, colatitude: (2, num_points) or (N, 2, num_points)
+                                arrays in radians, nan where the
+                                function has a single sign.
+    """
+    alm = _dense(alm)
+
+    Q = (quadrupole_tensor(alm[...,4:9]) +
+         (alm[...,0].real * 0.5 / sqrt(pi))[...,newaxis,newaxis] * eye(3))
+    lam, V = eigh(Q)
+
+    # flip Q so that the odd signed eigenvalue is the negative one,
+    # first of the ascending eigenvalues
+    num_negative = (lam < 0).sum(axis=-1)
+    flip = num_negative == 2
+    lam = where(flip[...,newaxis], -lam[...,::-1], lam)
+    V = where(flip[...,newaxis,newaxis], V[...,::-1], V)
+    valid = (num_negative == 1) | (num_negative == 2)
+    lam = where(valid[...,newaxis], lam, [-1.0, 1.0, 1.0])
+
+    t = linspace(0, 2*pi, num_points)
+    mu_o = -lam[...,0,newaxis]
+    q = (lam[...,1,newaxis] * cos(t)**2 + lam[...,2,newaxis] * sin(t)**2)
+
+    # on the cone and the sphere, r^2 + w^2 = 1
+    r = sqrt(mu_o / (q + mu_o))
+    w = sqrt(q / (q + mu_o))
+
+    e_o = V[...,newaxis,:,0]
+    e_a = V[...,newaxis,:,1]
+    e_b = V[...,newaxis,:,2]
+    ring = ((r*cos(t))[...,newaxis] * e_a + (r*sin(t))[...,newaxis] * e_b)
+    w = w[...,newaxis] * e_o
+
+    x = stack([ring + w, ring - w], axis=-3)
+    azimuth, colatitude = _to_spherical(x)
+
+    invalid = ~valid[...,newaxis,newaxis]
+    return where(invalid, nan, azimuth), where(invalid, nan, colatitude)
+
+def _marching_squares(F, X, Y):
+    """
+    The zero contour of F[i,j], sampled at (X[i], Y[j]), as a list of
+    (n, 2) arrays of vertices.
+    """
+    A, B = F.shape
+    positive = F > 0
+
+    # the vertices are the crossings of the grid edges, the edges along
+    # the first axis first, (i,j)-(i+1,j), then the second (i,j)-(i,j+1)
+    t0 = F[:-1] / (F[:-1] - F[1:] + (F[:-1] == F[1:]))
+    t1 = F[:,:-1] / (F[:,:-1] - F[:,1:] + (F[:,:-1] == F[:,1:]))
+    vertices = concatenate([
+        stack([(X[:-1,newaxis] + t0 * (X[1:] - X[:-1])[:,newaxis]).ravel(),
+               (Y[newaxis,:] + zeros(t0.shape)).ravel()], axis=-1),
+        stack([(X[:,newaxis] + zeros(t1.shape)).ravel(),
+               (Y[newaxis,:-1] + t1 * (Y[1:] - Y[:-1])).ravel()], axis=-1)])
+    crossed = concatenate([(positive[:-1] != positive[1:]).ravel(),
+                           (positive[:,:-1] != positive[:,1:]).ravel()])
+
+    # the edges of each cell, bottom, right, top, left
+    i, j = [k.ravel() for k in indices((A-1, B-1))]
+    offset = (A-1) * B
+    edges = stack([i*B + j, offset + (i+1)*(B-1) + j,
+                   i*B + j + 1, offset + i*(B-1) + j], axis=-1)
+    cut = crossed[edges]
+    num_cut = cut.sum(axis=-1)
+
+    # a single segment across the two cut edges
+    two = num_cut == 2
+    order = argsort(~cut[two], axis=-1, kind='mergesort')
+    segments = [take_along_axis(edges[two], order[:,:2], axis=-1)]
+
+    # saddles, resolved by the value at the centre of the cell
+    four = (num_cut == 4).nonzero()[0]
+    if len(four) > 0:
+        centre = (F[i[four], j[four]] + F[i[four]+1, j[four]] +
+                  F[i[four], j[four]+1] + F[i[four]+1, j[four]+1]) > 0
+        same = centre == positive[i[four], j[four]]
+        e = edges[four]
+        segments.append(where(same[:,newaxis], e[:,[0, 1]], e[:,[0, 3]]))
+        segments.append(where(same[:,newaxis], e[:,[3, 2]], e[:,[2, 1]]))
+
+    segments = concatenate(segments)
+
+    # each vertex joins at most two segments
+    neighbours = full((len(vertices), 2), -1)
+    ends = concatenate([segments, segments[:,::-1]])
+    ends = ends[argsort(ends[:,0], kind='mergesort')]
+    first = concatenate([[True], ends[1:,0] != ends[:-1,0]])
+    slot = arange(len(ends)) - arange(len(ends))[first][first.cumsum() - 1]
+    neighbours[ends[:,0], slot] = ends[:,1]
+
+    # walk the chains, open ones from their ends first
+    degree = (neighbours >= 0).sum(axis=-1)
+    visited = ~crossed
+    lines = []
+    starts = concatenate([(degree == 1).nonzero()[0],
+                          (degree == 2).nonzero()[0]])
+    for start in starts:
+        if visited[start]:
+            continue
+
+        chain = [start]
+        visited[start] = True
+        previous, current = -1, start
+        while True:
+            a, b = neighbours[current]
+            step = b if a == previous or a < 0 else a
+            if step < 0 or step == previous:
+                break
+            if visited[step]:
+                if step == start:
+                    chain.append(start)
+                break
+            chain.append(step)
+            visited[step] = True
+            previous, current = current, step
+
+        if len(chain) > 1:
+            lines.append(vertices[chain])
+
+    return lines
+
+def nodal_lines(Alm, resolution=(200,400)):
+    """
+    The nodal lines of any spectrum, contoured over the grid of
+    get_sph_harm_grid with marching squares.
+
+    Parameters:
+    -----------
+    :param Alm: a spectrum dict, or a dense spectrum ordered as
+                sph_harm_modes.
+    :param resolution: of the grid, as for get_sph_harm.
+
+    Returns:
+    --------
+    :rtype lines: a list of (n, 2) arrays of the (azimuth, colatitude)
+                  vertices of each line, in radians. Lines crossing
+                  azimuth 0 are split there.
+    """
+    if isinstance(Alm, dict):
+        Alm = Alm_to_array(Alm)
+    Alm = asarray(Alm)
+    lmax = int(round(sqrt(Alm.shape[-1]))) - 1
+
+    longi, lati, _ = get_sph_harm_grid(resolution, lmax)
+
+    Nlong, Nlati = resolution
+    F = render_mechanisms(Alm[newaxis], resolution)[0].reshape(Nlati, Nlong)
+
+    return _marching_squares(F, longi.reshape(Nlati, Nlong)[:,0],
+                             lati.reshape(Nlati, Nlong)[0])
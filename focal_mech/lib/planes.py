@@ -0,0 +1,74 @@
+"""
+The geometry of the nodal planes of a double couple, in the strike, dip
+and rake convention of Aki and Richards, x north, y east and z down.
+"""
+from numpy import (asarray, sin, cos, arccos, arctan2, deg2rad, rad2deg,
+                   stack, where, mod, clip)
+
+
+def plane_vectors(strike, dip, rake):
+    """
+    The normal and slip vectors of a plane.
+
+    :param strike, dip, rake: in degrees, of any (matching) shape.
+    :rtype normal, slip: arrays of shape strike.shape + (3,), the normal
+                         pointing up.
+    """
+    strike = deg2rad(asarray(strike, dtype=float))
+    dip = deg2rad(asarray(dip, dtype=float))
+    rake = deg2rad(asarray(rake, dtype=float))
+
+    normal = stack([-sin(dip)*sin(strike), sin(dip)*cos(strike),
+                    -cos(dip)], axis=-1)
+    slip = stack([cos(rake)*cos(strike) + sin(rake)*cos(dip)*sin(strike),
+                  cos(rake)*sin(strike) - sin(rake)*cos(dip)*cos(strike),
+                  -sin(rake)*sin(dip)], axis=-1)
+
+    return normal, slip
+
+def vectors_to_plane(normal, slip):
+    """
+    The strike, dip and rake of a plane, from its normal and slip
+    vectors, see plane_vectors.
+
+    :rtype strike, dip, rake: in degrees, the strike in [0, 360), the
+                              dip in [0, 90] and the rake in
+                              (-180, 180].
+    """
+    normal = asarray(normal, dtype=float)
+    slip = asarray(slip, dtype=float)
+
+    # the normal points up, flipping both keeps the same motion
+    down = (normal[...,2] > 0)[...,None]
+    normal = where(down, -normal, normal)
+    slip = where(down, -slip, slip)
+
+    dip = arccos(clip(-normal[...,2], -1, 1))
+    strike = arctan2(-normal[...,0], normal[...,1])
+    rake = arctan2(-slip[...,2] / where(sin(dip) > 0, sin(dip), 1),
+                   slip[...,0]*cos(strike) + slip[...,1]*sin(strike))
+
+    strike = mod(rad2deg(strike), 360.0)
+    rake = rad2deg(rake)
+    rake = where(rake <= -180.0, rake + 360.0, rake)
+
+    return strike, rad2deg(dip), rake
+
+def aux_plane(strike, dip, rake):
+    """
+    The auxiliary plane of a double couple, in place of
+    obspy.imaging.beachball.aux_plane. The normal of one nodal plane is
+    the slip of the other.
+
+    :param strike, dip, rake: of one plane in degrees, scalars or
+                              arrays.
+    :rtype strike, dip, rake: of the other plane in degrees, see
+                              vectors_to_plane.
+    """
+    normal, slip = plane_vectors(strike, dip, rake)
+    strike, dip, rake = vectors_to_plane(slip, normal)
+
+    if strike.ndim == 0:
+        return float(strike), float(dip), float(rake)
+
+    return strike, dip, rake
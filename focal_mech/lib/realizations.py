@@ -0,0 +1,269 @@
+"""
+The uncertainty of the double couple of an event from realizations of
+its picks, the polarities flipped and the takeoff angles and azimuths
+perturbed, as HASH does.
+
+The realizations of an event are one stacked array, fit at once in the
+explicit feature space of the degree 2 kernel, see fit_explicit, and
+their double couple searches are warm started from the solution of the
+unperturbed picks.
+"""
+from collections import namedtuple
+from functools import partial
+
+from numpy import (asarray, where, sin, cos, deg2rad, rad2deg, stack,
+                   concatenate, isnan, full, nan, newaxis, mod, pi,
+                   array, eye, diag, matmul, einsum, arccos, clip, sqrt,
+                   abs, dot, mean)
+from numpy.random import RandomState
+
+from focal_mech.lib.sph_harm import complex_to_real
+from focal_mech.lib.correlate import corr_shear_batch
+from focal_mech.lib.rotation_table import (real_shear_templates,
+                                           euler_to_matrix)
+from focal_mech.lib.batch import imap_items, fit_spectra
+
+
+Quality = namedtuple("Quality", ["grade", "prob", "rms_diff", "misfit",
+                                 "stdr"])
+
+Realizations = namedtuple("Realizations", ["event", "Alm", "double_couple",
+                                           "score", "solutions", "scores",
+                                           "quality"])
+
+# the grades of HASH, (grade, prob >, rms_diff <=, misfit <=, stdr >=),
+# the first one met, otherwise D
+QUALITY_GRADES = [("A", 0.8, 25.0, 0.15, 0.5),
+                  ("B", 0.6, 35.0, 0.2, 0.4),
+                  ("C", 0.5, 45.0, 0.3, 0.3)]
+
+# the rotations leaving the template, 2yz, unchanged
+_SHEAR_SYMMETRIES = array([eye(3),
+                           diag([1.0, -1.0, -1.0]),
+                           [[-1.0, 0, 0], [0, 0, 1.0], [0, 1.0, 0]],
+                           [[-1.0, 0, 0], [0, 0, -1.0], [0, -1.0, 0]]])
+
+
+def perturb_picks(data, num_realizations, flip_fraction=0.1,
+                  takeoff_error=5.0, azimuth_error=5.0, rng=None):
+    """
+    Realizations of the picks of an event.
+
+    Parameters:
+    -----------
+    :param data: (n, 3) azimuth, takeoff angle (radians) and polarity of
+                 each pick, as read_demo.
+    :param flip_fraction: the chance each polarity is flipped, badfrac
+                          of HASH.
+    :param takeoff_error, azimuth_error: the standard deviation of the
+                                         normal perturbations, in
+                                         degrees.
+    :param rng: a numpy RandomState, or a seed for one.
+
+    Returns:
+    --------
+    :rtype realizations: (num_realizations, n, 3) array, in the form of
+                         data.
+    """
+    if not isinstance(rng, RandomState):
+        rng = RandomState(rng)
+
+    data = asarray(data, dtype=float)
+    shape = (num_realizations, len(data))
+
+    flip = where(rng.random_sample(shape) < flip_fraction, -1.0, 1.0)
+    azimuth = data[:,0] + deg2rad(azimuth_error) * rng.standard_normal(shape)
+    takeoff = data[:,1] + deg2rad(takeoff_error) * rng.standard_normal(shape)
+
+    return stack([azimuth, takeoff, data[:,2] * flip], axis=-1)
+
+def _unit_vectors(data):
+    # the takeoff angle is the colatitude, see hash_to_classifier
+    return (cos(data[...,0])*sin(data[...,1]),
+            sin(data[...,0])*sin(data[...,1]),
+            cos(data[...,1]))
+
+def _signed_shear(solution, c):
+    """
+    corr_shear matches the nodal planes, whatever the sign of the
+    correlation. Turn the rake of the anti-correlated solutions by 180
+    degrees, so the solutions also match the polarities.
+    """
+    strike, dip, rake = deg2rad(solution).T
+    corr = (real_shear_templates(strike, dip, rake) * c).sum(axis=-1)
+    rake = where(corr < 0, mod(rake + pi, 2*pi), rake)
+
+    return rad2deg(stack([strike, dip, rake], axis=-1))
+
+def _solve(data, init='table', parity=1, kernel_coeff=1, C=1.0, table=None):
+    """
+    The spectra and the double couples of stacked picks, (N, n, 3),
+    see corr_shear_batch for init.
+    """
+    alm = fit_spectra(data, parity=parity, kernel_coeff=kernel_coeff, C=C)[0]
+
+    solution = full((len(alm), 3), nan)
+    score = full(len(alm), nan)
+
+    # there is no solution with a single class
+    valid = ~isnan(alm).any(axis=-1)
+    if valid.any():
+        # the search is faster in the real basis
+        quadrupole = complex_to_real(alm[valid])[:,4:]
+        x, s, _ = corr_shear_batch(quadrupole, init=init, table=table,
+                                   basis='real')
+
+        solution[valid] = _signed_shear(x, quadrupole)
+        score[valid] = s
+
+    return alm, solution, score
+
+def _solve_chunk(data, **kwargs):
+    return _solve(data, **kwargs)[1:]
+
+def rotation_angle(a, b):
+    """
+    The smallest rotation taking one double couple to another, the
+    Kagan angle, with the polarities kept.
+
+    :param a, b: (..., 3) strike, dip, rake in degrees.
+    :rtype angle: in degrees, between 0 and 120.
+    """
+    a = deg2rad(asarray(a, dtype=float))
+    b = deg2rad(asarray(b, dtype=float))
+
+    Ra = euler_to_matrix(a[...,0], a[...,1], a[...,2])
+    Rb = euler_to_matrix(b[...,0], b[...,1], b[...,2])
+    M = matmul(Ra.swapaxes(-1, -2), Rb)
+
+    # trace(M S) for each symmetry S
+    traces = einsum('...ij,kji->...k', M, _SHEAR_SYMMETRIES)
+    return rad2deg(arccos(clip((traces.max(axis=-1) - 1) / 2, -1, 1)))
+
+def quality(data, double_couple, solutions, max_angle=45.0):
+    """
+    The quality of a double couple and its realizations, graded as
+    HASH grades its mechanisms.
+
+    Parameters:
+    -----------
+    :param data: (n, 3) the picks, as read_demo.
+    :param double_couple: (strike, dip, rake) in degrees.
+    :param solutions: (N, 3) the double couples of the realizations.
+    :param max_angle: realizations within this rotation angle, in
+                      degrees, of double_couple count as close to it.
+
+    Returns:
+    --------
+    :rtype Quality: the grade, A to D, or F without a solution. prob,
+                    the fraction of realizations close to the double
+                    couple. rms_diff, the rms rotation angle of the
+                    realizations, in place of the rms fault plane
+                    difference of HASH. misfit, the fraction of the
+                    polarities not matched, and stdr, the station
+                    distribution ratio, both weighted by the square
+                    root of the radiation amplitude at each pick.
+    """
+    double_couple = asarray(double_couple, dtype=float)
+    if isnan(double_couple).any():
+        return Quality("F", nan, nan, nan, nan)
+
+    angle = rotation_angle(double_couple, solutions)
+    angle = angle[~isnan(angle)]
+    prob = mean(angle < max_angle) if len(angle) > 0 else 0.0
+    rms_diff = sqrt(mean(angle**2)) if len(angle) > 0 else nan
+
+    R = euler_to_matrix(*deg2rad(double_couple))
+    x = stack(_unit_vectors(asarray(data, dtype=float)), axis=-1)
+    radiation = 2 * dot(x, R[:,1]) * dot(x, R[:,2])
+    polarity = where(asarray(data)[:,2] > 0, 1.0, -1.0)
+
+    weight = sqrt(abs(radiation))
+    misfit = (weight * (polarity * radiation < 0)).sum() / weight.sum()
+    stdr = mean(weight)
+
+    grade = "D"
+    for g, min_prob, max_rms, max_misfit, min_stdr in QUALITY_GRADES:
+        if (prob > min_prob and rms_diff <= max_rms and
+                misfit <= max_misfit and stdr >= min_stdr):
+            grade = g
+            break
+
+    return Quality(grade, prob, rms_diff, misfit, stdr)
+
+def realize_event(event, data, num_realizations=100, flip_fraction=0.1,
+                  takeoff_error=5.0, azimuth_error=5.0, parity=1,
+                  kernel_coeff=1, C=1.0, max_angle=45.0, seed=None,
+                  table=None, processes=1, chunksize=50):
+    """
+    Fit the picks of an event and realizations of them.
+
+    Parameters:
+    -----------
+    :param event: the event id, carried through to the result.
+    :param data: (n, 3) the picks, as read_demo.
+    :param num_realizations, flip_fraction, takeoff_error,
+           azimuth_error: see perturb_picks.
+    :param parity: see hash_to_classifier.
+    :param kernel_coeff, C: of the degree 2 kernel classifier.
+    :param max_angle: see quality.
+    :param seed: of the perturbations.
+    :param table: the lookup table for the unperturbed double couple,
+                  see load_shear_table.
+    :param processes: number of worker processes to fit the
+                      realizations, see imap_items.
+    :param chunksize: number of realizations fit at once.
+
+    Returns:
+    --------
+    :rtype Realizations: the dense spectrum Alm and the double couple,
+                         (strike, dip, rake) in degrees, of the picks,
+                         with its correlation score. The double couples
+                         of the realizations and their scores, (N, 3)
+                         and (N,), nan for realizations without a
+                         solution, and their Quality.
+    """
+    data = asarray(data, dtype=float)
+    options = dict(parity=parity, kernel_coeff=kernel_coeff, C=C)
+
+    alm, solution, score = _solve(data[newaxis], table=table, **options)
+    alm, solution, score = alm[0], solution[0], score[0]
+
+    realizations = perturb_picks(data, num_realizations, flip_fraction,
+                                 takeoff_error, azimuth_error, seed)
+
+    if isnan(solution).any():
+        solutions = full((num_realizations, 3), nan)
+        scores = full(num_realizations, nan)
+    else:
+        worker = partial(_solve_chunk, init=solution, **options)
+        chunks = [realizations[k:k+chunksize]
+                  for k in range(0, num_realizations, chunksize)]
+        results = list(imap_items(worker, chunks, processes))
+        solutions = concatenate([r[0] for r in results])
+        scores = concatenate([r[1] for r in results])
+
+    return Realizations(event, alm, solution, score, solutions, scores,
+                        quality(data, solution, solutions, max_angle))
+
+def _realize_item(item, **kwargs):
+    event, data = item
+    return realize_event(event, data, **kwargs)
+
+def iter_realizations(events, processes=None, chunksize=1, ordered=True,
+                      **kwargs):
+    """
+    realize_event for each event of a catalog, the events spread over
+    a pool of worker processes.
+
+    :param events: dict of picks keyed by event, as read_demo, or an
+                   iterable of (event, data) such as iter_demo.
+    :param processes, chunksize, ordered: see iter_catalog.
+    :param kwargs: passed through to realize_event.
+    :rtype generator: of Realizations.
+    """
+    if isinstance(events, dict):
+        events = events.items()
+    worker = partial(_realize_item, **kwargs)
+
+    return imap_items(worker, iter(events), processes, chunksize, ordered)
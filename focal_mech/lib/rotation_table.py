@@ -0,0 +1,325 @@
+"""
+A lookup table of the double couple template rotated over a quasi
+uniform grid of SO(3), so the coarse search of corr_shear is a single
+matrix product and argmax.
+
+The table is the same for every event. It is built once, saved as .npy
+files and memory mapped read only, so worker processes share the
+pages.
+"""
+import os
+import tempfile
+
+from numpy import (arange, sqrt, sin, cos, pi, array, stack, load, save,
+                   abs, dot, argmax, mod, arccos, arctan2, clip, asarray,
+                   empty, broadcast_arrays, newaxis, concatenate, sign)
+from numpy.linalg import norm
+from numpy.polynomial.legendre import leggauss
+
+from focal_mech.lib.sph_harm import (WignerD2, real_transform,
+                                     sph_harm_matrix, rotate_spectrum)
+from focal_mech.lib.feature_map import SPH_HARM_MONOMIALS
+
+
+# bump when the layout or the template changes, old files are ignored.
+TABLE_VERSION = 1
+
+# about 9 degrees between neighbouring rotations
+DEFAULT_SIZE = 20000
+
+TABLE_DIR = os.path.join(os.path.expanduser("~"), ".focal_mech")
+
+# tables loaded by this process, keyed by size
+_tables = {}
+
+# spectra of the template polarities, keyed by degree
+_polarity = {}
+
+
+def super_fibonacci(n):
+    """
+    Quasi uniform unit quaternions, the super-Fibonacci spirals of
+    Alexa, "Super-Fibonacci Spirals: Fast, Low-Discrepancy Sampling of
+    SO(3)", CVPR 2022.
+
+    Returns:
+    --------
+    :rtype q: (n, 4) array of unit quaternions (w, x, y, z)
+    """
+    phi = sqrt(2.0)
+    psi = 1.533751168755204288118041
+
+    s = arange(n) + 0.5
+    r = sqrt(s / n)
+    R = sqrt(1.0 - s / n)
+    alpha = 2 * pi * s / phi
+    beta = 2 * pi * s / psi
+
+    return stack([r * sin(alpha), r * cos(alpha),
+                  R * sin(beta), R * cos(beta)], axis=-1)
+
+def quaternion_to_matrix(q):
+    """
+    :param q: (..., 4) unit quaternions (w, x, y, z)
+    :rtype R: (..., 3, 3) rotation matrices
+    """
+    w, x, y, z = q[...,0], q[...,1], q[...,2], q[...,3]
+
+    return stack([
+        stack([1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)], axis=-1),
+        stack([2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)], axis=-1),
+        stack([2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)], axis=-1)],
+                 axis=-2)
+
+def matrix_to_euler(R):
+    """
+    The (strike, dip, rake) of corr_shear for a rotation,
+    R = Rz(strike) Ry(dip) Rz(-rake), i.e. WignerD2(strike, dip, -rake).
+
+    :param R: (..., 3, 3) rotation matrices
+    :rtype strike, dip, rake: in radians, within the bounds of corr_shear
+    """
+    R = asarray(R)
+    strike = arctan2(R[...,1,2], R[...,0,2])
+    dip = arccos(clip(R[...,2,2], -1, 1))
+    rake = -arctan2(R[...,2,1], -R[...,2,0])
+
+    return mod(strike, 2*pi), dip, mod(rake, 2*pi)
+
+def euler_to_matrix(strike, dip, rake):
+    """
+    The rotation R = Rz(strike) Ry(dip) Rz(-rake) of corr_shear, the
+    inverse of matrix_to_euler. The columns R[:,1] and R[:,2] are the
+    normals of the nodal planes of the template, 2yz.
+
+    :param strike, dip, rake: arrays of angles, in radians.
+    :rtype R: (..., 3, 3) rotation matrices
+    """
+    strike, dip, rake = broadcast_arrays(asarray(strike, dtype=float),
+                                         asarray(dip, dtype=float),
+                                         asarray(rake, dtype=float))
+    ca, sa = cos(strike), sin(strike)
+    cb, sb = cos(dip), sin(dip)
+    cc, sc = cos(rake), -sin(rake)
+
+    return stack([
+        stack([ca*cb*cc - sa*sc, -ca*cb*sc - sa*cc, ca*sb], axis=-1),
+        stack([sa*cb*cc + ca*sc, -sa*cb*sc + ca*cc, sa*sb], axis=-1),
+        stack([-sb*cc, sb*sc, cb], axis=-1)], axis=-2)
+
+def shear_templates(strike, dip, rake):
+    """
+    The rotated template spectra t, such that the correlation of
+    _corr_shear is abs(t.dot(alm)).
+
+    :param strike, dip, rake: arrays of angles, in radians.
+    :rtype t: (..., 5) complex array
+    """
+    # Wigner is ZYZ Euler rotation, \gamma = -rake
+    D = WignerD2(strike, dip, -rake).conjugate()
+    # Template Spectrum : glm = (0, -1j, 0, -1j, 0)
+    return (D[...,:,3] + D[...,:,1]) * 1j
+
+def _real_shear_forms():
+    """
+    The real coefficients of the template, 2yz, rotated by R are
+    linear in the outer product of the columns R[:,1] and R[:,2],
+    since the rotated template is the quadratic form of
+    R (e_y e_z^T + e_z e_y^T) R^T, up to scale.
+
+    Returns the (9, 5) matrix W taking the outer product, raveled, to
+    the coefficients.
+    """
+    # the quadratic forms B[m] of the real harmonics, S_2m = x.B[m].x
+    c = dot(real_transform(2).conjugate(),
+            SPH_HARM_MONOMIALS[3:,4:].conjugate()).real
+    B = array([[[xx, xy/2, xz/2], [xy/2, yy, yz/2], [xz/2, yz/2, zz]]
+               for xx, yy, zz, xy, xz, yz in c])
+
+    # the template, kappa (e_y e_z^T + e_z e_y^T)
+    kappa = dot([0, -1j, 0, -1j, 0],
+                SPH_HARM_MONOMIALS[3:,-1].conjugate()).real / 2
+
+    # <x.M.x, x.B.x> over the sphere is 8 pi/15 tr(M B), for traceless B
+    return (16 * pi / 15) * kappa * B.transpose(1, 2, 0).reshape(9, 5)
+
+_REAL_SHEAR_FORMS = _real_shear_forms()
+
+def real_shear_templates(strike, dip, rake):
+    """
+    shear_templates in the basis of real_sph_harm_matrix, the
+    correlation with real coefficients c is abs(t.dot(c)). Built from
+    the 3x3 rotation, R = Rz(strike) Ry(dip) Rz(-rake), with real
+    arithmetic only.
+
+    :rtype t: (..., 5) real array
+    """
+    R = euler_to_matrix(strike, dip, rake)
+    r_y, r_z = R[...,:,1], R[...,:,2]
+
+    outer = r_y[...,:,newaxis] * r_z[...,newaxis,:]
+    return dot(outer.reshape(outer.shape[:-2] + (9,)), _REAL_SHEAR_FORMS)
+
+def real_shear_table(table=None):
+    """
+    The lookup table in the basis of real_sph_harm_matrix.
+
+    :param table: (angles, templates), see load_shear_table.
+    :rtype angles, templates: the templates are real, see
+                              real_shear_templates.
+    """
+    if table is None:
+        table = load_shear_table()
+    angles, templates = table
+
+    # the rows are the conjugate of the rotated template spectra
+    return angles, dot(templates.conjugate(), real_transform(2).T).real
+
+def polarity_spectrum(lmax):
+    """
+    The dense spectrum, up to degree lmax, of the polarities of the
+    template, sign(yz), scaled so its quadrupole is the template of
+    shear_templates. The degrees are even and the orders odd.
+
+    sign(yz) is smooth within each quarter of the sphere between its
+    nodal planes, it is integrated by Gauss-Legendre quadrature over
+    each, exactly to round off.
+
+    :rtype glm: ((lmax+1)**2,) complex array, ordered as
+                sph_harm_modes.
+    """
+    if lmax in _polarity:
+        return _polarity[lmax]
+
+    nodes, weights = leggauss(2*lmax + 32)
+    # (nodes + 1) pi/4 over [0, pi/2], and the mirror over [pi/2, pi]
+    colat = concatenate([(nodes + 1) * pi/4, pi - (nodes + 1) * pi/4])
+    longi = concatenate([(nodes + 1) * pi/2, pi + (nodes + 1) * pi/2])
+
+    w_colat = concatenate([weights, weights]) * (pi/4) * sin(colat)
+    w_longi = concatenate([weights, weights]) * (pi/2)
+
+    # sign(y z) = sign(sin(longi)) sign(cos(colat))
+    f = sign(sin(longi))[newaxis,:] * sign(cos(colat))[:,newaxis]
+
+    longi, colat = broadcast_arrays(longi[newaxis,:], colat[:,newaxis])
+    weights = f * w_colat[:,newaxis] * w_longi[newaxis,:]
+    glm = (sph_harm_matrix(lmax, longi, colat).conjugate() *
+           weights).sum(axis=(1, 2))
+
+    glm[abs(glm) < 1e-12] = 0
+    if lmax >= 2:
+        glm *= sqrt(2.0) / norm(glm[4:9])
+
+    _polarity[lmax] = glm
+    return glm
+
+def polarity_templates(strike, dip, rake, lmax=2):
+    """
+    shear_templates for spectra up to degree lmax, the rotated
+    polarity_spectrum, such that the correlation is abs(t.dot(alm)).
+    polarity_templates(..., lmax=2)[..., 4:] is
+    shear_templates(...).
+
+    :param strike, dip, rake: arrays of angles, in radians.
+    :rtype t: (..., (lmax+1)**2) complex array
+    """
+    return rotate_spectrum(polarity_spectrum(lmax), strike, dip,
+                           -asarray(rake)).conjugate()
+
+def build_shear_table(n=DEFAULT_SIZE):
+    """
+    :param n: number of rotations.
+
+    Returns:
+    --------
+    :rtype angles: (n, 3) the (strike, dip, rake) of each rotation.
+    :rtype templates: (n, 5) the rotated template spectra.
+    """
+    strike, dip, rake = matrix_to_euler(
+        quaternion_to_matrix(super_fibonacci(n)))
+
+    angles = stack([strike, dip, rake], axis=-1)
+    templates = shear_templates(strike, dip, rake)
+
+    return angles, templates
+
+def _table_paths(n, directory):
+    base = os.path.join(directory, "shear_table_v%d_%d" % (TABLE_VERSION, n))
+    return base + ".angles.npy", base + ".templates.npy"
+
+def _atomic_save(filename, data):
+    # write then rename, so concurrent readers never see a partial file
+    directory = os.path.dirname(filename)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            save(fp, data)
+        os.rename(tmp, filename)
+    except:
+        os.remove(tmp)
+        raise
+
+def load_shear_table(n=DEFAULT_SIZE, directory=None):
+    """
+    The lookup table of n rotated templates, memory mapped read only.
+    The table is built and saved under directory the first time,
+    TABLE_DIR by default.
+
+    Returns:
+    --------
+    :rtype angles, templates: see build_shear_table.
+    """
+    if n in _tables:
+        return _tables[n]
+
+    if directory is None:
+        directory = TABLE_DIR
+
+    angles_file, templates_file = _table_paths(n, directory)
+
+    if not (os.path.exists(angles_file) and os.path.exists(templates_file)):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(directory):
+                    raise
+
+        angles, templates = build_shear_table(n)
+        _atomic_save(angles_file, angles)
+        _atomic_save(templates_file, templates)
+
+    _tables[n] = (load(angles_file, mmap_mode='r'),
+                  load(templates_file, mmap_mode='r'))
+
+    return _tables[n]
+
+def table_shear(alm, table=None, block_size=2**22):
+    """
+    :param alm: Quadrupole components, or an (N, 5) stack of them.
+    :param table: (angles, templates), see load_shear_table.
+    :param block_size: bound on the number of correlations held at
+                       once, when searching for a stack of events.
+
+    The best rotation in the table, a starting point for corr_shear.
+    For a stack of events, returns an (N, 3) array of angles.
+    """
+    if table is None:
+        table = load_shear_table()
+    angles, templates = table
+
+    alm = asarray(alm)
+    if alm.ndim == 1:
+        best = argmax(abs(dot(templates, alm)))
+        return tuple(angles[best])
+
+    step = max(1, block_size // len(templates))
+    best = empty(len(alm), dtype=int)
+    for start in range(0, len(alm), step):
+        block = alm[start:start+step]
+        best[start:start+step] = argmax(abs(dot(block, templates.T)),
+                                        axis=-1)
+
+    return asarray(angles)[best]
@@ -0,0 +1,255 @@
+"""
+The similarity of the mechanisms of a catalog, the normalized
+correlation of their spectra,
+
+    abs(alm.conjugate().dot(blm)) / (norm(alm) * norm(blm))
+
+as in demo/test5.py, for all pairs or the k most similar events of
+each, in blocks so the memory is bounded whatever the size of the
+catalog.
+
+The spectra of the classifier functions are real functions, their
+correlation is the dot product of their real coefficients, see
+complex_to_real, so the scores of a block are one real matrix product.
+
+With invariant=True the events are compared by the square root of
+their power_spectrum, unchanged by rotations: two events score 1 when
+one mechanism is a rotation of the other. The features are then a few
+numbers per event, and tree search of them is sublinear.
+"""
+from numpy import (asarray, sqrt, zeros, empty, full, arange, argsort,
+                   isfinite, newaxis, take_along_axis, concatenate,
+                   argpartition, abs, inf, nonzero, where, einsum)
+
+from focal_mech.lib.sph_harm import complex_to_real, power_spectrum
+from focal_mech.lib import instrument
+
+
+def spectrum_features(alm, basis='complex', invariant=False, dtype=float):
+    """
+    The unit norm feature vectors of SimilarityIndex, the dot product
+    of two of them is the normalized correlation of their spectra.
+
+    :param alm: (N, (lmax+1)**2) dense spectra, ordered as
+                sph_harm_modes.
+    :param basis: 'complex', or 'real' for alm the real coefficients of
+                  complex_to_real.
+    :param invariant: the square root of the power_spectrum of each
+                      event instead of its coefficients.
+    :param dtype: of the features, float32 halves the memory and time
+                  of the products.
+
+    Returns:
+    --------
+    :rtype features: (N, d) real, zero for events without a spectrum,
+                     a zero or nan spectrum, e.g. of fit_spectra for an
+                     event of a single polarity.
+    """
+    alm = asarray(alm)
+    if invariant:
+        features = sqrt(power_spectrum(alm))
+    elif basis == 'complex':
+        features = complex_to_real(alm)
+    elif basis == 'real':
+        features = asarray(alm, dtype=float)
+    else:
+        raise Exception("Unknown basis %s" % basis)
+
+    norm = sqrt((features**2).sum(axis=-1))
+    valid = isfinite(norm) & (norm > 0)
+    norm = where(valid, norm, 1)
+
+    features = where(valid[:,newaxis], features / norm[:,newaxis], 0)
+    return features.astype(dtype)
+
+class SimilarityIndex(object):
+    """
+    The normalized correlations of a catalog of spectra.
+
+        index = SimilarityIndex(alm)
+        neighbours, scores = index.top_k(10)
+
+    Parameters:
+    -----------
+    :param alm: (N, (lmax+1)**2) dense spectra, ordered as
+                sph_harm_modes, e.g. of fit_spectra.
+    :param basis, invariant, dtype: see spectrum_features.
+    :param signed: keep the sign of the correlation, so a mechanism
+                   and its reversal score -1. By default they score 1,
+                   as in demo/test5.py.
+    :param block_size: bound on the number of scores held at once.
+    """
+    def __init__(self, alm, basis='complex', invariant=False, signed=False,
+                 block_size=2**22, dtype=float):
+        self.basis = basis
+        self.invariant = invariant
+        self.signed = signed
+        self.block_size = block_size
+        self.dtype = dtype
+
+        self.features = spectrum_features(alm, basis, invariant, dtype)
+        self.valid = (self.features != 0).any(axis=-1)
+        self._tree = None
+
+    def __len__(self):
+        return len(self.features)
+
+    def _queries(self, queries):
+        if queries is None:
+            return self.features
+        return spectrum_features(queries, self.basis, self.invariant,
+                                 self.dtype)
+
+    def blocks(self, queries=None):
+        """
+        The scores of the queries against every event, a block of rows
+        at a time.
+
+        :param queries: (Q, (lmax+1)**2) spectra, the events of the
+                        index by default.
+        :rtype start, scores: the first query of each block, and its
+                              (rows, N) scores.
+        """
+        return self._blocks(self._queries(queries))
+
+    def _blocks(self, queries):
+        step = max(1, self.block_size // max(len(self), 1))
+
+        for start in range(0, len(queries), step):
+            scores = queries[start:start+step].dot(self.features.T)
+            if not self.signed:
+                scores = abs(scores)
+            yield start, scores
+
+    def all_pairs(self, queries=None):
+        """
+        The (Q, N) scores of the queries against every event, the
+        (N, N) scores of the index by default. This holds Q*N scores,
+        see top_k and pairs for large catalogs.
+        """
+        queries = self._queries(queries)
+        scores = empty((len(queries), len(self)), dtype=self.dtype)
+        for start, block in self._blocks(queries):
+            scores[start:start+len(block)] = block
+        return scores
+
+    def top_k(self, k, queries=None, method='exact'):
+        """
+        The k best scoring events of each query.
+
+        :param k: number of events.
+        :param queries: (Q, (lmax+1)**2) spectra, or the events of the
+                        index by default, each then leaving itself out.
+        :param method: 'exact', blocked products, or 'tree' to search
+                       a ball tree of the features, sublinear in the
+                       number of events and the same result, see
+                       tree_top_k.
+
+        Returns:
+        --------
+        :rtype index: (Q, k) the events, best first, -1 where there are
+                      fewer than k events.
+        :rtype scores: (Q, k) their scores, -inf where there are none.
+        """
+        if method == 'tree':
+            return self.tree_top_k(k, queries)
+        elif method != 'exact':
+            raise Exception("Unknown method %s" % method)
+
+        exclude_self = queries is None
+        queries = self._queries(queries)
+        num = min(k, len(self) - exclude_self)
+
+        index = full((len(queries), k), -1, dtype=int)
+        scores = full((len(queries), k), -inf)
+
+        with instrument.timer("similarity.top_k"):
+            for start, block in self._blocks(queries):
+                rows = arange(len(block))
+                if exclude_self:
+                    block[rows, start + rows] = -inf
+                if num <= 0:
+                    continue
+
+                best = argpartition(-block, num - 1, axis=-1)[:,:num]
+                best_scores = take_along_axis(block, best, axis=-1)
+                order = argsort(-best_scores, axis=-1)
+
+                index[start:start+len(block),:num] = take_along_axis(
+                    best, order, axis=-1)
+                scores[start:start+len(block),:num] = take_along_axis(
+                    best_scores, order, axis=-1)
+        instrument.count("similarity.queries", len(queries))
+
+        return index, scores
+
+    def _build_tree(self):
+        if self._tree is None:
+            # sklearn is slow to import, only load it when it is used
+            from sklearn.neighbors import BallTree
+
+            self._members = nonzero(self.valid)[0]
+            self._tree = BallTree(self.features[self._members])
+        return self._tree
+
+    def tree_top_k(self, k, queries=None):
+        """
+        top_k from a ball tree of the features, built on the first
+        call. For unit vectors |u - v|^2 = 2 - 2 u.v, the nearest
+        features are the best scores, and unsigned scores are the
+        nearest of the query or its reversal. The features of
+        invariant=True have a few dimensions, where the tree search is
+        fastest.
+        """
+        exclude_self = queries is None
+        queries = self._queries(queries)
+        tree = self._build_tree()
+
+        num = min(k + exclude_self, len(self._members))
+        index = full((len(queries), k), -1, dtype=int)
+        scores = full((len(queries), k), -inf)
+        if num == 0:
+            return index, scores
+
+        with instrument.timer("similarity.tree_top_k"):
+            _, found = tree.query(queries, k=num)
+            if not self.signed and not self.invariant:
+                # the reversed mechanisms score as well
+                _, reversed_found = tree.query(-queries, k=num)
+                found = concatenate([found, reversed_found], axis=-1)
+            found = self._members[found]
+
+            # the exact scores, each event once
+            found.sort(axis=-1)
+            best = einsum('qd,qkd->qk', queries, self.features[found])
+            if not self.signed:
+                best = abs(best)
+            best[:,1:][found[:,1:] == found[:,:-1]] = -inf
+            if exclude_self:
+                best[found == arange(len(queries))[:,newaxis]] = -inf
+
+            order = argsort(-best, axis=-1)[:,:min(k, num - exclude_self)]
+            index[:,:order.shape[1]] = take_along_axis(found, order, -1)
+            scores[:,:order.shape[1]] = take_along_axis(best, order, -1)
+        instrument.count("similarity.queries", len(queries))
+
+        return index, scores
+
+    def pairs(self, threshold):
+        """
+        Every pair of events of the index scoring at least threshold,
+        e.g. the edges of a similarity graph for clustering.
+
+        :rtype i, j, scores: the pairs i < j and their scores.
+        """
+        found = []
+        for start, block in self.blocks():
+            rows, columns = nonzero(block >= threshold)
+            upper = columns > start + rows
+            found.append((start + rows[upper], columns[upper],
+                          block[rows[upper], columns[upper]]))
+
+        if len(found) == 0:
+            return (zeros(0, dtype=int), zeros(0, dtype=int),
+                    zeros(0, dtype=self.dtype))
+        return tuple(concatenate(column) for column in zip(*found))
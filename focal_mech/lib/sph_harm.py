@@ -1,6 +1,11 @@
+from collections import OrderedDict
+
 from numpy import (pi, complex_, empty, mgrid, exp, sin, cos, zeros,
-                   sqrt, mod, amin, amax, where)
-from scipy.special import sph_harm as scipy_sph_harm
+                   sqrt, mod, amin, amax, where, arange, asarray, floor,
+                   array, concatenate, broadcast_arrays, newaxis, abs,
+                   dot, dtype as dtype_, sign, stack, ones, tensordot,
+                   matmul, add)
+from numpy.linalg import eigh
 
 
 def sph_harm(m, l, longi, colat):
@@ -12,40 +17,339 @@ def sph_harm(m, l, longi, colat):
     :param longi: longitude [0,2*pi]
     :param colat: colatitude [0,pi]
     """
-    cordon_shortley = (-1)**m    
+    # scipy is slow to import, only load it when it is used
+    from scipy.special import sph_harm as scipy_sph_harm
+
+    cordon_shortley = (-1)**m
     return cordon_shortley * scipy_sph_harm(m, l, longi, colat)
 
+def real_sph_harm(m, l, longi, colat):
+    """
+    The real spherical harmonic S_lm, see real_sph_harm_matrix.
+    """
+    Y = sph_harm(abs(m), l, longi, colat)
+    if m > 0:
+        return sqrt(2.0) * Y.real
+    elif m < 0:
+        return sqrt(2.0) * Y.imag
+    return Y.real
+
+def sph_harm_modes(lmax):
+    """
+    The (l, m) of each mode up to degree lmax, in the order
+    (0,0), (1,-1), (1,0), (1,1), (2,-2), ..., (lmax,lmax), so that
+    mode (l, m) is at index l*l + l + m.
+
+    Returns:
+    --------
+    :rtype l, m: integer arrays of length (lmax+1)**2
+    """
+    index = arange((lmax+1)**2)
+    l = floor(sqrt(index)).astype(int)
+    m = index - l*l - l
+    return l, m
+
+def sph_harm_matrix(lmax, longi, colat):
+    """
+    Evaluates every sph_harm(m, l, longi, colat) up to degree lmax at
+    once, sharing the trig terms between modes.
+
+    The normalized associated Legendre functions are built degree by
+    degree with the standard recurrences, vectorized over the order m.
+
+    :param lmax: maximum degree
+    :param longi: longitude [0,2*pi]
+    :param colat: colatitude [0,pi]
+
+    Returns:
+    --------
+    :rtype Y: array of shape ((lmax+1)**2,) + longi.shape, the rows are
+              ordered as sph_harm_modes.
+    """
+    longi = asarray(longi, dtype=float)
+    colat = asarray(colat, dtype=float)
+
+    cos_t = cos(colat)
+    sin_t = sin(colat)
+
+    # broadcasts a vector over the modes against the coords
+    col = (-1,) + (1,)*cos_t.ndim
+
+    # exp(i m longi), and (-1)^m for the negative orders
+    phase = exp(1j * arange(lmax+1).reshape(col) * longi)
+    sign = ((-1.0)**arange(lmax+1)).reshape(col)
+
+    # P[m] = sqrt((2l+1)/4pi (l-m)!/(l+m)!) P_l^m(cos(colat)), for the
+    # current degree l and 0 <= m <= l, without the Cordon Shortley phase.
+    P = empty((1,) + cos_t.shape)
+    P[0] = sqrt(1.0 / (4*pi))
+    P_prev = None
+
+    Y = [P * phase[:1]]
+    for l in range(1, lmax+1):
+        P_next = empty((l+1,) + cos_t.shape)
+
+        if l > 1:
+            emm = arange(l-1)
+            a = sqrt((4.0*l*l - 1) / (l*l - emm*emm)).reshape(col)
+            b = sqrt(((l-1.0)**2 - emm*emm) / (4.0*(l-1)**2 - 1)).reshape(col)
+            P_next[:l-1] = a * (cos_t * P[:l-1] - b * P_prev[:l-1])
+
+        P_next[l-1] = sqrt(2.0*l + 1) * cos_t * P[l-1]
+        P_next[l] = sqrt((2.0*l + 1) / (2.0*l)) * sin_t * P[l-1]
+
+        P_prev, P = P, P_next
+
+        positive = P * phase[:l+1]
+        # Y_l,-m = (-1)^m conj(Y_lm)
+        negative = sign[1:l+1] * positive[1:].conjugate()
+        Y.append(negative[::-1])
+        Y.append(positive)
+
+    return concatenate(Y)
+
+def Alm_to_array(Alm, lmax=None):
+    """
+    Packs the spectrum dict into a dense array, ordered as
+    sph_harm_modes, e.g. [Alm[0,0], Alm[1,-1], ..., Alm[2,2]].
+
+    Modes missing from Alm are zero.
+    """
+    if lmax is None:
+        lmax = max(l for l, m in Alm)
+
+    l, m = sph_harm_modes(lmax)
+    return array([Alm.get((li, mi), 0) for li, mi in zip(l, m)],
+                 dtype=complex)
+
+def array_to_Alm(alm):
+    """
+    A dict view, Alm[l,m], of a dense spectrum ordered as
+    sph_harm_modes.
+    """
+    alm = asarray(alm)
+    lmax = int(round(sqrt(alm.shape[0]))) - 1
+    l, m = sph_harm_modes(lmax)
+    return dict(((li, mi), alm[k]) for k, (li, mi) in enumerate(zip(l, m)))
+
 # removes amplitude from a radiation pattern
 def beachball(s):
     maxval= amax(amax(s))
     minval= amin(amin(s))
     return where(s>0,1,0)
 
-def get_sph_harm(resolution=(25,25)):
-    """ Initialize a grid of template harmonic functions
+def real_sph_harm_matrix(lmax, longi, colat):
     """
+    The real spherical harmonics up to degree lmax, ordered as
+    sph_harm_modes,
+
+    S_l0 = Y_l0, S_lm = sqrt(2) Re Y_lm, S_l,-m = sqrt(2) Im Y_lm
+
+    for m > 0, an orthonormal real basis.
+
+    :rtype S: real array of shape ((lmax+1)**2,) + longi.shape
+    """
+    Y = sph_harm_matrix(lmax, longi, colat)
+
+    l, m = sph_harm_modes(lmax)
+    Y = Y[l*l + l + abs(m)]
+    col = (-1,) + (1,)*(Y.ndim - 1)
+    m = m.reshape(col)
+
+    return where(m > 0, sqrt(2.0) * Y.real,
+                 where(m < 0, sqrt(2.0) * Y.imag, Y.real))
+
+def complex_to_real(alm):
+    """
+    The coefficients c of a dense spectrum alm, ordered as
+    sph_harm_modes, in the basis of real_sph_harm_matrix, such that
+    c.dot(S) = alm.dot(Y).real.
+
+    For the spectrum of a real function, Alm[l,-m] = (-1)^m Alm[l,m]*,
+    e.g. the classifier function, c = real_transform(l).dot(alm) per
+    degree and nothing is lost.
+
+    :param alm: (..., (lmax+1)**2) complex
+    :rtype c: (..., (lmax+1)**2) real
+    """
+    alm = asarray(alm)
+    lmax = int(round(sqrt(alm.shape[-1]))) - 1
+    l, m = sph_harm_modes(lmax)
+
+    # the coefficients of Y_l|m| and Y_l-|m|
+    a_pos = alm[...,l*l + l + abs(m)]
+    a_neg = alm[...,l*l + l - abs(m)] * (-1.0)**m
+
+    return where(m > 0, (a_pos.real + a_neg.real) / sqrt(2.0),
+                 where(m < 0, (a_neg.imag - a_pos.imag) / sqrt(2.0),
+                       a_pos.real))
+
+def real_to_complex(c):
+    """
+    The inverse of complex_to_real, the spectrum of the real function
+    c.dot(S) in the complex basis.
+
+    :param c: (..., (lmax+1)**2) real
+    :rtype alm: (..., (lmax+1)**2) complex
+    """
+    c = asarray(c, dtype=float)
+    lmax = int(round(sqrt(c.shape[-1]))) - 1
+    l, m = sph_harm_modes(lmax)
+
+    c_pos = c[...,l*l + l + abs(m)]
+    c_neg = c[...,l*l + l - abs(m)]
+
+    return where(m > 0, (c_pos - 1j*c_neg) / sqrt(2.0),
+                 where(m < 0, (-1.0)**m * (c_pos + 1j*c_neg) / sqrt(2.0),
+                       c_pos + 0j))
+
+def Alm_to_real(Alm, lmax=None):
+    """
+    The spectrum dict in the real basis, a dense real array ordered as
+    sph_harm_modes, see complex_to_real.
+    """
+    return complex_to_real(Alm_to_array(Alm, lmax))
+
+def real_to_Alm(c):
+    """
+    The spectrum dict, Alm[l,m], of real coefficients, see
+    real_to_complex.
+    """
+    return array_to_Alm(real_to_complex(c))
+
+def power_spectrum(alm):
+    """
+    The power of each degree, sum_m |Alm[l,m]|^2, unchanged by
+    rotations of the function, see rotate_spectrum.
+
+    :param alm: (..., (lmax+1)**2) dense spectra ordered as
+                sph_harm_modes, complex or the real coefficients of
+                complex_to_real, which have the same power.
+    :rtype power: (..., lmax+1)
+    """
+    alm = asarray(alm)
+    lmax = int(round(sqrt(alm.shape[-1]))) - 1
+
+    return add.reduceat(abs(alm)**2, arange(lmax+1)**2, axis=-1)
+
+def real_transform(l):
+    """
+    The unitary matrix U taking the spectrum of a real function of
+    degree l, [Alm[l,-l], ..., Alm[l,l]], to the real basis, so that
+    the rotation matrices of the real basis are U.dot(D).dot(U^H).
+    """
+    U = zeros((2*l+1, 2*l+1), dtype=complex)
+    for m in range(-l, l+1):
+        if m > 0:
+            U[l+m,l+m] = 1
+            U[l+m,l-m] = (-1)**m
+        elif m < 0:
+            U[l+m,l-m] = 1j
+            U[l+m,l+m] = -1j * (-1)**m
+        else:
+            U[l,l] = sqrt(2.0)
+
+    return U / sqrt(2.0)
+
+# grids held by _cached_grid, least recently used first
+_grids = OrderedDict()
+
+# bound on the memory held by the cached grids
+GRID_CACHE_BYTES = 256 * 2**20
+
+def _cached_grid(key, build):
+    """
+    The grid for key, from the cache or build(). Least recently used
+    grids are evicted beyond GRID_CACHE_BYTES.
+    """
+    if key in _grids:
+        grid = _grids.pop(key)
+    else:
+        grid = build()
+        for array_ in grid:
+            array_.flags.writeable = False
+
+    _grids[key] = grid
+
+    held = sum(array_.nbytes for grid_ in _grids.values()
+               for array_ in grid_)
+    while held > GRID_CACHE_BYTES and len(_grids) > 1:
+        _, evicted = _grids.popitem(last=False)
+        held -= sum(array_.nbytes for array_ in evicted)
+
+    # views, so reshaping them leaves the cache alone
+    return tuple(array_.view() for array_ in grid)
+
+def clear_grid_cache():
+    _grids.clear()
+
+def _grid_coords(resolution):
     Nlong, Nlati = resolution
-    
+
     longi, lati = mgrid[0:2*pi:(Nlati*1j), 0:pi:(Nlong*1j)]
 
-    longi = longi.ravel()
-    lati = lati.ravel()
-    
-    s_harm = empty(shape=(9,Nlong*Nlati), dtype=complex_)
+    return longi.ravel(), lati.ravel()
 
-    s_harm[0,:] = sph_harm(0, 0, longi, lati)
-    
-    s_harm[1,:] = sph_harm(-1, 1, longi, lati)
-    s_harm[2,:] = sph_harm(0, 1, longi, lati)
-    s_harm[3,:] = sph_harm(1, 1, longi, lati)
-    
-    s_harm[4,:] = sph_harm(-2, 2, longi, lati)
-    s_harm[5,:] = sph_harm(-1, 2, longi, lati)
-    s_harm[6,:] = sph_harm(0, 2, longi, lati)
-    s_harm[7,:] = sph_harm(1, 2, longi, lati)
-    s_harm[8,:] = sph_harm(2, 2, longi, lati)
-    
-    return longi, lati, s_harm
+def get_sph_harm(resolution=(25,25)):
+    """ Initialize a grid of template harmonic functions
+
+    The grid is cached, the same as get_sph_harm_grid.
+    """
+    def build():
+        longi, lati = _grid_coords(resolution)
+        return longi, lati, sph_harm_matrix(2, longi, lati)
+
+    return _cached_grid(("complex", tuple(resolution), 2), build)
+
+def get_sph_harm_grid(resolution=(25,25), lmax=2, dtype=float):
+    """
+    The real spherical harmonics, see real_sph_harm_matrix, over the
+    grid of get_sph_harm. Grids are cached by resolution, degree and
+    dtype, and are read only.
+
+    :param dtype: float32 halves the memory and the time to render.
+
+    Returns:
+    --------
+    :rtype longi, lati: the grid coords, flattened.
+    :rtype S: ((lmax+1)**2, Nlong*Nlati) real array.
+    """
+    def build():
+        longi, lati = _grid_coords(resolution)
+        S = real_sph_harm_matrix(lmax, longi, lati).astype(dtype)
+        return longi, lati, S
+
+    return _cached_grid(("real", tuple(resolution), lmax,
+                         dtype_(dtype).str), build)
+
+def render_mechanisms(coeffs, resolution=(25,25), dtype=float,
+                      basis='complex'):
+    """
+    Evaluates the radiation patterns of many events over the grid of
+    get_sph_harm_grid at once, a single real matrix product.
+
+    Parameters:
+    -----------
+    :param coeffs: (N, (lmax+1)**2) dense spectra of the events, ordered
+                   as sph_harm_modes, see Alm_to_array.
+    :param dtype: dtype of the grid, and of the patterns.
+    :param basis: 'complex', or 'real' for coeffs in the basis of
+                  real_sph_harm_matrix, see complex_to_real.
+
+    Returns:
+    --------
+    :rtype patterns: (N, Nlong*Nlati) the real part of each pattern,
+                     coeffs[i].dot(Z).real for the Z of get_sph_harm.
+    """
+    coeffs = asarray(coeffs)
+    lmax = int(round(sqrt(coeffs.shape[-1]))) - 1
+
+    _, _, S = get_sph_harm_grid(resolution, lmax, dtype)
+
+    if basis == 'complex':
+        coeffs = complex_to_real(coeffs)
+
+    return dot(coeffs.astype(dtype), S)
 
 def WignerD1(alpha, beta, gamma):
     """
@@ -84,6 +388,47 @@ def WignerD1(alpha, beta, gamma):
 
     return D
 
+def _wigner_d2(beta):
+    """
+    The small d matrix, d^2_M'M(beta), with the matrix indices last.
+    """
+    cb = cos(beta)
+    sb = sin(beta)
+
+    d = array([
+        [0.25 * (1 + cb) * (1 + cb),
+         -0.5 * sb * (1 + cb),
+         sqrt(3.0/8.0) * sb * sb,
+         -0.5 * sb * (1 - cb),
+         0.25 * (1 - cb) * (1 - cb)],
+
+        [0.5 * sb * (1 + cb),
+         0.5 * (2.0*cb**2 + cb - 1),
+         -sqrt(3.0/2.0) * sb * cb,
+         -0.5 * (2.0*cb**2 - cb - 1),
+         -0.5 * sb * (1 - cb)],
+
+        [sqrt(3.0/8.0) * sb * sb,
+         sqrt(3.0/2.0) * sb * cb,
+         1.5 * cb * cb - 0.5,
+         -sqrt(3.0/2.0) * sb * cb,
+         sqrt(3.0/8.0) * sb * sb],
+
+        [0.5 * sb * (1 - cb),
+         -0.5 * (2.0*cb**2 - cb - 1),
+         sqrt(3.0/2.0) * sb * cb,
+         0.5 * (2.0*cb**2 + cb - 1),
+         -0.5 * sb * (1 + cb)],
+
+        [0.25 * (1 - cb) * (1 - cb),
+         0.5 * sb * (1 - cb),
+         sqrt(3.0/8.0) * sb * sb,
+         0.5 * sb * (1 + cb),
+         0.25 * (1 + cb) * (1 + cb)]])
+
+    # move the matrix indices last
+    return d.transpose(tuple(range(2, d.ndim)) + (0, 1))
+
 def WignerD2(alpha, beta, gamma):
     """
     Compute the wigner d matrix for l = 2.
@@ -93,56 +438,187 @@ def WignerD2(alpha, beta, gamma):
     :param beta: dip
     :param gamma: -rake
 
+    The angles may be arrays (broadcast against each other), to build
+    a stack of matrices at once.
+
     Returns:
-    :rtype D: D^2_M'M(alpha,beta,gamma) : for -2<=M<= 2
+    :rtype D: D^2_M'M(alpha,beta,gamma) : for -2<=M<= 2, of shape
+              (5,5), or the broadcast shape of the angles + (5,5)
     """
+    alpha, beta, gamma = broadcast_arrays(asarray(alpha, dtype=float),
+                                          asarray(beta, dtype=float),
+                                          asarray(gamma, dtype=float))
 
-    D = zeros([5,5]) * complex(1,0)
+    d = _wigner_d2(beta)
 
-    # exp(-i\alpha), exp(-i\gamma)
-    neialp2 = exp(-complex(0,2)*alpha)
-    neigam2 = exp(-complex(0,2)*gamma)
+    # exp(-i M' alpha) on the rows, exp(-i M gamma) on the columns
+    emm = array([2, 1, 0, -1, -2])
+    row = exp(-1j * alpha[...,newaxis] * emm)
+    column = exp(-1j * gamma[...,newaxis] * emm)
 
-    # exp(-i\alpha), exp(-i\gamma)
-    neialp1 = exp(-complex(0,1)*alpha)
-    neigam1 = exp(-complex(0,1)*gamma)
+    D = row[...,:,newaxis] * d * column[...,newaxis,:]
 
-    # exp(-i\alpha), exp(-i\gamma)
-    peialp1 = exp(complex(0,1)*alpha)
-    peigam1 = exp(complex(0,1)*gamma)
+    return D.conjugate()
 
-    # exp(i\alpha), exp(i\gamma)
-    peialp2 = exp(complex(0,2)*alpha)
-    peigam2 = exp(complex(0,2)*gamma)
-
-    D[0,0] = neialp2 * 0.25 * (1 + cos(beta)) * (1 + cos(beta)) * neigam2
-    D[0,1] = -neialp2 * 0.5 * sin(beta) * (1 + cos(beta)) * neigam1
-    D[0,2] = neialp2 * sqrt(3.0/8.0) * sin(beta) * sin(beta)
-    D[0,3] = -neialp2 * 0.5 * sin(beta) * (1 - cos(beta)) * peigam1
-    D[0,4] = neialp2 * 0.25 * (1 - cos(beta)) * (1 - cos(beta)) * peigam2
-
-    D[1,0] = neialp1 * 0.5 * sin(beta) * (1 + cos(beta)) * neigam2
-    D[1,1] = neialp1 * 0.5 * (2.0*cos(beta)**2 + cos(beta) - 1) * neigam1
-    D[1,2] = -neialp1 * sqrt(3.0/2.0) * sin(beta) * cos(beta) 
-    D[1,3] = -neialp1 * 0.5 * (2.0*cos(beta)**2 - cos(beta) - 1) * peigam1
-    D[1,4] = -neialp1 * 0.5 * sin(beta) * (1 - cos(beta)) * peigam2
-
-    D[2,0] = sqrt(3.0/8.0) * sin(beta) * sin(beta) * neigam2
-    D[2,1] = sqrt(3.0/2.0) * sin(beta) * cos(beta) * neigam1
-    D[2,2] = 1.5 * cos(beta) * cos(beta) - 0.5
-    D[2,3] = -sqrt(3.0/2.0) * sin(beta) * cos(beta) * peigam1
-    D[2,4] = sqrt(3.0/8.0) * sin(beta) * sin(beta) * peigam2
-
-    D[3,0] = peialp1 * 0.5 * sin(beta) * (1 - cos(beta)) * neigam2
-    D[3,1] = -peialp1 * 0.5 * (2.0*cos(beta)**2 - cos(beta) - 1) * neigam1
-    D[3,2] = peialp1 * sqrt(3.0/2.0) * sin(beta) * cos(beta)
-    D[3,3] = peialp1 * 0.5 * (2.0*cos(beta)**2 + cos(beta) - 1) * peigam1
-    D[3,4] = -peialp1 * 0.5 * sin(beta) * (1 + cos(beta)) * peigam2
-
-    D[4,0] = peialp2 * 0.25 * (1 - cos(beta)) * (1 - cos(beta)) * neigam2
-    D[4,1] = peialp2 * 0.5 * sin(beta) * (1 - cos(beta)) * neigam1
-    D[4,2] = peialp2 * sqrt(3.0/8.0) * sin(beta) * sin(beta)
-    D[4,3] = peialp2 * 0.5 * sin(beta) * (1 + cos(beta)) * peigam1
-    D[4,4] = peialp2 * 0.25 * (1 + cos(beta)) * (1 + cos(beta)) * peigam2
+def _real_rotation_terms():
+    """
+    Constants of real_WignerD2. The rotations about z are
+    Re(U diag(exp(i M theta)) U^H), a combination of
+    (1, cos(theta), sin(theta), cos(2 theta), sin(2 theta)), and the
+    rotation about y is Re(U d U^H), linear in the entries of d.
+    """
+    U = real_transform(2)
+    emm = array([2, 1, 0, -1, -2])
+
+    # U[:,k] U[:,k]^H, for each M = emm[k]
+    outer = U[:,newaxis,:] * U.conjugate()[newaxis,:,:]
+
+    Z = zeros((5, 5, 5))
+    for k, M in enumerate(emm):
+        Z[0] += (M == 0) * outer[...,k].real
+        Z[2*abs(M)-1] += (M != 0) * outer[...,k].real
+        Z[2*abs(M)] -= sign(M) * outer[...,k].imag
+
+    # Re(U_ik U*_jl), the y rotation is K.dot(d.ravel())
+    K = (U[:,newaxis,:,newaxis] *
+         U.conjugate()[newaxis,:,newaxis,:]).real.reshape(25, 25)
+
+    return Z, K
+
+_REAL_Z, _REAL_K = _real_rotation_terms()
+
+def _real_z_rotation(theta):
+    trig = stack([ones(theta.shape), cos(theta), sin(theta),
+                  cos(2*theta), sin(2*theta)], axis=-1)
+    return tensordot(trig, _REAL_Z, axes=1)
+
+def real_WignerD2(alpha, beta, gamma):
+    """
+    WignerD2 in the basis of real_sph_harm_matrix, the real rotation
+    matrix real_transform(2).dot(D).dot(real_transform(2)^H), built
+    with real arithmetic only.
+
+    :param alpha, beta, gamma: Euler angles, as in WignerD2.
+    :rtype D: real, of shape (5,5) or the broadcast shape of the
+              angles + (5,5)
+    """
+    alpha, beta, gamma = broadcast_arrays(asarray(alpha, dtype=float),
+                                          asarray(beta, dtype=float),
+                                          asarray(gamma, dtype=float))
+
+    d = _wigner_d2(beta)
+    d = dot(d.reshape(d.shape[:-2] + (25,)), _REAL_K.T)
+    d = d.reshape(d.shape[:-1] + (5, 5))
+
+    return matmul(matmul(_real_z_rotation(alpha), d),
+                  _real_z_rotation(gamma))
+
+# eigen decompositions of J_y, keyed by degree, see _jy_eigen
+_jy = {}
+
+def _jy_eigen(l):
+    """
+    J_y = V diag(w) V^H for degree l, in the basis M = l, ..., -l of
+    WignerD2. The eigenvalues w are -l, ..., l.
+    """
+    if l not in _jy:
+        emm = arange(l, -l-1, -1)
+        # J_+ |l,M> = sqrt(l(l+1) - M(M+1)) |l,M+1>
+        Jp = zeros((2*l+1, 2*l+1))
+        Jp[arange(2*l), arange(1, 2*l+1)] = sqrt(
+            l*(l+1.0) - emm[1:]*(emm[1:] + 1.0))
+        _jy[l] = eigh((Jp - Jp.T) / 2j)
+    return _jy[l]
+
+def wigner_d(l, beta):
+    """
+    The small d matrix, d^l_M'M(beta), for any degree, with the matrix
+    indices last, the rows and columns ordered M = l, ..., -l.
+    wigner_d(2, beta) is _wigner_d2(beta).
+
+    d^l(beta) = exp(-i beta J_y) is the Fourier series
+    V diag(exp(-i beta w)) V^H, from the eigen decomposition of J_y,
+    stable for any degree and a matrix product for many angles.
+    """
+    beta = asarray(beta, dtype=float)
+    w, V = _jy_eigen(l)
+
+    # d is real, the imaginary part is round off.
+    return matmul(V * exp(-1j * beta[...,newaxis,newaxis] * w),
+                  V.conjugate().T).real
+
+def WignerD(l, alpha, beta, gamma):
+    """
+    The Wigner-D matrix for any degree l, WignerD(2, ...) is
+    WignerD2(...).
+
+    :param l: degree
+    :param alpha, beta, gamma: Euler angles, as in WignerD2, arrays
+                               broadcast against each other.
+
+    Returns:
+    --------
+    :rtype D: D^l_M'M(alpha,beta,gamma) : for -l<=M<=l, of shape
+              (2l+1,2l+1), or the broadcast shape of the angles
+              + (2l+1,2l+1)
+    """
+    alpha, beta, gamma = broadcast_arrays(asarray(alpha, dtype=float),
+                                          asarray(beta, dtype=float),
+                                          asarray(gamma, dtype=float))
+
+    d = wigner_d(l, beta)
+
+    emm = arange(l, -l-1, -1)
+    row = exp(-1j * alpha[...,newaxis] * emm)
+    column = exp(-1j * gamma[...,newaxis] * emm)
+
+    D = row[...,:,newaxis] * d * column[...,newaxis,:]
 
     return D.conjugate()
+
+def rotate_spectrum(alm, alpha, beta, gamma):
+    """
+    The spectrum of a rotated function, f(R^T x) for the function f
+    of spectrum alm and R = Rz(alpha) Ry(beta) Rz(gamma), e.g. the
+    template of corr_shear rotated to (strike, dip, -rake).
+
+    Degree by degree it is the product with
+    WignerD(l, -gamma, beta, -alpha).T, with the modes reversed to
+    M = -l ... l. Each degree is rotated without building the matrix,
+    the rotation about y through the eigenvectors of J_y, see
+    wigner_d. The cost is O(lmax^3) per rotation, vectorized over the
+    angles.
+
+    :param alm: (..., (lmax+1)**2) dense spectra, ordered as
+                sph_harm_modes.
+    :param alpha, beta, gamma: Euler angles, broadcast against each
+                               other and the leading axes of alm.
+    :rtype alm: complex, of the broadcast shape + ((lmax+1)**2,)
+    """
+    alm = asarray(alm, dtype=complex)
+    alpha, beta, gamma = broadcast_arrays(asarray(alpha, dtype=float),
+                                          asarray(beta, dtype=float),
+                                          asarray(gamma, dtype=float))
+    lmax = int(round(sqrt(alm.shape[-1]))) - 1
+
+    shape = broadcast_arrays(alm[...,0], alpha)[0].shape
+    rotated = empty(shape + alm.shape[-1:], dtype=complex)
+
+    for l in range(lmax+1):
+        # e.g. the odd degrees of the polarity template
+        if not alm[...,l*l:(l+1)**2].any():
+            rotated[...,l*l:(l+1)**2] = 0
+            continue
+
+        # the modes of degree l, M = -l ... l, reverse the basis of J_y
+        w, V = _jy_eigen(l)
+        V = V[::-1]
+        emm = arange(-l, l+1)
+
+        a = alm[...,l*l:(l+1)**2] * exp(-1j * gamma[...,newaxis] * emm)
+        a = matmul(a, V.conjugate()) * exp(1j * beta[...,newaxis] * w)
+        a = matmul(a, V.T) * exp(-1j * alpha[...,newaxis] * emm)
+
+        rotated[...,l*l:(l+1)**2] = a
+
+    return rotated
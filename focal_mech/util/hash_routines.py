@@ -1,6 +1,14 @@
-from numpy import atleast_2d, sin, cos, hstack, sign, array, pi
+from collections import namedtuple
+
+from numpy import (atleast_2d, sin, cos, hstack, sign, array, pi, zeros,
+                   concatenate, cumsum, deg2rad, stack, asarray, int64,
+                   where)
 from focal_mech.io.read_hash import (parse_phase_file, parse_reverse,
-                                     reverse_polarity)
+                                     reverse_polarity, PhaseBlock)
+
+
+PickBatch = namedtuple("PickBatch", ["event", "coords", "polarity",
+                                     "offsets", "parity", "weight"])
 
         
 def hash_to_classifier(demo_data, parity=1):
@@ -18,16 +26,26 @@ def hash_to_classifier(demo_data, parity=1):
                    momentum.
     """    
 
-    inputs = {}
-    for event, dat in demo_data.items():
+    return dict(iter_hash_to_classifier(demo_data.items(), parity))
+
+def iter_hash_to_classifier(events, parity=1):
+    """
+    hash_to_classifier one event at a time.
+
+    :param events: iterable of (event, data), e.g. read_demo(...).items()
+                   or focal_mech.io.read_hash.iter_demo, to stream a
+                   phase file into the classifier.
+    :param parity: see hash_to_classifier.
+    """
+    for event, dat in events:
         # take off angles need to be "colatitude" measured from
         # Up 0-degrees, Down 180-degrees
         # The other angle needs to be azimuth
         x = atleast_2d(cos(dat[:,0])*sin(dat[:,1]))
         y = atleast_2d(sin(dat[:,0])*sin(dat[:,1]))
         z = atleast_2d(cos(dat[:,1]))
-        
-        classes = atleast_2d(dat[:,2])    
+
+        classes = atleast_2d(dat[:,2])
         if parity != 0:
             x = hstack((x,-x))
             y = hstack((y,-y))
@@ -35,6 +53,140 @@ def hash_to_classifier(demo_data, parity=1):
 
             classes = hstack((classes, sign(parity)*classes))
 
-        inputs[event] = (x, y, z, classes)
-        
-    return inputs
+        yield event, (x, y, z, classes)
+
+def hash_to_batch(events, parity=1, polarity=None, weight=None):
+    """
+    hash_to_classifier for a whole catalog at once, packed in a few
+    flat arrays instead of a dict of small arrays per event.
+
+    The antipodes are not added, the parity is carried along with the
+    picks and the solvers count each pick and its antipode, of class
+    sign(parity) times the polarity, see focal_mech.lib.batch.fit_batch.
+
+    Parameters:
+    -----------
+    :param events: a PhaseBlock of read_phase_columns, the output of
+                   read_demo or an iterable of (event, data) as
+                   iter_demo.
+    :param parity: see hash_to_classifier.
+    :param polarity: for a PhaseBlock, the polarity of each pick, e.g.
+                     reverse_catalog(index, block), by default
+                     block.picks['polarity'].
+    :param weight: the (n_total,) weights of the picks, scaling their
+                   penalty in the fit, or a function of the picks
+                   returning them, e.g. pick_weights. It is passed
+                   block.picks for a PhaseBlock, otherwise the data of
+                   all the events, concatenated. None for unweighted.
+
+    Returns:
+    --------
+    :rtype PickBatch: the event ids, the (n_total, 3) cartesian coords
+                      and the (n_total,) polarities of the picks of
+                      all the events, the picks of event k are
+                      offsets[k]:offsets[k+1], the parity and the
+                      (n_total,) weights or None.
+    """
+    if isinstance(events, PhaseBlock):
+        azimuth = deg2rad(events.picks['azimuth'].astype(float))
+        takeoff = deg2rad(events.picks['takeoff'].astype(float))
+        if polarity is None:
+            polarity = events.picks['polarity']
+        event = asarray(events.event)
+        offsets = asarray(events.offsets, dtype=int64)
+        picks = events.picks
+    else:
+        if isinstance(events, dict):
+            events = events.items()
+        items = list(events)
+
+        event = array([item[0] for item in items])
+        offsets = zeros(len(items) + 1, dtype=int64)
+        offsets[1:] = cumsum([len(data) for _, data in items])
+
+        width = max([data.shape[-1] for _, data in items] + [3])
+        picks = concatenate([data for _, data in items] +
+                            [zeros((0, width))])
+        azimuth, takeoff, polarity = picks[:,0], picks[:,1], picks[:,2]
+
+    if callable(weight):
+        weight = weight(picks)
+    if weight is not None:
+        weight = asarray(weight, dtype=float)
+
+    # the takeoff angle is the colatitude, see hash_to_classifier
+    coords = stack([cos(azimuth)*sin(takeoff), sin(azimuth)*sin(takeoff),
+                    cos(takeoff)], axis=-1)
+
+    return PickBatch(event, coords, asarray(polarity, dtype=float),
+                     offsets, parity, weight)
+
+def pick_weights(picks, quality_weight=0.5, max_quality=None,
+                 angle_error=None):
+    """
+    Weights of the picks from their quality and the uncertainty of
+    their angles, see hash_to_batch.
+
+    A pick of quality q, 0 the best, weighs quality_weight**q, and
+    nothing above max_quality, so the low quality picks are dropped in
+    the fit rather than filtered beforehand. With angle_error, the
+    weight is also scaled by
+
+        angle_error**2 / (angle_error**2 + sigma**2)
+
+    sigma the uncertainty of the pick on the focal sphere, from the
+    takeoff and azimuth uncertainties, the azimuth counting as
+    sin(takeoff). A pick uncertain by angle_error keeps half its
+    weight.
+
+    Parameters:
+    -----------
+    :param picks: a structured array of PICK_DTYPE, e.g. the picks of
+                  a PhaseBlock, or (n, 7) data of read_demo with
+                  full=True, see DEMO_COLUMNS.
+    :param quality_weight: the weight of each step down in quality.
+    :param max_quality: the lowest quality kept, all by default.
+    :param angle_error: in degrees, by default the uncertainties are
+                        not used.
+
+    Returns:
+    --------
+    :rtype weight: (n,) in [0, 1].
+    """
+    if getattr(picks, "dtype", None) is not None and picks.dtype.names:
+        quality = picks['quality'].astype(float)
+        takeoff = deg2rad(picks['takeoff'].astype(float))
+        takeoff_error = deg2rad(picks['takeoff_error'].astype(float))
+        azimuth_error = deg2rad(picks['azimuth_error'].astype(float))
+    else:
+        picks = asarray(picks, dtype=float)
+        quality, takeoff = picks[:,3], picks[:,1]
+        takeoff_error, azimuth_error = picks[:,5], picks[:,6]
+
+    weight = quality_weight ** quality
+    if max_quality is not None:
+        weight = where(quality > max_quality, 0.0, weight)
+
+    if angle_error is not None:
+        scale = deg2rad(angle_error)**2
+        sigma = takeoff_error**2 + (sin(takeoff) * azimuth_error)**2
+        weight = weight * scale / (scale + sigma)
+
+    return weight
+
+def iter_batch_to_classifier(batch):
+    """
+    The inputs of hash_to_classifier for each event of a PickBatch,
+    with the antipodes added, e.g. for classify with solver='svc'.
+    """
+    for k, event in enumerate(batch.event):
+        start, end = batch.offsets[k], batch.offsets[k+1]
+        x, y, z = batch.coords[start:end].T
+        classes = batch.polarity[start:end]
+
+        if batch.parity != 0:
+            x, y, z = (concatenate((x, -x)), concatenate((y, -y)),
+                       concatenate((z, -z)))
+            classes = concatenate((classes, sign(batch.parity)*classes))
+
+        yield event, (x[None], y[None], z[None], classes[None])
@@ -0,0 +1,434 @@
+"""
+Fit focal mechanisms as a long running service. The picks stream in as
+the lines of a HASH phase file, on stdin or a local socket, and each
+event is fit once its closing line arrives, its mechanism written out
+as a line of JSON.
+
+    python -m focal_mech.util.service [--reverse FILE] [--socket PATH]
+
+The lookup table of the double couple search, the harmonic grid of the
+nodal lines and the station reversal index are loaded once, at start
+up. Events are fit in batches, see fit_events, in worker processes. The
+queue of events waiting for a fit is bounded, when the fits fall behind
+it fills and the streams are not read until there is room again.
+
+Requires Python 3.7 or later.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from numpy import log10, floor, zeros, cumsum, searchsorted, rad2deg, nan
+
+from focal_mech.io.read_hash import (PhaseParser, event_data,
+                                     load_reversal_index)
+from focal_mech.lib.batch import fit_events
+from focal_mech.lib.sph_harm import (Alm_to_array, complex_to_real,
+                                     get_sph_harm_grid)
+from focal_mech.lib.rotation_table import load_shear_table
+from focal_mech.lib.nodal import nodal_lines
+
+
+# closed, the closing line read; queue, waiting for a fit; fit, the
+# batch in the worker; emit, writing the result
+STAGES = ["queue", "fit", "emit", "total"]
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in log spaced bins, per_decade bins a decade
+    between low and high seconds, with a bin each for the latencies
+    under and over.
+    """
+    def __init__(self, low=1e-5, high=1e2, per_decade=10):
+        self.low = low
+        self.per_decade = per_decade
+        num_bins = int(round(per_decade * log10(high / low)))
+        self.counts = zeros(num_bins + 2, dtype=int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        k = 0
+        if seconds >= self.low:
+            k = int(floor(self.per_decade * log10(seconds / self.low))) + 1
+        self.counts[min(k, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        The upper edge of the bin holding the q quantile, in seconds.
+        """
+        if self.count == 0:
+            return nan
+        k = searchsorted(cumsum(self.counts), q * self.count)
+        if k == len(self.counts) - 1:
+            return self.max
+        return min(self.low * 10**(k / float(self.per_decade)), self.max)
+
+    def summary(self):
+        """
+        The count, and the mean, quantiles and max in milliseconds.
+        """
+        if self.count == 0:
+            return dict(count=0)
+        return dict(count=self.count,
+                    mean_ms=1e3 * self.total / self.count,
+                    p50_ms=1e3 * self.quantile(0.5),
+                    p90_ms=1e3 * self.quantile(0.9),
+                    p99_ms=1e3 * self.quantile(0.99),
+                    max_ms=1e3 * self.max)
+
+# the options and resolution of each worker, see _warm
+_worker = {}
+
+def _warm(options, resolution):
+    """
+    Load the lookup table, and the harmonic grid of the nodal lines,
+    once per worker.
+    """
+    _worker["options"] = dict(options, table=load_shear_table())
+    _worker["resolution"] = resolution
+    if resolution is not None:
+        get_sph_harm_grid(resolution)
+
+def _ready():
+    return True
+
+def _record(result, num_picks, resolution):
+    """
+    The JSON record of an EventResult.
+    """
+    record = dict(event=int(result.event), picks=num_picks)
+    if result.Alm is None:
+        record["double_couple"] = None
+        return record
+
+    strike, dip, rake = [float(a) for a in result.double_couple]
+    coeffs = complex_to_real(Alm_to_array(result.Alm, 2))
+    record.update(double_couple=dict(strike=strike, dip=dip, rake=rake),
+                  score=float(result.score),
+                  accuracy=float(result.accuracy),
+                  coeffs=[float(c) for c in coeffs])
+
+    if resolution is not None:
+        # (azimuth, colatitude) in degrees
+        record["nodal_lines"] = [rad2deg(line).round(2).tolist()
+                                 for line in nodal_lines(result.Alm,
+                                                         resolution)]
+    return record
+
+def _fit_batch(items):
+    """
+    The JSON records of a batch of (event, data), fit in a worker.
+    """
+    results = fit_events(items, **_worker["options"])
+    return [_record(result, len(data), _worker["resolution"])
+            for result, (_, data) in zip(results, items)]
+
+class _StdoutWriter(object):
+    """
+    stdout, with the write and drain of an asyncio.StreamWriter.
+    """
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+
+    async def drain(self):
+        sys.stdout.flush()
+
+    def close(self):
+        sys.stdout.flush()
+
+class Service(object):
+    """
+    Parse streams of phase lines and fit their events, see the module
+    docs.
+
+    Parameters:
+    -----------
+    :param reverse: the station polarity reversal file, if given the
+                    polarities are reversed.
+    :param processes: the number of worker processes, 0 fits in a
+                      thread of this process.
+    :param batch_size: the most events fit at once.
+    :param queue_size: the most events waiting for a fit.
+    :param resolution: of the grid of the nodal lines, see nodal_lines,
+                       if given the lines are part of each record.
+    :param parity: see hash_to_classifier.
+    :param kernel_coeff, C: of the degree 2 kernel classifier.
+    """
+    def __init__(self, reverse=None, processes=1, batch_size=32,
+                 queue_size=256, resolution=None, parity=1, kernel_coeff=1,
+                 C=1.0):
+        self.index = None
+        if reverse is not None:
+            self.index = load_reversal_index(reverse)
+
+        options = dict(parity=parity, kernel_coeff=kernel_coeff, C=C)
+        self.processes = processes
+        if processes > 0:
+            self.executor = ProcessPoolExecutor(
+                processes, initializer=_warm, initargs=(options, resolution))
+        else:
+            _warm(options, resolution)
+            self.executor = ThreadPoolExecutor(1)
+
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # a batch being fit by each worker, and one more waiting
+        self.max_batches = max(processes, 1) + 1
+
+        self.histograms = dict((stage, LatencyHistogram())
+                               for stage in STAGES)
+        self.events = 0
+        self.errors = 0
+
+        # the events of each writer not yet written
+        self._pending = {}
+        self._idle = {}
+        self.queue = None
+
+    def stats(self):
+        """
+        The counts, and a summary of the latency of each stage.
+        """
+        return dict(events=self.events, errors=self.errors,
+                    queued=self.queue.qsize() if self.queue else 0,
+                    latency=dict((stage, self.histograms[stage].summary())
+                                 for stage in STAGES))
+
+    async def start(self):
+        """
+        Create the queue, start the workers and load them.
+        """
+        self.queue = asyncio.Queue(self.queue_size)
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, _ready)
+                               for _ in range(max(self.processes, 1))])
+
+    def _write(self, writer, record):
+        writer.write((json.dumps(record) + "\n").encode())
+
+    def _done(self, writer):
+        self._pending[writer] -= 1
+        if self._pending[writer] == 0:
+            self._idle[writer].set()
+
+    async def read(self, readline, writer):
+        """
+        Queue the events of a stream of phase lines, their records
+        written to writer. A malformed line is reported, and its event
+        dropped.
+
+        :param readline: coroutine function returning the next line,
+                         empty at the end of the stream.
+        :param writer: with the write and drain of an
+                       asyncio.StreamWriter.
+        """
+        self._pending[writer] = 0
+        self._idle[writer] = asyncio.Event()
+        self._idle[writer].set()
+
+        parser = PhaseParser()
+        skip = False
+        lineno = 0
+        while True:
+            line = await readline()
+            if not line:
+                break
+            if isinstance(line, bytes):
+                line = line.decode("ascii", "replace")
+            lineno += 1
+
+            if skip:
+                # the rest of a dropped event
+                skip = bool(line.strip()) and line[0] != " "
+                continue
+
+            try:
+                closed = parser.feed(line)
+            except (ValueError, IndexError) as err:
+                self.errors += 1
+                self._write(writer, dict(event=parser.event,
+                                         error="line %d: %s" % (lineno, err)))
+                parser = PhaseParser()
+                skip = True
+                continue
+
+            if closed is not None:
+                data = event_data(closed.picks, closed.time, self.index)
+                self._pending[writer] += 1
+                self._idle[writer].clear()
+                # waits here while the queue is full
+                await self.queue.put((writer, closed.event, closed.time,
+                                      data, time.time()))
+
+        if parser.event is not None:
+            self.errors += 1
+            self._write(writer, dict(event=parser.event,
+                                     error="unexpected end of stream"))
+
+        await self._idle[writer].wait()
+        del self._pending[writer], self._idle[writer]
+
+    async def fit(self):
+        """
+        Fit the queued events in batches, until cancelled.
+        """
+        slots = asyncio.Semaphore(self.max_batches)
+        while True:
+            await slots.acquire()
+            batch = [await self.queue.get()]
+            # the events queued while the workers were busy
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            asyncio.ensure_future(self._fit_batch(batch, slots))
+
+    async def _fit_batch(self, batch, slots):
+        loop = asyncio.get_event_loop()
+        dispatched = time.time()
+        items = [(event, data) for _, event, _, data, _ in batch]
+        try:
+            records = await loop.run_in_executor(self.executor, _fit_batch,
+                                                 items)
+        except Exception as err:
+            records = [dict(event=int(event), error=str(err))
+                       for event, _ in items]
+            self.errors += len(items)
+        finally:
+            slots.release()
+        fitted = time.time()
+
+        writers = []
+        for (writer, _, t, _, closed), record in zip(batch, records):
+            record["time"] = t
+            self._write(writer, record)
+            if writer not in writers:
+                writers.append(writer)
+
+        for writer in writers:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+        emitted = time.time()
+        for writer, _, _, _, closed in batch:
+            self.histograms["queue"].add(dispatched - closed)
+            self.histograms["fit"].add(fitted - dispatched)
+            self.histograms["emit"].add(emitted - fitted)
+            self.histograms["total"].add(emitted - closed)
+            self.events += 1
+            self._done(writer)
+
+    async def _report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            sys.stderr.write(json.dumps(self.stats()) + "\n")
+
+    async def run_stdin(self, stats_interval=None):
+        """
+        Fit the events of the phase lines on stdin, writing the records
+        to stdout.
+        """
+        await self.start()
+        tasks = [asyncio.ensure_future(self.fit())]
+        if stats_interval:
+            tasks.append(asyncio.ensure_future(self._report(stats_interval)))
+
+        loop = asyncio.get_event_loop()
+        lines = ThreadPoolExecutor(1)
+
+        async def readline():
+            return await loop.run_in_executor(lines, sys.stdin.readline)
+
+        try:
+            await self.read(readline, _StdoutWriter())
+        finally:
+            for task in tasks:
+                task.cancel()
+            lines.shutdown()
+
+    async def _handle(self, reader, writer):
+        try:
+            await self.read(reader.readline, writer)
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, port=None, stats_interval=None):
+        """
+        Fit the events of each connection to a unix socket at path, or
+        to a TCP port of localhost, writing the records back to it.
+        """
+        await self.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, "127.0.0.1",
+                                                port)
+
+        tasks = [asyncio.ensure_future(self.fit())]
+        if stats_interval:
+            tasks.append(asyncio.ensure_future(self._report(stats_interval)))
+
+        try:
+            await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            server.close()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fit the events of a stream of HASH phase lines, "
+                    "writing their mechanisms as lines of JSON.")
+    parser.add_argument("--socket", help="listen on this unix socket, "
+                        "otherwise read stdin")
+    parser.add_argument("--port", type=int, help="listen on this TCP port "
+                        "of localhost, otherwise read stdin")
+    parser.add_argument("--reverse", help="the station polarity reversal "
+                        "file")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes, 0 fits in this process")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--nodal-lines", type=int, nargs=2, default=None,
+                        metavar=("NLONG", "NLATI"),
+                        help="add the nodal lines on a grid of this size")
+    parser.add_argument("--stats-interval", type=float, default=None,
+                        help="seconds between the stats written to stderr")
+    parser.add_argument("--parity", type=int, default=1)
+    parser.add_argument("-C", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    resolution = None
+    if args.nodal_lines is not None:
+        resolution = tuple(args.nodal_lines)
+
+    service = Service(args.reverse, args.processes, args.batch_size,
+                      args.queue_size, resolution, args.parity, C=args.C)
+
+    if args.socket is not None or args.port is not None:
+        run = service.serve(args.socket, args.port, args.stats_interval)
+    else:
+        run = service.run_stdin(args.stats_interval)
+
+    try:
+        asyncio.run(run)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+        sys.stderr.write(json.dumps(service.stats()) + "\n")
+
+if __name__ == "__main__":
+    main()
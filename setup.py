@@ -6,8 +6,11 @@ setup(name = "focal_mech",
       author_email = "blasscoc@gmail.com",
       description = ("An Earthquake classifier."),
       packages=find_packages(),
-      install_requires = ['numpy', 'scipy', 'matplotlib',
-                          'mplstereonet',
-                          'obspy'])
+      install_requires = ['numpy'],
+      # scipy for corr_shear and sph_harm, scikit-learn for the svc
+      # solver, matplotlib and mplstereonet for the demos
+      extras_require = {'full': ['scipy', 'scikit-learn'],
+                        'demo': ['scipy', 'scikit-learn', 'matplotlib',
+                                 'mplstereonet']})
 
 